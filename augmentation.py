@@ -0,0 +1,224 @@
+"""
+data augmentations performed on whole batches (on the training device),
+instead of one sample at a time in `CPSC2021.__getitem__`
+"""
+
+from typing import Optional, Tuple, NoReturn
+
+import numpy as np
+import torch
+from torch import Tensor
+import torch.nn.functional as F
+from easydict import EasyDict as ED
+
+
+__all__ = [
+    "BatchAugmenter",
+]
+
+
+class BatchAugmenter(object):
+    """ finished, NOT checked,
+
+    batch-level counterpart of the per-sample data augmentations of `CPSC2021`,
+    for the tasks "qrs_detection", "main" and "multi_task", including
+    random flip (sign), random (per-sample-per-lead) re-normalization, and label smoothing,
+    with random numbers drawn from a (seeded) generator,
+    and optionally the stretch-or-compress, ref. `self.stretch_compress`
+    """
+    __name__ = "BatchAugmenter"
+
+    def __init__(self, config:ED, task:str, seed:Optional[int]=None) -> NoReturn:
+        """
+
+        Parameters
+        ----------
+        config: dict,
+            training configurations, ref. `cfg.TrainCfg`
+        task: str,
+            the task, one of "qrs_detection", "main", "multi_task"
+        seed: int, optional,
+            seed of the generator of the random numbers,
+            defaults to `config.augmentation_seed`, and if it is also None,
+            the generator is seeded non-deterministically
+        """
+        self.config = config
+        self.task = task
+        assert self.task in ["qrs_detection", "main", "multi_task",], \
+            f"batch augmentation is not implemented for task \042{self.task}\042"
+        self.n_classes = len(self.config[self.task].classes)
+        self.flip = torch.as_tensor(self.config.flip, dtype=torch.float32)
+        self.seglen = self.config[self.task].input_len
+        # the same as the `stretch_compress_choices` of `CPSC2021`
+        self.sc_choices = torch.as_tensor(
+            [-1,1] + [0] * int(2/self.config.stretch_compress_prob - 2), dtype=torch.float64
+        )
+        self._boundary_kernel = None
+        self.generator = torch.Generator()
+        seed = seed if seed is not None else self.config.get("augmentation_seed", None)
+        if seed is None:
+            self.generator.seed()
+        else:
+            self.generator.manual_seed(seed)
+
+    def __call__(self, signals:Tensor, labels:Tensor) -> Tuple[Tensor, Tensor]:
+        """
+
+        Parameters
+        ----------
+        signals: Tensor,
+            the batch of signals, of shape (batch_size, n_leads, seq_len)
+        labels: Tensor,
+            the batch of labels, of shape (batch_size, label_len, n_classes)
+
+        Returns
+        -------
+        signals, labels: Tensor,
+            the augmented signals and labels, on the same device as the inputs
+        """
+        batch_size, n_leads, _ = signals.shape
+        if len(self.flip) > 0:
+            sign = self.flip[torch.randint(len(self.flip), (batch_size,), generator=self.generator)]
+            signals = signals * sign.to(device=signals.device, dtype=signals.dtype).view(-1, 1, 1)
+        if self.config.random_normalize:
+            rn_mean = self._uniform(self.config.random_normalize_mean, (batch_size, n_leads, 1))
+            rn_std = self._uniform(self.config.random_normalize_std, (batch_size, n_leads, 1))
+            rn_mean = rn_mean.to(device=signals.device, dtype=signals.dtype)
+            rn_std = rn_std.to(device=signals.device, dtype=signals.dtype)
+            # the same as `normalize(..., per_channel=True)` of `utils.utils_signal`
+            eps = 1e-7
+            std, mean = torch.std_mean(signals, dim=-1, unbiased=False, keepdim=True)
+            signals = (signals - mean) / (std + eps) * rn_std + rn_mean
+        if self.config.label_smoothing > 0:
+            labels = (1 - self.config.label_smoothing) * labels \
+                + self.config.label_smoothing / (1 + self.n_classes)
+        return signals, labels
+
+    def _uniform(self, bounds:Tuple[float, float], shape:Tuple[int, ...]) -> Tensor:
+        """
+        """
+        low, high = bounds
+        return low + (high - low) * torch.rand(shape, generator=self.generator)
+
+    def stretch_compress(self,
+                         ext_data:Tensor,
+                         rpeaks_mask:Tensor,
+                         af_mask:Tensor,
+                         offset:Tensor) -> Tuple[Tensor, Tensor, Optional[Tensor]]:
+        """ finished, NOT checked,
+
+        stretch or compress (with probability `stretch_compress_prob`) the segments of a batch
+        via linear interpolation (nearest for the masks), with the rpeaks remapped,
+        and generate the labels (and weight masks for the task "main") of the resulting segments,
+        in accordance with the offline stretch-or-compress of `CPSC2021._build_segment`
+
+        Parameters
+        ----------
+        ext_data: Tensor,
+            the extended windows, of shape (batch_size, n_leads, ext_len),
+            ref. `CPSC2021._load_extended_segment`
+        rpeaks_mask: Tensor,
+            masks being 1 at the rpeaks, of shape (batch_size, ext_len)
+        af_mask: Tensor,
+            masks of af episodes, of shape (batch_size, ext_len)
+        offset: Tensor,
+            start indices of the segments in the extended windows, of shape (batch_size,)
+
+        Returns
+        -------
+        signals: Tensor,
+            the segments, of shape (batch_size, n_leads, seglen)
+        labels: Tensor,
+            the labels, of shape (batch_size, label_len, 1),
+            or (batch_size, label_len, 2) for the task "multi_task" (qrs labels and af labels)
+        weight_masks: Tensor or None,
+            the weight masks (of the af labels), of shape (batch_size, label_len, 1),
+            None for the task "qrs_detection"
+        """
+        device, dtype = ext_data.device, ext_data.dtype
+        batch_size, n_leads, ext_len = ext_data.shape
+        # random ratios, and the windows (centered at the original segments) to be resampled
+        sign = self.sc_choices[torch.randint(len(self.sc_choices), (batch_size,), generator=self.generator)]
+        low, high = self.config.stretch_compress / 4, self.config.stretch_compress
+        sc_ratio = 1 + (self._uniform((low, high), (batch_size,)).double() * sign) / 100
+        sc_len = torch.round(sc_ratio * self.seglen)
+        sc_ratio = sc_len / self.seglen
+        start = offset.cpu().double() + torch.div(self.seglen - sc_len, 2, rounding_mode="floor")
+        start = torch.minimum(torch.clamp(start, min=0), ext_len - sc_len)
+        pos = start.unsqueeze(1) + torch.arange(self.seglen, dtype=torch.float64).unsqueeze(0) * sc_ratio.unsqueeze(1)
+        pos = pos.to(device)
+
+        # signals, via linear interpolation
+        idx0 = torch.clamp(torch.floor(pos), 0, ext_len - 1).long()
+        idx1 = torch.clamp(idx0 + 1, max=ext_len - 1)
+        frac = (pos - idx0).to(dtype).unsqueeze(1)
+        idx0 = idx0.unsqueeze(1).expand(-1, n_leads, -1)
+        idx1 = idx1.unsqueeze(1).expand(-1, n_leads, -1)
+        signals = (1 - frac) * ext_data.gather(-1, idx0) + frac * ext_data.gather(-1, idx1)
+
+        masks = []
+        if self.task in ["qrs_detection", "multi_task",]:
+            # remap the rpeaks, and re-generate the qrs masks (of fixed width)
+            sample_idx, rpeaks = torch.nonzero(rpeaks_mask, as_tuple=True)
+            rpeaks = rpeaks.double() - start.to(device)[sample_idx]
+            keep = (rpeaks >= self.config.rpeaks_dist2border) \
+                & (rpeaks < self.seglen - self.config.rpeaks_dist2border)
+            sample_idx = sample_idx[keep]
+            rpeaks = torch.round(rpeaks[keep] / sc_ratio.to(device)[sample_idx]).long()
+            mask = torch.zeros((batch_size, self.seglen), dtype=dtype, device=device)
+            for bias in range(-self.config.qrs_mask_bias, self.config.qrs_mask_bias):
+                pos_bias = rpeaks + bias
+                valid = (pos_bias >= 0) & (pos_bias < self.seglen)
+                mask[sample_idx[valid], pos_bias[valid]] = 1
+            masks.append(mask)
+        if self.task in ["main", "multi_task",]:
+            masks.append(af_mask.to(dtype).gather(-1, torch.clamp(torch.round(pos), 0, ext_len - 1).long()))
+        mask = torch.stack(masks, dim=-1)  # (batch_size, seglen, n_masks)
+
+        if self.config[self.task].model_name == "unet":
+            labels = mask
+        else:  # "seq_lab", a label is 1 only if the whole block is 1, ref. `dataset._reduce_mask`
+            reduction = self.config[self.task].reduction
+            n_blocks = self.seglen // reduction
+            labels = mask[:, :n_blocks*reduction].reshape(batch_size, n_blocks, reduction, -1).amin(dim=2)
+
+        weight_masks = None
+        if self.task in ["main", "multi_task",]:
+            weight_masks = self._generate_weight_mask(labels[..., -1])
+        return signals, labels, weight_masks
+
+    def _generate_weight_mask(self, labels:Tensor) -> Tensor:
+        """ finished, NOT checked,
+
+        batched version of `dataset._generate_weight_mask` for the task "main",
+        with the gaussians at the boundaries summed via one convolution
+
+        Parameters
+        ----------
+        labels: Tensor,
+            the (binary) labels, of shape (batch_size, label_len)
+
+        Returns
+        -------
+        weight_masks: Tensor,
+            the weight masks, of shape (batch_size, label_len, 1)
+        """
+        fg_weight, boundary_weight, radius = 2, 5, 0.8
+        label_len = labels.shape[-1]
+        if self._boundary_kernel is None or self._boundary_kernel.device != labels.device \
+                or self._boundary_kernel.dtype != labels.dtype:
+            sigma = int((radius * self.config.fs) / self.config[self.task].reduction)
+            # values beyond 6 sigma are below 1e-15
+            half_width = min(label_len - 1, int(np.ceil(6 * sigma)))
+            dist = torch.arange(-half_width, half_width + 1, dtype=torch.float64)
+            self._boundary_kernel = torch.exp(-dist.pow(2) / sigma**2).to(
+                device=labels.device, dtype=labels.dtype
+            ).view(1, 1, -1)
+        half_width = self._boundary_kernel.shape[-1] // 2
+        weight_masks = 1 + (fg_weight - 1) * (labels > 0.5).to(labels.dtype)
+        border = torch.zeros_like(labels)
+        border[:, :-1] = (labels[:, 1:] != labels[:, :-1]).to(labels.dtype)
+        weight_masks = weight_masks + boundary_weight * F.conv1d(
+            border.unsqueeze(1), self._boundary_kernel, padding=half_width,
+        ).squeeze(1)
+        return weight_masks.unsqueeze(-1)
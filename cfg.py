@@ -36,6 +36,7 @@ __all__ = [
     "TrainCfg",
     "ModelCfg",
     "PlotCfg",
+    "SweepCfg",
 ]
 
 
@@ -87,6 +88,15 @@ TrainCfg.model_dir = BaseCfg.model_dir
 TrainCfg.checkpoints = os.path.join(_BASE_DIR, "checkpoints")
 os.makedirs(TrainCfg.checkpoints, exist_ok=True)
 TrainCfg.keep_checkpoint_max = 20
+# checkpoints are snapshotted into CPU memory, and written to disk by a background thread
+TrainCfg.async_checkpoint = True
+# policy of saving the checkpoints of the epochs, "all", or
+# "best" (only those of the epochs improving the monitored metric)
+TrainCfg.checkpoint_policy = "all"
+# number of steps between mid-epoch checkpoints (of the latest step, overwritten), 0 to disable
+TrainCfg.checkpoint_step = 0
+# path of the checkpoint to resume training from
+TrainCfg.resume = None
 
 TrainCfg.debug = True
 
@@ -114,6 +124,22 @@ TrainCfg.qrs_mask_bias = int(0.075 * TrainCfg.fs)  # bias to rpeaks
 
 TrainCfg.normalize_data = True
 
+# storage of the sliced segments, "shards" (packed memory-mapped arrays, one directory per subject),
+# or "mat" (two .mat files per segment, the legacy format)
+TrainCfg.segment_storage = "shards"
+# if True, segments are stored as (start_idx, end_idx, sc_ratio) triples only,
+# and are built on the fly from the memory-mapped preprocessed records,
+# with the random ones (stretch-or-compress, around critical points) regenerated every epoch
+TrainCfg.virtual_segments = False
+# base seed of the per-record random states for slicing segments and rr sequences,
+# so that the parallel persistence yields the same output as the serial one
+TrainCfg.persistence_seed = 0
+# maximum number of cached weight masks (per DataLoader worker), 0 for no caching
+TrainCfg.weight_mask_cache_size = 8192
+# if True, for the task "rr_lstm", all rr sequences of a split are packed into one memory-mapped array,
+# with weight masks precomputed, and batches are fetched by whole slices
+TrainCfg.rr_seq_packed = True
+
 # data augmentation
 
 TrainCfg.label_smoothing = 0.1
@@ -148,12 +174,27 @@ TrainCfg.random_normalize_std = [0.08, 0.32]
 # ])
 
 TrainCfg.flip = [-1] + [1]*4  # making the signal upside down, with probability 1/(1+4)
+# if True, the above flip, random normalization and label smoothing for the tasks "qrs_detection" and "main"
+# are performed by `trainer.train` on whole batches on the training device (ref. `augmentation.BatchAugmenter`),
+# rather than on each sample in `CPSC2021.__getitem__`,
+# other consumers of `CPSC2021` (notebooks, etc.) still get the per-sample augmentations
+TrainCfg.batch_augmentation = True
+TrainCfg.augmentation_seed = None  # seed of the generator of `BatchAugmenter`, None for non-deterministic
+# if True (and with `virtual_segments` and `batch_augmentation`), the stretch-or-compress is performed
+# on whole batches via linear interpolation, freshly drawn for every batch,
+# instead of offline via FFT resampling at the time of slicing the segments
+TrainCfg.online_stretch_compress = True
 # TODO: explore and add more data augmentations
 
 # configs of training epochs, batch, etc.
 TrainCfg.n_epochs = 20
 TrainCfg.batch_size = 64
 TrainCfg.train_ratio = 0.8
+TrainCfg.num_workers = 4  # number of worker processes of the data loaders
+
+# distributed training launched via `torchrun`, ref. `trainer._init_distributed`
+TrainCfg.dist_backend = "gloo"  # "gloo" for CPU-only machines
+TrainCfg.dist_seed = 0  # seed shared by all processes, for the samplers and the virtual segments
 
 # configs of optimizers and lr_schedulers
 TrainCfg.train_optimizer = "adamw_amsgrad"  # "sgd", "adam", "adamw"
@@ -179,6 +220,13 @@ TrainCfg.loss = "BCEWithLogitsLoss"
 TrainCfg.flooding_level = 0.0  # flooding performed if positive
 
 TrainCfg.log_step = 20
+# time of the phases of the training steps (waiting for data, host-to-device copy, forward, backward, optimizer step),
+# and the throughput, logged every `log_step` steps, ref. `instrumentation.StepTimer`,
+# NOTE that cuda is synchronized at the boundaries of the phases if on cuda,
+# which slows down training, hence disabled by default
+TrainCfg.step_timing = False
+# (global) steps [start, end] to capture a profile via `torch.profiler`, None to disable
+TrainCfg.profile_steps = None
 TrainCfg.eval_every = 20
 
 # tasks of training
@@ -186,6 +234,7 @@ TrainCfg.tasks = [
     "qrs_detection",
     "rr_lstm",
     "main",
+    "multi_task",  # qrs detection and the main task, by one model with a shared backbone
 ]
 
 # configs of model selection
@@ -229,6 +278,42 @@ TrainCfg.main.classes = ["af",]
 TrainCfg.main.monitor = "neg_masked_bce"  # "main_score", "neg_masked_bce"  # monitor for determining the best model
 TrainCfg.main.loss = "MaskedBCEWithLogitsLoss"
 
+# one shared backbone with two sequence labelling heads, the qrs head and the af head,
+# trained on the same segments, with the qrs masks and the af masks as labels
+TrainCfg.multi_task.final_model_name = None
+TrainCfg.multi_task.model_name = "seq_lab"
+TrainCfg.multi_task.reduction = 8
+TrainCfg.multi_task.cnn_name = "multi_scopic"
+TrainCfg.multi_task.rnn_name = "lstm"  # "none", "lstm"
+TrainCfg.multi_task.attn_name = "se"  # "none", "se", "gc", "nl"
+TrainCfg.multi_task.input_len = int(30*TrainCfg.fs)
+TrainCfg.multi_task.overlap_len = int(15*TrainCfg.fs)
+TrainCfg.multi_task.critical_overlap_len = int(25*TrainCfg.fs)
+# the classes of the heads, in the order of the output channels
+TrainCfg.multi_task.classes = TrainCfg.qrs_detection.classes + TrainCfg.main.classes
+TrainCfg.multi_task.monitor = "neg_masked_bce"  # "main_score", "qrs_score", "neg_masked_bce"
+# loss of the af head, that of the qrs head is `TrainCfg.qrs_detection.loss`
+TrainCfg.multi_task.loss = "MaskedBCEWithLogitsLoss"
+# weights of the losses of the heads in the combined loss
+TrainCfg.multi_task.loss_weights = ED(qrs_detection=1.0, main=1.0)
+
+# knowledge distillation of the SeqLab models (tasks "qrs_detection", "main", "multi_task") into compact students,
+# ref. `distillation` and `trainer.train`
+TrainCfg.distillation = ED()
+# path of the checkpoint of the (frozen) teacher, of the same task and model class, None to disable distillation
+TrainCfg.distillation.teacher = None
+# config of the student, one of the compact configs of `ModelCfg[task]`, e.g. "seq_lab_small", "seq_lab_tiny"
+TrainCfg.distillation.student = "seq_lab_small"
+TrainCfg.distillation.alpha = 0.5  # weight of the distillation loss, (1 - alpha) for the loss w.r.t. the labels
+TrainCfg.distillation.temperature = 2.0
+# if True, the soft targets of the (non-augmented) training segments are computed once and cached per segment,
+# NOT applicable to virtual segments (which are regenerated each epoch),
+# the flip and random normalization (label-invariant) are then NOT seen by the teacher
+TrainCfg.distillation.cache_soft_targets = False
+# device and batch size on which the latency of the teacher and the student are measured
+TrainCfg.distillation.latency_device = "cpu"
+TrainCfg.distillation.latency_batch_size = 1
+
 
 
 # Plan:
@@ -336,6 +421,63 @@ ModelCfg.main.unet.up_num_filters = [
 ModelCfg.main.unet.up_mode = "deconv"
 
 
+ModelCfg.multi_task.input_len = TrainCfg.multi_task.input_len
+ModelCfg.multi_task.classes = TrainCfg.multi_task.classes
+ModelCfg.multi_task.model_name = TrainCfg.multi_task.model_name
+ModelCfg.multi_task.cnn_name = TrainCfg.multi_task.cnn_name
+ModelCfg.multi_task.rnn_name = TrainCfg.multi_task.rnn_name
+ModelCfg.multi_task.attn_name = TrainCfg.multi_task.attn_name
+
+# the backbone is shared by the qrs head and the af head,
+# with the (larger) receptive fields of the main task
+ModelCfg.multi_task.seq_lab = deepcopy(ECG_SEQ_LAB_NET_CONFIG)
+ModelCfg.multi_task.seq_lab.fs = BaseCfg.fs
+ModelCfg.multi_task.seq_lab.reduction = TrainCfg.multi_task.reduction
+ModelCfg.multi_task.seq_lab.cnn.name = ModelCfg.multi_task.cnn_name
+ModelCfg.multi_task.seq_lab.rnn.name = ModelCfg.multi_task.rnn_name
+ModelCfg.multi_task.seq_lab.attn.name = ModelCfg.multi_task.attn_name
+
+ModelCfg.multi_task.seq_lab.cnn.multi_scopic.filter_lengths = deepcopy(
+    ModelCfg.main.seq_lab.cnn.multi_scopic.filter_lengths
+)
+
+
+# compact students for knowledge distillation, ref. `TrainCfg.distillation`,
+# with the same input_len and reduction as the teachers (`seq_lab`)
+for t in ["qrs_detection", "main", "multi_task",]:
+    # half of the filters, without the lstm
+    ModelCfg[t].seq_lab_small = deepcopy(ModelCfg[t].seq_lab)
+    ModelCfg[t].seq_lab_small.rnn.name = "none"
+    ModelCfg[t].seq_lab_small.cnn.multi_scopic.num_filters = [
+        [n // 2 for n in item] for item in ModelCfg[t].seq_lab.cnn.multi_scopic.num_filters
+    ]
+    # a quarter of the filters, without the lstm and the attention
+    ModelCfg[t].seq_lab_tiny = deepcopy(ModelCfg[t].seq_lab_small)
+    ModelCfg[t].seq_lab_tiny.attn.name = "none"
+    ModelCfg[t].seq_lab_tiny.cnn.multi_scopic.num_filters = [
+        [n // 4 for n in item] for item in ModelCfg[t].seq_lab.cnn.multi_scopic.num_filters
+    ]
+
+
+# configurations of hyperparameter sweeps, ref. `sweep.run_sweep`
+SweepCfg = ED()
+SweepCfg.task = "main"  # one of "qrs_detection", "rr_lstm", "main", "multi_task"
+SweepCfg.sweep_dir = os.path.join(_BASE_DIR, "sweeps")
+SweepCfg.n_parallel = 4  # number of trials trained concurrently
+SweepCfg.threads_per_trial = None  # torch threads of each trial, None for the cpus evenly partitioned
+SweepCfg.workers_per_trial = 1  # data loader worker processes of each trial
+# median stopping rule: after `grace_epochs` epochs, a trial is stopped if its best monitored metric so far
+# is below the median of those of at least `min_trials` other trials at the same epoch
+SweepCfg.grace_epochs = 3
+SweepCfg.min_trials = 2
+# the grid of the sweep, keyed by (dotted) keys of `TrainCfg`, e.g. "learning_rate", "main.overlap_len",
+# keys of the segmentation (e.g. "overlap_len", "stretch_compress") require `TrainCfg.virtual_segments`
+SweepCfg.grid = ED()
+SweepCfg.grid.learning_rate = [1e-3, 3e-4]
+SweepCfg.grid.flooding_level = [0.0, 0.1]
+SweepCfg.grid.label_smoothing = [0.0, 0.1]
+
+
 # configurations for visualization
 PlotCfg = ED()
 # default const for the plot function in dataset.py
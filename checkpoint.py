@@ -0,0 +1,257 @@
+"""
+checkpointing during training, with the state dicts snapshotted into CPU memory,
+and written (atomically) to disk by a background thread,
+so that the training loop does not stall on disk I/O
+"""
+
+import os
+import random
+import logging
+from copy import deepcopy
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Optional, NoReturn
+
+import numpy as np
+import torch
+from torch import Tensor
+
+
+__all__ = [
+    "CheckpointManager",
+    "snapshot_state",
+    "get_rng_states",
+    "set_rng_states",
+]
+
+
+def snapshot_state(state:Any) -> Any:
+    """ finished, NOT checked,
+
+    snapshot (nested) states, e.g. of `state_dict`s of models and optimizers,
+    with the tensors copied into CPU memory, and other objects deep-copied,
+    so that the snapshot is no longer affected by the subsequent training steps
+
+    Parameters
+    ----------
+    state: any,
+        the states, typically dicts of tensors, numbers, configs, etc.
+
+    Returns
+    -------
+    any, the snapshot of the states
+    """
+    if isinstance(state, Tensor):
+        return state.detach().to(device="cpu", copy=True)
+    if isinstance(state, dict):
+        # `OrderedDict`, `EasyDict`, etc. keep their types
+        snapshot = type(state)() if type(state) is not dict else {}
+        for k, v in state.items():
+            snapshot[k] = snapshot_state(v)
+        return snapshot
+    if isinstance(state, (list, tuple)):
+        return type(state)(snapshot_state(v) for v in state)
+    return deepcopy(state)
+
+
+def get_rng_states(generator:Optional[torch.Generator]=None) -> dict:
+    """ finished, NOT checked,
+
+    get the states of the random number generators (of python, numpy, torch, and cuda if available),
+    to be stored into the checkpoints, so that the training can be resumed
+
+    Parameters
+    ----------
+    generator: Generator, optional,
+        an extra (torch) generator, e.g. that of the `BatchAugmenter`
+
+    Returns
+    -------
+    states: dict,
+        the states of the random number generators
+    """
+    states = {
+        "random": random.getstate(),
+        "numpy": np.random.get_state(),
+        "torch": torch.get_rng_state(),
+        "cuda": torch.cuda.get_rng_state_all() if torch.cuda.is_available() else None,
+    }
+    if generator is not None:
+        states["generator"] = generator.get_state()
+    return states
+
+
+def set_rng_states(states:dict, generator:Optional[torch.Generator]=None) -> NoReturn:
+    """ finished, NOT checked,
+
+    restore the states of the random number generators, ref. `get_rng_states`
+
+    Parameters
+    ----------
+    states: dict,
+        the states of the random number generators
+    generator: Generator, optional,
+        the extra (torch) generator, restored if its state is in `states`
+    """
+    random.setstate(states["random"])
+    np.random.set_state(states["numpy"])
+    torch.set_rng_state(states["torch"])
+    if states.get("cuda", None) is not None and torch.cuda.is_available() \
+            and len(states["cuda"]) == torch.cuda.device_count():
+        torch.cuda.set_rng_state_all(states["cuda"])
+    if generator is not None and states.get("generator", None) is not None:
+        generator.set_state(states["generator"])
+
+
+class CheckpointManager(object):
+    """ finished, NOT checked,
+
+    saves the checkpoints of the epochs (those not to be skipped according to `policy`),
+    keeping at most `keep_checkpoint_max` of them (the outdated ones are removed),
+    states are snapshotted into CPU memory in the calling (training) thread,
+    and written in a background thread (at most one write in flight), if `asynchronous`
+    """
+    __name__ = "CheckpointManager"
+
+    def __init__(self,
+                 checkpoint_dir:str,
+                 keep_checkpoint_max:int=20,
+                 policy:str="all",
+                 asynchronous:bool=True,
+                 logger:Optional[logging.Logger]=None) -> NoReturn:
+        """
+
+        Parameters
+        ----------
+        checkpoint_dir: str,
+            directory to save the checkpoints
+        keep_checkpoint_max: int, default 20,
+            maximum number of checkpoints to keep, if 0, all checkpoints are kept
+        policy: str, default "all",
+            policy of saving the checkpoints of the epochs, can be one of
+            "all": checkpoints of all the epochs are saved,
+            "best": only checkpoints of the epochs improving the monitored metric are saved
+        asynchronous: bool, default True,
+            if True, checkpoints are written by a background thread,
+            otherwise, written synchronously
+        logger: Logger, optional,
+            logger
+        """
+        self.checkpoint_dir = checkpoint_dir
+        self.keep_checkpoint_max = keep_checkpoint_max
+        self.policy = policy.lower()
+        assert self.policy in ["all", "best",], \
+            f"checkpoint policy `{policy}` not supported"
+        self.asynchronous = asynchronous
+        self.logger = logger
+        self.saved_checkpoints = deque()
+        self._executor = ThreadPoolExecutor(max_workers=1) if self.asynchronous else None
+        self._pending = None
+        os.makedirs(self.checkpoint_dir, exist_ok=True)
+
+    def save(self, state:dict, filename:str, is_best:bool=True, msg:Optional[str]=None) -> Optional[str]:
+        """ finished, NOT checked,
+
+        save a checkpoint (of an epoch) into `self.checkpoint_dir`,
+        unless skipped according to `self.policy`
+
+        Parameters
+        ----------
+        state: dict,
+            the checkpoint, e.g. with "model_state_dict", "optimizer_state_dict", etc.
+        filename: str,
+            filename of the checkpoint
+        is_best: bool, default True,
+            whether the checkpoint improves the monitored metric
+        msg: str, optional,
+            message to log after the checkpoint is written
+
+        Returns
+        -------
+        save_path: str or None,
+            path of the checkpoint, None if skipped
+        """
+        if self.policy == "best" and not is_best:
+            return None
+        save_path = os.path.join(self.checkpoint_dir, filename)
+        self._submit(snapshot_state(state), save_path, True, msg)
+        return save_path
+
+    def write(self, state:dict, save_path:str, msg:Optional[str]=None) -> str:
+        """ finished, NOT checked,
+
+        write a checkpoint to `save_path` (e.g. the best model),
+        which is NOT subject to `self.policy` nor `self.keep_checkpoint_max`
+
+        Parameters
+        ----------
+        state: dict,
+            the checkpoint
+        save_path: str,
+            path of the checkpoint
+        msg: str, optional,
+            message to log after the checkpoint is written
+
+        Returns
+        -------
+        save_path: str,
+            path of the checkpoint
+        """
+        self._submit(snapshot_state(state), save_path, False, msg)
+        return save_path
+
+    def wait(self) -> NoReturn:
+        """ wait for the pending write (if any) to finish, re-raising its exception if any
+        """
+        if self._pending is not None:
+            pending, self._pending = self._pending, None
+            pending.result()
+
+    def close(self) -> NoReturn:
+        """ wait for the pending write, and shut down the background thread
+        """
+        try:
+            self.wait()
+        finally:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+                self._executor = None
+
+    def _submit(self, state:dict, save_path:str, managed:bool, msg:Optional[str]) -> NoReturn:
+        """
+        """
+        # at most one snapshot is held besides the one being written
+        self.wait()
+        if self._executor is None:
+            self._write(state, save_path, managed, msg)
+        else:
+            self._pending = self._executor.submit(self._write, state, save_path, managed, msg)
+
+    def _write(self, state:dict, save_path:str, managed:bool, msg:Optional[str]) -> NoReturn:
+        """ write to a temporary file, then (atomically) rename,
+        so that no partially written checkpoint exists under `save_path`
+        """
+        os.makedirs(os.path.dirname(save_path) or ".", exist_ok=True)
+        tmp_path = f"{save_path}.tmp"
+        torch.save(state, tmp_path)
+        os.replace(tmp_path, save_path)
+        if msg:
+            self._log(msg)
+        if not managed:
+            return
+        self.saved_checkpoints.append(save_path)
+        # remove outdated checkpoints
+        while len(self.saved_checkpoints) > self.keep_checkpoint_max > 0:
+            ckpt_to_remove = self.saved_checkpoints.popleft()
+            try:
+                os.remove(ckpt_to_remove)
+            except OSError:
+                self._log(f"failed to remove {ckpt_to_remove}")
+
+    def _log(self, msg:str) -> NoReturn:
+        """
+        """
+        if self.logger:
+            self.logger.info(msg)
+        else:
+            print(msg)
@@ -9,8 +9,12 @@ import time
 import warnings
 import logging
 import json
+import threading
+from copy import copy
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from datetime import datetime
-from typing import Union, Optional, Any, List, Tuple, Dict, Sequence, NoReturn
+from typing import Union, Optional, Any, List, Tuple, Dict, Sequence, Iterator, NoReturn
 from numbers import Real
 
 import numpy as np
@@ -28,7 +32,8 @@ from utils.misc import (
     WFDB_Beat_Annotations, WFDB_Non_Beat_Annotations, WFDB_Rhythm_Annotations,
 )
 from utils.utils_interval import generalized_intervals_intersection
-from utils.scoring_metrics import gen_endpoint_score_mask
+from utils.utils_signal import minmax_envelope
+from utils.scoring_metrics import EndpointScoreRange, gen_endpoint_score_intervals
 
 
 __all__ = [
@@ -119,6 +124,21 @@ class CPSC2021Reader(object):
         working_dir: str, optional,
             working directory, to store intermediate files and log file
         verbose: int, default 2,
+        kwargs: dict,
+            auxiliary key word arguments, including
+            resample_cache: bool, default False,
+                if True, whole-record resampled signals are cached (in memory and on disk),
+                and `load_data` with `fs` differing from `self.fs` slices the cached signals
+            resample_cache_dir: str, optional,
+                directory to store the resampled signals,
+                defaults to the sub-directory "resampled" of `working_dir`
+            resample_cache_size: int, default 8,
+                maximum number of resampled records kept in memory,
+                0 for caching on disk only
+            beat_ann_dir: str, optional,
+                directory to store the per-beat annotations computed by `load_beat_ann`,
+                defaults to the sub-directory "beat_ann" of `working_dir`,
+                so that `db_dir` is kept read-only
         """
         self.db_name = "CPSC2021"
         self.db_dir_base = db_dir
@@ -168,9 +188,41 @@ class CPSC2021Reader(object):
 
         self._epsilon = 1e-7  # dealing with round(0.5) = 0, hence keeping accordance with output length of `resample_poly`
 
+        # opt-in cache of whole-record resampled signals, keyed by (record, fs, leads, units)
+        self._resample_cache_enabled = kwargs.get("resample_cache", False)
+        self._resample_cache_dir = kwargs.get("resample_cache_dir", None) \
+            or os.path.join(self.working_dir, "resampled")
+        self._resample_cache_size = kwargs.get("resample_cache_size", 8)
+        self._resample_cache = OrderedDict()
+        self._resample_cache_lock = threading.Lock()  # `load_many` loads records concurrently
+
+        # compact per-beat annotations (rpeaks, rr, af labels), ref. `load_beat_ann`
+        self._beat_ann_dir = kwargs.get("beat_ann_dir", None) \
+            or os.path.join(self.working_dir, "beat_ann")
+        self._beat_ann_cache = {}
+
+        # sparse scoring ranges of the onsets and offsets of af episodes, keyed by (record, bias)
+        self._endpoint_score_cache = {}
+
         # self.palette = {"spb": "yellow", "pvc": "red",}
 
 
+    def __getstate__(self) -> dict:
+        """
+        the lock of the resample cache can not be pickled (e.g. for worker processes)
+        """
+        state = self.__dict__.copy()
+        del state["_resample_cache_lock"]
+        return state
+
+
+    def __setstate__(self, state:dict) -> NoReturn:
+        """
+        """
+        self.__dict__.update(state)
+        self._resample_cache_lock = threading.Lock()
+
+
     def _auto_infer_units(self, sig:np.ndarray, sig_type:str="ECG") -> str:
         """ finished, checked,
 
@@ -519,6 +571,20 @@ class CPSC2021Reader(object):
             _leads = leads
         assert all([l in self.all_leads for l in _leads])
 
+        if fs is not None and fs != self.fs and self._resample_cache_enabled:
+            sf, st = self._validate_samp_interval(rec, sampfrom, sampto)
+            data = self._load_resampled_record(rec, _leads, units, fs)
+            # index mapping in accordance with `load_af_episodes` and `load_rpeaks`
+            # of the same length as resampling the interval directly (the uncached path below),
+            # the start is shifted back (by at most one sample) at the end of the record if necessary
+            siglen = self._resampled_len(st - sf, fs)
+            sf = min(self._round(sf * fs / self.fs), data.shape[1] - siglen)
+            st = sf + siglen
+            data = data[:, sf:st].copy()  # copy to keep the cached signal untouched
+            if data_format.lower() in ["channel_last", "lead_last"]:
+                data = data.T
+            return data
+
         rec_fp = self._get_path(rec)
         sf, st = self._validate_samp_interval(rec, sampfrom, sampto)
         wfdb_rec = wfdb.rdrecord(rec_fp, sampfrom=sf, sampto=st, physical=True, channel_names=_leads)
@@ -536,6 +602,58 @@ class CPSC2021Reader(object):
 
         return data
 
+
+    def _load_resampled_record(self, rec:str, leads:List[str], units:str, fs:Real) -> np.ndarray:
+        """ finished, NOT checked,
+
+        load the whole record resampled to `fs`, from the in-memory cache,
+        or from the on-disk cache, or computed via `resample_poly` (and then cached)
+
+        Parameters
+        ----------
+        rec: str,
+            name of the record
+        leads: list of str,
+            the leads to load
+        units: str,
+            units of the output signal, "mV" or "μV" (alias "uV")
+        fs: real number,
+            the sampling frequency to resample to
+
+        Returns
+        -------
+        data: ndarray,
+            the resampled ecg data of the whole record, of format "channel_first"
+        """
+        _units = "uV" if units.lower() in ["uv", "μv"] else "mV"
+        key = (rec, fs, tuple(leads), _units)
+        with self._resample_cache_lock:
+            if key in self._resample_cache:
+                self._resample_cache.move_to_end(key)
+                return self._resample_cache[key]
+
+        os.makedirs(self._resample_cache_dir, exist_ok=True)
+        cache_fp = os.path.join(
+            self._resample_cache_dir,
+            f"{rec}-{fs:g}Hz-{'_'.join(leads)}-{_units}.npy",
+        )
+        if os.path.isfile(cache_fp):
+            data = np.load(cache_fp)
+        else:
+            data = self.load_data(rec, leads=leads, data_format="channel_first", units=_units)
+            data = resample_poly(data, fs, self.fs, axis=1)
+            # write to a temporary file (per process and thread) first, in case of concurrent readers
+            tmp_fp = f"{cache_fp}.{os.getpid()}.{threading.get_ident()}.tmp.npy"
+            np.save(tmp_fp, data)
+            os.replace(tmp_fp, cache_fp)
+
+        if self._resample_cache_size > 0:
+            with self._resample_cache_lock:
+                self._resample_cache[key] = data
+                while len(self._resample_cache) > self._resample_cache_size:
+                    self._resample_cache.popitem(last=False)
+        return data
+
     
     def load_ann(self,
                  rec:str,
@@ -685,14 +803,35 @@ class CPSC2021Reader(object):
         af_episodes: list or ndarray,
             episodes of atrial fibrillation, in terms of intervals or mask
         """
-        header = wfdb.rdheader(self._get_path(rec))
-        label = self._labels_f2a[header.comments[0]]
-        siglen = header.sig_len
         # if ann is None or fmt.lower() in ["c_intervals",]:
         #     _ann = wfdb.rdann(self._get_path(rec), extension=self.ann_ext)
         # else:
         #     _ann = ann
-        _ann = wfdb.rdann(self._get_path(rec), extension=self.ann_ext)
+        return self._load_af_episodes(
+            rec,
+            full_ann=wfdb.rdann(self._get_path(rec), extension=self.ann_ext),
+            header=wfdb.rdheader(self._get_path(rec)),
+            sampfrom=sampfrom, sampto=sampto, zero_start=zero_start, fs=fs, fmt=fmt,
+        )
+
+
+    def _load_af_episodes(self,
+                          rec:str,
+                          full_ann:wfdb.Annotation,
+                          header:wfdb.Record,
+                          sampfrom:Optional[int]=None,
+                          sampto:Optional[int]=None,
+                          zero_start:bool=False,
+                          fs:Optional[Real]=None,
+                          fmt:str="intervals") -> Union[List[List[int]], np.ndarray]:
+        """ finished, NOT checked,
+
+        the same as `load_af_episodes`, with the (whole) annotation and the header already read,
+        ref. `_load_one`
+        """
+        label = self._labels_f2a[header.comments[0]]
+        siglen = header.sig_len
+        _ann = full_ann
         sf, st = self._validate_samp_interval(rec, sampfrom, sampto)
         aux_note = np.array(_ann.aux_note)
         critical_points = _ann.sample
@@ -773,7 +912,15 @@ class CPSC2021Reader(object):
         label: str,
             classifying label of the record
         """
-        header = wfdb.rdheader(self._get_path(rec))
+        return self._load_label(wfdb.rdheader(self._get_path(rec)), fmt=fmt)
+
+
+    def _load_label(self, header:wfdb.Record, fmt:str="a") -> str:
+        """ finished, NOT checked,
+
+        the same as `load_label`, with the header already read,
+        ref. `_load_one`
+        """
         label = header.comments[0]
         if fmt.lower() in ["a", "abbr", "abbreviation"]:
             label = self._labels_f2a[label]
@@ -784,6 +931,258 @@ class CPSC2021Reader(object):
         return label
 
 
+    def load_beat_ann(self, rec:str, force_recompute:bool=False) -> ED:
+        """ finished, NOT checked,
+
+        load the compact per-beat annotations of the record,
+        computed once from the annotation file, and stored in a npz file
+
+        Parameters
+        ----------
+        rec: str,
+            name of the record
+        force_recompute: bool, default False,
+            if True, recompute regardless of possible existing files
+
+        Returns
+        -------
+        beat_ann: dict,
+            with items
+            - rpeaks: int32 ndarray, of shape (n_beats,), indices of rpeaks of the record
+            - rr: float32 ndarray, of shape (n_beats-1,), rr intervals, with units in seconds
+            - af_label: int32 ndarray, of shape (n_beats,), 1 for beats inside af episodes, 0 otherwise,
+              i.e. equals `self.load_af_episodes(rec, fmt="mask")[rpeaks]`
+            - af_intervals: int32 ndarray, of shape (n_episodes, 2), episodes of atrial fibrillation
+        """
+        if not force_recompute and rec in self._beat_ann_cache:
+            return self._beat_ann_cache[rec]
+        beat_ann_fp = os.path.join(self._beat_ann_dir, f"{rec}.npz")
+        if not force_recompute and os.path.isfile(beat_ann_fp):
+            with np.load(beat_ann_fp) as npz:
+                beat_ann = ED({k: npz[k] for k in npz.files})
+        else:
+            rpeaks = self.load_rpeaks(rec).astype(np.int32)
+            af_intervals = np.array(self.load_af_episodes(rec, fmt="intervals"), dtype=np.int32).reshape(-1, 2)
+            # episodes are sorted and disjoint, the beat is in af if it lies in [start, end) of the last starting episode
+            itv_idx = np.searchsorted(af_intervals[:, 0], rpeaks, side="right") - 1
+            af_label = (itv_idx >= 0) & (rpeaks < af_intervals[np.maximum(itv_idx, 0), 1]) \
+                if len(af_intervals) > 0 else np.zeros_like(rpeaks, dtype=bool)
+            beat_ann = ED(
+                rpeaks=rpeaks,
+                rr=(np.diff(rpeaks) / self.fs).astype(np.float32),
+                af_label=af_label.astype(np.int32),
+                af_intervals=af_intervals,
+            )
+            os.makedirs(self._beat_ann_dir, exist_ok=True)
+            # write to a temporary file (per process and thread) first, in case of concurrent readers
+            tmp_fp = f"{beat_ann_fp}.{os.getpid()}.{threading.get_ident()}.tmp.npz"
+            np.savez(tmp_fp, **beat_ann)
+            os.replace(tmp_fp, beat_ann_fp)
+        self._beat_ann_cache[rec] = beat_ann
+        return beat_ann
+
+
+    def load_many(self,
+                  records:Optional[Sequence[str]]=None,
+                  fields:Union[str, Sequence[str]]=("data", "rpeaks", "af_episodes", "label",),
+                  windows:Optional[Union[Sequence[int], Dict[str, Sequence[int]]]]=None,
+                  max_workers:Optional[int]=None,
+                  as_generator:bool=False,
+                  max_memory:Optional[Real]=None,
+                  **kwargs:Any) -> Union[Dict[str, ED], Iterator[Tuple[str, ED]]]:
+        """ finished, NOT checked,
+
+        load signals and (or) annotations of multiple records concurrently,
+        using a bounded pool of threads (file reading of `wfdb` releases the GIL)
+
+        Parameters
+        ----------
+        records: sequence of str, optional,
+            names of the records to load, defaults to all records
+        fields: str or sequence of str, default ("data", "rpeaks", "af_episodes", "label",),
+            fields to load, can be any of "data", "rpeaks", "af_episodes", "label"
+        windows: sequence of int, or dict, optional,
+            the windows (`sampfrom`, `sampto`) to load,
+            if is a 2-sequence, the same window is used for all the records,
+            if is a dict, keys are record names, records absent in it are loaded in whole
+        max_workers: int, optional,
+            maximum number of threads, defaults to `min(32, os.cpu_count() + 4)`
+        as_generator: bool, default False,
+            if True, a generator yielding 2-tuples (record name, loaded fields)
+            in the order of completion will be returned,
+            otherwise, a dict of the loaded fields keyed by record names
+        max_memory: real number, optional,
+            ceiling (in bytes) of the estimated size of the signals in memory,
+            which are being loaded or (when `as_generator` is True) yielded but not consumed,
+            no new loading is issued if the ceiling would be exceeded,
+            except when nothing else is in flight,
+            defaults to no ceiling
+        kwargs: dict,
+            key word arguments passed to `load_data`, including
+            "leads", "data_format", "units", "fs",
+            and also "af_fmt" for the format of "af_episodes",
+            "fs" is also used for "rpeaks" and "af_episodes"
+
+        Returns
+        -------
+        dict of ED, or generator of 2-tuple (str, ED),
+            the loaded fields of each record
+
+        NOTE
+        ----
+        records are loaded as a whole if `windows` is not given,
+        which might be very memory consuming for long records
+        """
+        _records = records or self.all_records
+        _fields = [fields] if isinstance(fields, str) else list(fields)
+        assert set(_fields) <= {"data", "rpeaks", "af_episodes", "label",}, \
+            f"invalid fields: {set(_fields) - {'data', 'rpeaks', 'af_episodes', 'label',}}"
+        if windows is None:
+            _windows = {}
+        elif isinstance(windows, dict):
+            _windows = windows
+        else:
+            _windows = {rec: windows for rec in _records}
+        max_workers = max_workers or min(32, (os.cpu_count() or 1) + 4)
+        max_memory = max_memory or np.inf
+        generator = self._load_many_iter(_records, _fields, _windows, max_workers, max_memory, **kwargs)
+        if as_generator:
+            return generator
+        return {rec: item for rec, item in generator}
+
+
+    def _load_many_iter(self,
+                        records:Sequence[str],
+                        fields:List[str],
+                        windows:Dict[str, Sequence[int]],
+                        max_workers:int,
+                        max_memory:Real,
+                        **kwargs:Any) -> Iterator[Tuple[str, ED]]:
+        """ finished, NOT checked,
+
+        the generator behind `load_many`,
+        with at most `2*max_workers` records in flight, and bounded estimated memory usage
+        """
+        fs = kwargs.get("fs", None)
+        n_leads = len(kwargs.get("leads", None) or self.all_leads)
+        if isinstance(kwargs.get("leads", None), str):
+            n_leads = 1
+        sig_lens = dict(zip(self.df_stats.record, self.df_stats.sig_len))
+
+        def _estimate_bytes(rec:str) -> int:
+            if "data" not in fields:
+                return 0
+            sf, st = windows.get(rec, (None, None))
+            siglen = (st or sig_lens[rec]) - (sf or 0)
+            if fs is not None:
+                siglen = siglen * fs / self.fs
+            return int(siglen * n_leads * np.dtype(np.float64).itemsize)
+
+        records_iter = iter(records)
+        next_rec = next(records_iter, None)
+        pending = {}
+        mem_in_flight = 0
+        executor = ThreadPoolExecutor(max_workers=max_workers)
+        try:
+            while next_rec is not None or pending:
+                while next_rec is not None and len(pending) < 2 * max_workers:
+                    est = _estimate_bytes(next_rec)
+                    if pending and mem_in_flight + est > max_memory:
+                        break
+                    sf, st = windows.get(next_rec, (None, None))
+                    future = executor.submit(self._load_one, next_rec, fields, sf, st, **kwargs)
+                    pending[future] = (next_rec, est)
+                    mem_in_flight += est
+                    next_rec = next(records_iter, None)
+                done, _ = wait(list(pending), return_when=FIRST_COMPLETED)
+                for future in done:
+                    rec, est = pending.pop(future)
+                    yield rec, future.result()
+                    mem_in_flight -= est
+        finally:
+            for future in pending:
+                future.cancel()
+            executor.shutdown(wait=True)
+
+
+    def _load_one(self,
+                  rec:str,
+                  fields:List[str],
+                  sampfrom:Optional[int]=None,
+                  sampto:Optional[int]=None,
+                  **kwargs:Any) -> ED:
+        """ finished, NOT checked,
+
+        load the `fields` of one record, with the annotation file and the header read at most once,
+        ref. `load_many`
+        """
+        fs = kwargs.get("fs", None)
+        sf, st = self._validate_samp_interval(rec, sampfrom, sampto)
+        full_ann, header = None, None
+        if "rpeaks" in fields or "af_episodes" in fields:
+            full_ann = wfdb.rdann(self._get_path(rec), extension=self.ann_ext)
+        if "af_episodes" in fields or "label" in fields:
+            header = wfdb.rdheader(self._get_path(rec))
+        loaded = ED()
+        if "data" in fields:
+            loaded.data = self.load_data(
+                rec,
+                leads=kwargs.get("leads", None),
+                data_format=kwargs.get("data_format", "channel_first"),
+                units=kwargs.get("units", "mV"),
+                sampfrom=sf, sampto=st, fs=fs,
+            )
+        if "rpeaks" in fields:
+            # restricted to [sf, st] (inclusive), as `wfdb.rdann` with `sampfrom` and `sampto` does
+            ann = copy(full_ann)
+            in_range = (full_ann.sample >= sf) & (full_ann.sample <= st)
+            ann.sample = full_ann.sample[in_range]
+            ann.symbol = list(np.array(full_ann.symbol)[in_range])
+            loaded.rpeaks = self.load_rpeaks(rec, ann, sf, st, fs=fs)
+        if "af_episodes" in fields:
+            loaded.af_episodes = self._load_af_episodes(
+                rec, full_ann, header, sampfrom=sf, sampto=st, fs=fs, fmt=kwargs.get("af_fmt", "intervals"),
+            )
+        if "label" in fields:
+            loaded.label = self._load_label(header)
+        return loaded
+
+
+    def gen_endpoint_score_intervals(self,
+                                     rec:str,
+                                     bias:dict={1:1, 2:0.5}) -> Tuple[EndpointScoreRange, EndpointScoreRange]:
+        """ finished, NOT checked,
+
+        generate the sparse scoring ranges for the onsets and offsets of af episodes,
+        computed once per record (and bias) from the beat locations, and cached,
+        ref. `utils.scoring_metrics.gen_endpoint_score_intervals`
+
+        Parameters
+        ----------
+        rec: str,
+            name of the record
+        bias: dict, default {1:1, 2:0.5},
+            keys are bias (with ±) in terms of number of rpeaks
+            values are corresponding scores
+
+        Returns
+        -------
+        (onset_score_range, offset_score_range): 2-tuple of EndpointScoreRange,
+            piecewise-constant scoring ranges for the onset and offsets predictions of af episodes,
+            which can be evaluated at predicted endpoints via indexing or `score_at`
+        """
+        key = (rec, tuple(sorted(bias.items())))
+        if key not in self._endpoint_score_cache:
+            self._endpoint_score_cache[key] = gen_endpoint_score_intervals(
+                siglen=self.df_stats[self.df_stats.record==rec].iloc[0].sig_len,
+                critical_points=wfdb.rdann(self._get_path(rec), extension=self.ann_ext).sample,
+                af_intervals=self.load_af_episodes(rec, fmt="c_intervals"),
+                bias=bias,
+                verbose=self.verbose,
+            )
+        return self._endpoint_score_cache[key]
+
+
     def gen_endpoint_score_mask(self, rec:str, bias:dict={1:1, 2:0.5}) -> Tuple[np.ndarray, np.ndarray]:
         """finished, checked,
 
@@ -804,16 +1203,12 @@ class CPSC2021Reader(object):
 
         NOTE
         ----
-        the onsets in `af_intervals` are 0.15s ahead of the corresponding R peaks,
+        1. the onsets in `af_intervals` are 0.15s ahead of the corresponding R peaks,
         while the offsets in `af_intervals` are 0.15s behind the corresponding R peaks,
+        2. the masks are expanded from the cached sparse ranges of `gen_endpoint_score_intervals`,
+        which should be preferred for computing the challenge score
         """
-        masks = gen_endpoint_score_mask(
-            siglen=self.df_stats[self.df_stats.record==rec].iloc[0].sig_len,
-            critical_points=wfdb.rdann(self._get_path(rec), extension=self.ann_ext).sample,
-            af_intervals=self.load_af_episodes(rec, fmt="c_intervals"),
-            bias=bias,
-            verbose=self.verbose,
-        )
+        masks = tuple(item.to_dense() for item in self.gen_endpoint_score_intervals(rec, bias))
         return masks
 
 
@@ -860,6 +1255,15 @@ class CPSC2021Reader(object):
             "q_onsets", "q_peaks", "r_peaks", "s_peaks", "s_offsets",
             "t_onsets", "t_peaks", "t_offsets"
         kwargs: dict,
+            auxiliary key word arguments, including
+            decimate: bool or str, default "auto",
+                if True, the signal is rendered in one interactive figure via min/max envelopes,
+                ref. `self._plot_decimated`,
+                if "auto", decimated rendering is used for signals longer than `decimate_thr`
+            decimate_thr: int, default 5 minutes,
+                threshold (in number of samples) of the signal length for decimated rendering
+            n_pixels: int, default 2000,
+                number of pixel columns of the min/max envelopes in decimated rendering
 
         TODO
         ----
@@ -966,10 +1370,27 @@ class CPSC2021Reader(object):
             af_episodes = _ann["af_episodes"]
             af_episodes = [[itv[0]-sf, itv[1]-sf] for itv in af_episodes]
             label = _ann["label"]
+            rpeaks_bias = sf
         else:
             rpeaks = ann.get("rpeaks", [])
             af_episodes = ann.get("af_episodes", [])
             label = ann.get("label", "")
+            rpeaks_bias = 0
+
+        decimate = kwargs.get("decimate", "auto")
+        if decimate == "auto":
+            decimate = _data.shape[1] > kwargs.get("decimate_thr", 5*60*self.fs)
+        if decimate:
+            self._plot_decimated(
+                data=_data,
+                leads=_leads,
+                sf=sf,
+                rpeaks=np.asarray(rpeaks, dtype=int) - rpeaks_bias,
+                af_episodes=af_episodes,
+                label=label,
+                n_pixels=kwargs.get("n_pixels", 2000),
+            )
+            return
 
         nb_leads = len(_leads)
 
@@ -1035,9 +1456,136 @@ class CPSC2021Reader(object):
         plt.show()
 
 
+    def _plot_decimated(self,
+                        data:np.ndarray,
+                        leads:List[str],
+                        sf:int,
+                        rpeaks:Sequence[int],
+                        af_episodes:Sequence[Sequence[int]],
+                        label:str="",
+                        n_pixels:int=2000) -> NoReturn:
+        """ finished, NOT checked,
+
+        plot (long) signals in one interactive figure,
+        rendered via per-pixel-column min/max envelopes when zoomed out,
+        and at full resolution when zoomed in (no more than 2 samples per pixel column)
+
+        Parameters
+        ----------
+        data: ndarray,
+            the signal to plot, of format "channel_first", units in μV
+        leads: list of str,
+            names of the leads of `data`
+        sf: int,
+            index (in the record) of the first sample of `data`
+        rpeaks: sequence of int,
+            indices of rpeaks, relative to `data`,
+            plotted only at full resolution
+        af_episodes: sequence of intervals,
+            episodes of atrial fibrillation, relative to `data`
+        label: str, default "",
+            label of the record
+        n_pixels: int, default 2000,
+            number of pixel columns of the min/max envelopes
+
+        NOTE
+        ----
+        1. envelopes of the whole signal are computed (vectorized) once for each zoom level,
+        i.e. bin size of power of 2, and cached along with the figure
+        2. only visible annotations are drawn, which are looked up in sorted arrays via `searchsorted`
+        """
+        import matplotlib.pyplot as plt
+        siglen = data.shape[1]
+        nb_leads = len(leads)
+        rpeaks = np.sort(np.asarray(rpeaks, dtype=int))
+        af_index = np.array(sorted([list(itv) for itv in af_episodes]), dtype=int).reshape((-1, 2))
+        envelopes = {}  # bin_size -> (env_min, env_max)
+        palette = {"qrs": "yellow", "af": "red",}
+        bias_thr = 0.07
+
+        fig, axes = plt.subplots(nb_leads, 1, sharex=True, figsize=(20, 3*nb_leads))
+        if nb_leads == 1:
+            axes = [axes]
+        lines = []
+        for ax_idx, ax in enumerate(axes):
+            lines.append(ax.plot([], [], color="black", linewidth=0.6, label=f"lead - {leads[ax_idx]}")[0])
+            if label:
+                ax.plot([], [], " ", label=f"label - {label}")
+            ax.legend(loc="upper left")
+            ax.set_ylabel("Voltage [μV]")
+        axes[-1].set_xlabel("Time [s]")
+        ann_artists = []
+
+        def _render(start:int, end:int) -> NoReturn:
+            start, end = max(0, start), min(siglen, end)
+            if end <= start:
+                return
+            for artist in ann_artists:
+                artist.remove()
+            ann_artists.clear()
+            if end - start <= 2 * n_pixels:  # zoomed in, full resolution
+                secs = (sf + np.arange(start, end)) / self.fs
+                for ax_idx, line in enumerate(lines):
+                    line.set_data(secs, data[ax_idx, start:end])
+                visible_rpeaks = rpeaks[np.searchsorted(rpeaks, start):np.searchsorted(rpeaks, end)]
+                for ax in axes:
+                    for r in visible_rpeaks:
+                        ann_artists.append(ax.axvspan(
+                            (sf+r)/self.fs-bias_thr, (sf+r)/self.fs+bias_thr,
+                            color=palette["qrs"], alpha=0.3,
+                        ))
+            else:
+                bin_size = 2 ** int(math.ceil(math.log2((end - start) / n_pixels)))
+                if bin_size not in envelopes:
+                    envelopes[bin_size] = minmax_envelope(data, bin_size)
+                env_min, env_max = envelopes[bin_size]
+                b_start, b_end = start // bin_size, math.ceil(end / bin_size)
+                secs = np.repeat((sf + (np.arange(b_start, b_end) + 0.5) * bin_size) / self.fs, 2)
+                for ax_idx, line in enumerate(lines):
+                    line.set_data(
+                        secs,
+                        np.stack([env_min[ax_idx, b_start:b_end], env_max[ax_idx, b_start:b_end]], axis=-1).ravel(),
+                    )
+            # af episodes are sorted and disjoint, hence so are their ends
+            i_start = np.searchsorted(af_index[:, 1], start, side="right")
+            i_end = np.searchsorted(af_index[:, 0], end, side="left")
+            for itv_start, itv_end in af_index[i_start:i_end]:
+                for ax in axes:
+                    ann_artists.append(ax.axvspan(
+                        (sf+max(itv_start, start))/self.fs, (sf+min(itv_end, end))/self.fs,
+                        color=palette["af"], alpha=0.15,
+                    ))
+            for ax, line in zip(axes, lines):
+                y = line.get_ydata()
+                margin = 0.05 * (y.max() - y.min()) + 1
+                ax.set_ylim(y.min() - margin, y.max() + margin)
+
+        def _on_xlim_changed(ax) -> NoReturn:
+            x_start, x_end = ax.get_xlim()
+            _render(int(math.floor(x_start*self.fs)) - sf, int(math.ceil(x_end*self.fs)) - sf)
+            ax.figure.canvas.draw_idle()
+
+        _render(0, siglen)
+        axes[0].set_xlim(sf/self.fs, (sf+siglen)/self.fs)
+        # shared axes do not emit `xlim_changed` when changed via a sibling
+        for ax in axes:
+            ax.callbacks.connect("xlim_changed", _on_xlim_changed)
+        plt.subplots_adjust(hspace=0.2)
+        plt.show()
+
+
     def _round(self, n:Real) -> int:
         """ finished, checked,
 
         dealing with round(0.5) = 0, hence keeping accordance with output length of `resample_poly`
         """
         return int(round(n + self._epsilon))
+
+
+    def _resampled_len(self, siglen:int, fs:Real) -> int:
+        """ finished, NOT checked,
+
+        length of a signal of length `siglen` resampled (via `resample_poly`) from `self.fs` to `fs`,
+        which is ceil(siglen * up / down), NOT `_round(siglen * fs / self.fs)`
+        """
+        return int(math.ceil(siglen * fs / self.fs - self._epsilon))
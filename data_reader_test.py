@@ -0,0 +1,120 @@
+"""
+test of the consistency of the cached (`resample_cache`) and the uncached paths
+of loading resampled data via `CPSC2021Reader.load_data`
+"""
+import argparse
+import math
+import tempfile
+from typing import NoReturn
+
+import numpy as np
+
+from cfg import BaseCfg
+from data_reader import CPSC2021Reader
+
+
+def _get_parser() -> dict:
+    """
+    """
+    description = "test of the consistency of loading resampled data with and without the resample cache"
+    parser = argparse.ArgumentParser(
+        description=description,
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument(
+        "-d", "--db-dir", type=str, default=BaseCfg.db_dir,
+        help="full database directory",
+        dest="db_dir",
+    )
+    parser.add_argument(
+        "-n", "--n-records", type=int, default=5,
+        help="number of (random) records to test",
+        dest="n_records",
+    )
+    parser.add_argument(
+        "--repeats", type=int, default=20,
+        help="number of (random) intervals of each record",
+        dest="repeats",
+    )
+    parser.add_argument(
+        "--atol", type=float, default=1e-3,
+        help="absolute tolerance of the values",
+        dest="atol",
+    )
+
+    args = vars(parser.parse_args())
+
+    return args
+
+
+def run_test(db_dir:str, n_records:int=5, repeats:int=20, seed:int=0, atol:float=1e-3) -> bool:
+    """ finished, NOT checked,
+
+    Parameters
+    ----------
+    db_dir: str,
+        full database directory
+    n_records: int, default 5,
+        number of (random) records to test
+    repeats: int, default 20,
+        number of (random) intervals of each record
+    seed: int, default 0,
+        seed of the random records and intervals
+    atol: float, default 1e-3,
+        absolute tolerance (in mV) of the values
+
+    NOTE
+    ----
+    values are compared for intervals starting on the common grid of the two sampling frequencies only,
+    other starts are rounded to the resampled grid by the cached path, hence shifted by a fraction of a sample;
+    samples within the half length of the filter of `resample_poly` (10 * max(up, down) / down)
+    from both ends are trimmed, where the uncached path has the transients of the filter
+
+    Returns
+    -------
+    agree: bool,
+        True if the cached and the uncached paths load resampled data of the same shapes,
+        and of close values in the interior, with the uncached path being the reference
+    """
+    rng = np.random.default_rng(seed)
+    agree = True
+    max_diff = 0.0
+    with tempfile.TemporaryDirectory() as cache_dir:
+        dr_uncached = CPSC2021Reader(db_dir, verbose=0)
+        dr_cached = CPSC2021Reader(db_dir, verbose=0, resample_cache=True, resample_cache_dir=cache_dir)
+        records = rng.choice(dr_uncached.all_records, size=min(n_records, len(dr_uncached.all_records)), replace=False)
+        for rec in records:
+            siglen = dr_uncached.df_stats[dr_uncached.df_stats.record==rec].iloc[0].sig_len
+            for fs in [100, 250, 500, 333,]:
+                up, down = fs // math.gcd(fs, dr_uncached.fs), dr_uncached.fs // math.gcd(fs, dr_uncached.fs)
+                trim = int(math.ceil(10 * max(up, down) / down)) + 1
+                # the whole record, intervals touching the end of the record, and random intervals
+                intervals = [[0, siglen], [max(0, siglen - 1001), siglen], [max(0, siglen - 7), siglen]]
+                for _ in range(repeats):
+                    sf, st = np.sort(rng.choice(siglen + 1, size=2, replace=False))
+                    # half of the random intervals start on the common grid
+                    if rng.random() < 0.5:
+                        sf = sf - sf % down
+                    intervals.append([int(sf), int(st)])
+                for sf, st in intervals:
+                    ref = dr_uncached.load_data(rec, sampfrom=sf, sampto=st, fs=fs)
+                    data = dr_cached.load_data(rec, sampfrom=sf, sampto=st, fs=fs)
+                    if data.shape != ref.shape:
+                        print(f"{rec}, [{sf}, {st}] resampled to {fs} Hz: cached {data.shape}, uncached {ref.shape}")
+                        agree = False
+                        continue
+                    data, ref = data[..., trim:data.shape[-1]-trim], ref[..., trim:ref.shape[-1]-trim]
+                    if sf % down != 0 or data.size == 0:
+                        continue
+                    diff = float(np.abs(data - ref).max())
+                    max_diff = max(max_diff, diff)
+                    if not np.allclose(data, ref, atol=atol):
+                        print(f"{rec}, [{sf}, {st}] resampled to {fs} Hz: largest difference {diff:.6f}")
+                        agree = False
+    print(f"cached and uncached agree: {agree}, largest difference (interior): {max_diff:.6f}")
+    return agree
+
+
+if __name__ == "__main__":
+    args = _get_parser()
+    run_test(**args)
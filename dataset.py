@@ -41,9 +41,13 @@ import re
 import time
 import multiprocessing as mp
 import random
-from itertools import repeat
+import shutil
+import zlib
+import hashlib
+from itertools import repeat, chain
+from collections import OrderedDict
 from copy import deepcopy
-from typing import Union, Optional, List, Tuple, Dict, Sequence, Set, NoReturn
+from typing import Union, Optional, Any, List, Tuple, Dict, Sequence, Set, NoReturn
 
 import numpy as np
 np.set_printoptions(precision=5, suppress=True)
@@ -52,6 +56,7 @@ from easydict import EasyDict as ED
 from tqdm import tqdm
 import torch
 from torch.utils.data.dataset import Dataset
+from torch.utils.data.sampler import Sampler
 from sklearn.preprocessing import StandardScaler
 from scipy.io import loadmat, savemat
 
@@ -61,10 +66,10 @@ from cfg import (
 from data_reader import CPSC2021Reader as CR
 from signal_processing.ecg_preproc import preprocess_multi_lead_signal
 from utils.utils_signal import normalize
-from utils.utils_interval import mask_to_intervals
+from utils.utils_interval import mask_to_intervals, generalized_intervals_intersection
 from utils.misc import (
-    dict_to_str, list_sum, nildent, uniform,
-    get_record_list_recursive3,
+    dict_to_str, nildent, uniform,
+    get_record_list_recursive3, dump_json_atomic,
 )
 
 
@@ -74,6 +79,7 @@ if ModelCfg.torch_dtype.lower() == "double":
 
 __all__ = [
     "CPSC2021",
+    "RRSeqBatchSampler",
 ]
 
 
@@ -86,6 +92,9 @@ class CPSC2021(Dataset):
     2. preprocessed ECGs are sliced with overlap to generate data and label for different tasks:
         the data files stores segments of fixed length of preprocessed ECGs,
         the annotation files contain "qrs_mask", and "af_mask"
+    3. segments are stored in packed shards (one directory per subject, ref. `_write_seg_shard`)
+    if `config.segment_storage` is "shards", otherwise in .mat files (two files per segment),
+    loading falls back to the .mat files for records not yet migrated (ref. `migrate_segments_to_shards`)
     """
     __DEBUG__ = False
     __name__ = "CPSC2021"
@@ -114,7 +123,8 @@ class CPSC2021(Dataset):
         self.__data_aug = self.training
 
         # create directories if needed
-        # preprocess_dir stores pre-processed signals
+        # preprocess_dir stores pre-processed signals,
+        # keyed by the hash of the preprocessing configurations, ref. `_get_preproc_hash`
         self.preprocess_dir = os.path.join(config.db_dir, "preprocessed")
         os.makedirs(self.preprocess_dir, exist_ok=True)
         # segments_dir for sliced segments of fixed length
@@ -122,11 +132,49 @@ class CPSC2021(Dataset):
         os.makedirs(self.segments_base_dir, exist_ok=True)
         self.segment_name_pattern = "S_\d{1,3}_\d{1,2}_\d{7}"
         self.segment_ext = "mat"
+        # packed shards of segments, one directory per subject, ref. `_write_seg_shard`
+        self.segment_storage = self.config.get("segment_storage", "shards").lower()
+        assert self.segment_storage in ["shards", "mat",]
+        self.shards_base_dir = os.path.join(self.segments_base_dir, "shards")
+        # subject --> opened shard (or None), one memory map per subject, hence NOT limited
+        self._shard_cache = {}
+        # if True, shards of single records are staged only, merged by `_merge_staged_shards` later
+        self._stage_shards = False
+        # virtual segments, stored as (start_idx, end_idx, sc_ratio) triples,
+        # and built on the fly from the memory-mapped preprocessed records
+        self.virtual_segments = self.config.get("virtual_segments", False)
+        self.virtual_segments_json = os.path.join(self.segments_base_dir, "virtual_segments.json")
+        self._virtual_segments = {}  # record name --> list of (start_idx, end_idx, sc_ratio)
+        self._preprocessed_cache = OrderedDict()  # record name --> memory-mapped preprocessed signal
+        self._preprocessed_cache_size = 64  # `mmap` holds file descriptors, hence limited
+        # whether the data augmentations are performed on whole batches by the consumer of the dataset
+        # (ref. `augmentation.BatchAugmenter`), set explicitly via `enable_batch_augmentation` (by `trainer.train`),
+        # otherwise they are performed on each sample in `__getitem__`
+        self.__batch_aug = False
+        # stretch-or-compress performed online on whole batches (when batch augmentation is enabled),
+        # for which (training) samples are extended windows built from the virtual segments,
+        # and the offline stretch-or-compress is disabled, ref. `self.online_stretch_compress`
+        self._online_stretch_compress = self.virtual_segments \
+            and self.config.get("online_stretch_compress", False) \
+            and self.config.stretch_compress != 0
+        # weight masks of the segments (rr sequences), keyed by name and parameters
+        self._weight_mask_cache = OrderedDict()
+        self._weight_mask_cache_size = self.config.get("weight_mask_cache_size", 8192)
+        # logits of a teacher model of the segments, appended to the items if set,
+        # ref. `distillation.SoftTargetCache`
+        self.soft_targets = None
         # rr_dir for sequence of rr intervals of fix length
         self.rr_seq_base_dir = os.path.join(config.db_dir, "rr_seq")
         os.makedirs(self.rr_seq_base_dir, exist_ok=True)
         self.rr_seq_name_pattern = "R_\d{1,3}_\d{1,2}_\d{7}"
-        self.rr_seq_ext = "mat"
+        self.rr_seq_ext = "mat"  # the legacy format, one file per rr sequence, read only
+        # rows (rr intervals, labels, weight masks) of the rr sequences of all records, ref. `_write_rr_seq_store`,
+        # opened lazily, and rows of the records sliced but not yet written into the store
+        self._rr_seq_store = None
+        self._staged_rr_seq = {}
+        # all rr sequences of the split packed into one contiguous array, ref. `_pack_rr_seq`
+        self.rr_seq_packed = self.config.get("rr_seq_packed", True)
+        self._packed_rr_seq = None
 
         self.__set_task(task)
 
@@ -155,22 +203,29 @@ class CPSC2021(Dataset):
         else:
             self.subjects = split_res.test
 
-        if self.task in ["qrs_detection", "main",]:
-            # for qrs detection, or for the main task
+        if self.task in ["qrs_detection", "main", "multi_task",]:
+            # for qrs detection, or for the main task, or for both
             self.segments_dirs = ED()
-            self.__all_segments = ED()
+            self.__all_segments = _NameRegistry(self.reader.all_subjects)
             self.segments_json = os.path.join(self.segments_base_dir, "segments.json")
-            self._ls_segments()
-            self.segments = list_sum([self.__all_segments[subject] for subject in self.subjects])
+            if self.virtual_segments:
+                self._ls_virtual_segments()
+            else:
+                self._ls_segments()
+            self.segments = list(chain.from_iterable(self.__all_segments[subject] for subject in self.subjects))
             if self.training:
                 random.shuffle(self.segments)
         elif self.task in ["rr_lstm",]:
             self.rr_seq_dirs = ED()
-            self.__all_rr_seq = ED()
+            self.__all_rr_seq = _NameRegistry(self.reader.all_subjects)
             self.rr_seq_json = os.path.join(self.rr_seq_base_dir, "rr_seq.json")
             self._ls_rr_seq()
-            self.rr_seq = list_sum([self.__all_rr_seq[subject] for subject in self.subjects])
-            if self.training:
+            self.rr_seq = list(chain.from_iterable(self.__all_rr_seq[subject] for subject in self.subjects))
+            if self.rr_seq_packed and len(self.rr_seq) > 0:
+                # the ordering of `self.rr_seq` is that of the packed array,
+                # shuffling is left to the sampler
+                self._pack_rr_seq()
+            elif self.training:
                 random.shuffle(self.rr_seq)
         else:
             raise NotImplementedError(f"data generator for task \042{self.task}\042 not implemented")
@@ -178,6 +233,16 @@ class CPSC2021(Dataset):
         # more aux config on offline augmentations
         self.config.stretch_compress_choices = [-1,1] + [0] * int(2/self.config.stretch_compress_prob - 2)
 
+    def __getstate__(self) -> dict:
+        """
+        memory-mapped arrays are not pickled (e.g. for worker processes), but re-opened lazily
+        """
+        state = self.__dict__.copy()
+        state["_shard_cache"] = {}
+        state["_preprocessed_cache"] = OrderedDict()
+        state["_rr_seq_store"] = None
+        return state
+
     def reset_task(self, task:str) -> NoReturn:
         """ finished, checked,
         """
@@ -195,17 +260,26 @@ class CPSC2021(Dataset):
                 os.makedirs(self.segments_dirs[item][s], exist_ok=True)
         if os.path.isfile(self.segments_json):
             with open(self.segments_json, "r") as f:
-                self.__all_segments = json.load(f)
+                self.__all_segments = _NameRegistry.from_dict(json.load(f), self._get_rec_name)
             return
         print(f"please allow the reader a few minutes to collect the segments from {self.segments_base_dir}...")
         seg_filename_pattern = f"{self.segment_name_pattern}.{self.segment_ext}"
-        self.__all_segments = ED({
+        all_segments = ED({
             s: get_record_list_recursive3(self.segments_dirs.data[s], seg_filename_pattern) \
                 for s in self.reader.all_subjects
         })
+        for s in self.reader.all_subjects:
+            meta_fp = os.path.join(self._get_shard_dir(s), "meta.npz")
+            if not os.path.isfile(meta_fp):
+                continue  # no (complete) shard
+            with np.load(meta_fp) as meta:
+                shard_segs = [
+                    self._get_seg_names(rec, [i])[0] for rec, i in zip(meta["record"], meta["index"])
+                ]
+            all_segments[s] = sorted(set(all_segments[s]).union(shard_segs))
+        self.__all_segments = _NameRegistry.from_dict(all_segments, self._get_rec_name)
         if all([len(self.__all_segments[s])>0 for s in self.reader.all_subjects]):
-            with open(self.segments_json, "w") as f:
-                json.dump(self.__all_segments, f)
+            self.__all_segments.dump(self.segments_json)
 
     def _ls_rr_seq(self) -> NoReturn:
         """ finished, checked,
@@ -217,44 +291,60 @@ class CPSC2021(Dataset):
             os.makedirs(self.rr_seq_dirs[s], exist_ok=True)
         if os.path.isfile(self.rr_seq_json):
             with open(self.rr_seq_json, "r") as f:
-                self.__all_rr_seq = json.load(f)
+                self.__all_rr_seq = _NameRegistry.from_dict(json.load(f), self._get_rec_name)
             return
         print(f"please allow the reader a few minutes to collect the rr sequences from {self.rr_seq_base_dir}...")
         rr_seq_filename_pattern = f"{self.rr_seq_name_pattern}.{self.rr_seq_ext}"
-        self.__all_rr_seq = ED({
+        all_rr_seq = {
             s: get_record_list_recursive3(self.rr_seq_dirs[s], rr_seq_filename_pattern) \
                 for s in self.reader.all_subjects
-        })
+        }
+        for seq_name in self._load_rr_seq_store().names:
+            all_rr_seq[self.reader.get_subject_id(self._get_rec_name(seq_name))].append(seq_name)
+        self.__all_rr_seq = _NameRegistry.from_dict(
+            {s: sorted(set(names)) for s, names in all_rr_seq.items()}, self._get_rec_name,
+        )
         if all([len(self.__all_rr_seq[s])>0 for s in self.reader.all_subjects]):
-            with open(self.rr_seq_json, "w") as f:
-                json.dump(self.__all_rr_seq, f)
+            self.__all_rr_seq.dump(self.rr_seq_json)
 
     @property
     def all_segments(self) -> ED:
-        if self.task in ["qrs_detection", "main",]:
-            return self.__all_segments
+        if self.task in ["qrs_detection", "main", "multi_task",]:
+            return self.__all_segments.to_dict()
         else:
             return ED()
 
     @property
     def all_rr_seq(self) -> ED:
         if self.task.lower() in ["rr_lstm",]:
-            return self.__all_rr_seq
+            return self.__all_rr_seq.to_dict()
         else:
             return ED()
 
     def __getitem__(self, index:int) -> Tuple[np.ndarray, np.ndarray]:
         """ finished, checked,
         """
-        if self.task in ["qrs_detection", "main",]:
+        if self.task in ["qrs_detection", "main", "multi_task",]:
             seg_name = self.segments[index]
+            if self.online_stretch_compress and self.__data_aug:
+                # labels (and weight masks) are generated after the stretch-or-compress of the batch
+                return self._load_extended_segment(seg_name)
             seg_data = self._load_seg_data(seg_name)
-            if self.config[self.task].model_name == "unet":
+            if self.task == "multi_task":
+                # labels of the qrs head and of the af head, concatenated along the channel dimension
+                seg_label = np.concatenate([
+                    self._load_seg_seq_lab(seg_name, reduction=self.config[self.task].reduction, task=t) \
+                        for t in ["qrs_detection", "main",]
+                ], axis=-1)
+            elif self.config[self.task].model_name == "unet":
                 seg_label = self._load_seg_mask(seg_name)
             else:  # "seq_lab"
                 seg_label = self._load_seg_seq_lab(seg_name, reduction=self.config[self.task].reduction)
             # augmentation
-            if self.__data_aug:
+            if self.__data_aug and self.__batch_aug:
+                # performed on whole batches, ref. `augmentation.BatchAugmenter`
+                pass
+            elif self.__data_aug:
                 if len(self.config.flip) > 0:
                     sign = random.sample(self.config.flip, 1)[0]
                     seg_data *= sign
@@ -286,31 +376,93 @@ class CPSC2021(Dataset):
                         std=list(repeat(np.mean(self.config.random_normalize_std), self.config.n_leads)),
                         per_channel=True,
                     )
-            if self.task == "main":
-                weight_mask = _generate_weight_mask(
-                    target_mask=seg_label.squeeze(-1),
+            if self.task in ["main", "multi_task",]:
+                # for the task "multi_task", only the af head is weighted
+                weight_mask = self._get_weight_mask(
+                    name=seg_name,
+                    target_mask=seg_label[..., -1],
                     fg_weight=2,
                     fs=self.config.fs,
                     reduction=self.config[self.task].reduction,
                     radius=0.8,
                     boundary_weight=5,
                 )[..., np.newaxis]
-                return seg_data, seg_label, weight_mask
-            return seg_data, seg_label
+                items = (seg_data, seg_label, weight_mask)
+            else:
+                items = (seg_data, seg_label)
+            if self.soft_targets is not None:
+                # for knowledge distillation
+                items += (self.soft_targets[seg_name],)
+            return items
         elif self.task in ["rr_lstm",]:
+            if self._packed_rr_seq is not None:
+                # `index` can also be a slice or an array of indices, ref. `RRSeqBatchSampler`
+                packed = np.array(self._packed_rr_seq[index])
+                return packed[..., :1], packed[..., 1:1+self.n_classes].astype(int), packed[..., -1:]
             rr_seq = self._load_rr_seq(self.rr_seq[index])
-            weight_mask = _generate_weight_mask(
+            weight_mask = self._get_weight_mask(
+                name=self.rr_seq[index],
                 target_mask=rr_seq["label"].squeeze(-1), 
-                fg_weight=2, fs=1/0.8, reduction=1, radius=2, boundary_weight=5
+                **_RR_WEIGHT_MASK_KW,
             )[..., np.newaxis]
             return rr_seq["rr"], rr_seq["label"], weight_mask
         else:
             raise NotImplementedError(f"data generator for task \042{self.task}\042 not implemented")
 
+    def _get_weight_mask(self, name:str, target_mask:np.ndarray, **kwargs) -> np.ndarray:
+        """ finished, NOT checked,
+
+        get the weight mask of the segment (or rr sequence) via `_generate_weight_mask`,
+        which depends only on the label of the segment, hence cached,
+        the cache is cleared whenever the segments (rr sequences) are regenerated or re-sliced,
+        ref. `_drop_cached_weight_masks`
+
+        Parameters
+        ----------
+        name: str,
+            name of the segment (or rr sequence)
+        target_mask: ndarray,
+            the target mask (label) of the segment, assumed to be 1d
+        kwargs: dict,
+            key word arguments of `_generate_weight_mask`, other than `target_mask`
+
+        Returns
+        -------
+        weight_mask: ndarray,
+            the weight mask
+        """
+        key = (name,) + tuple(sorted(kwargs.items()))
+        if key in self._weight_mask_cache:
+            self._weight_mask_cache.move_to_end(key)
+            return self._weight_mask_cache[key].copy()
+        weight_mask = _generate_weight_mask(target_mask=target_mask, **kwargs)
+        if self._weight_mask_cache_size > 0:
+            self._weight_mask_cache[key] = weight_mask.copy()
+            while len(self._weight_mask_cache) > self._weight_mask_cache_size:
+                self._weight_mask_cache.popitem(last=False)
+        return weight_mask
+
+    def _drop_cached_weight_masks(self, rec:Optional[str]=None) -> NoReturn:
+        """ finished, NOT checked,
+
+        drop the cached weight masks, since the names of the segments (rr sequences) are reused
+        by the regenerated (re-sliced) ones, with different intervals and labels
+
+        Parameters
+        ----------
+        rec: str, optional,
+            the record whose segments (and rr sequences) are dropped, defaults to all records
+        """
+        if rec is None:
+            self._weight_mask_cache.clear()
+            return
+        for key in [k for k in self._weight_mask_cache if self._get_rec_name(k[0]) == rec]:
+            del self._weight_mask_cache[key]
+
     def __len__(self) -> int:
         """ finished,
         """
-        if self.task in ["qrs_detection", "main",]:
+        if self.task in ["qrs_detection", "main", "multi_task",]:
             return len(self.segments)
         else:  # "rr_lstm"
             return len(self.rr_seq)
@@ -362,6 +514,14 @@ class CPSC2021(Dataset):
         seg_data: ndarray,
             data of the segment, of shape (2, `self.seglen`)
         """
+        if self.virtual_segments:
+            rec = self._get_rec_name(seg)
+            start_idx, end_idx, _ = self._virtual_segments[rec][int(seg[-7:])]
+            return self._get_segment_data(self._load_preprocessed_mmap(rec), start_idx, end_idx)
+        located = self._locate_seg(seg)
+        if located is not None:
+            shard, row = located
+            return np.array(shard.rows["data"][row])
         seg_data_fp = self._get_seg_data_path(seg)
         seg_data = loadmat(seg_data_fp)["ecg"]
         return seg_data
@@ -382,11 +542,357 @@ class CPSC2021(Dataset):
             - qrs_mask: mask of qrs complexes of the segment
             - af_mask: mask of af episodes of the segment
             - interval: interval ([start_idx, end_idx]) in the original ECG record of the segment
+            - qrs_seq_lab_<reduction>, af_seq_lab_<reduction>: reduced sequence labels of the segment,
+              ref. `self._get_seq_labs`, absent for segments sliced without them
         """
+        if self.virtual_segments:
+            rec = self._get_rec_name(seg)
+            seg_ann = self._build_segment(rec, *self._virtual_segments[rec][int(seg[-7:])])
+            seg_ann = {k: np.array(v, dtype=int) for k, v in seg_ann.items()}
+            return seg_ann
+        located = self._locate_seg(seg)
+        if located is not None:
+            shard, row = located
+            seg_ann = {
+                "rpeaks": np.array(shard.rpeaks[shard.rpeaks_ptr[row]:shard.rpeaks_ptr[row+1]], dtype=int),
+                "interval": np.array(shard.interval[row], dtype=int),
+            }
+            seg_ann.update({
+                k: np.array(shard.rows[k][row], dtype=int) for k in shard.rows.dtype.names if k != "data"
+            })
+            return seg_ann
         seg_ann_fp = self._get_seg_ann_path(seg)
         seg_ann = {k:v.flatten() for k,v in loadmat(seg_ann_fp).items() if not k.startswith("__")}
         return seg_ann
 
+    def _load_extended_segment(self, seg:str) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """ finished, NOT checked,
+
+        load the (virtual) segment along with its surroundings,
+        so that the window can be stretched or compressed online, ref. `augmentation.BatchAugmenter`
+
+        Parameters
+        ----------
+        seg: str,
+            name of the segment, of pattern like "S_1_1_0000193"
+
+        Returns
+        -------
+        ext_data: ndarray,
+            data of the extended window, of shape (2, `self._sc_ext_len`),
+            right-padded with edge values if the record is too short
+        rpeaks_mask: ndarray,
+            mask of the extended window, being 1 at the rpeaks and 0 elsewhere
+        af_mask: ndarray,
+            mask of af episodes of the extended window
+        offset: ndarray,
+            start index (0-d array) of the segment in the extended window
+        """
+        rec = self._get_rec_name(seg)
+        start_idx, end_idx, _ = self._virtual_segments[rec][int(seg[-7:])]
+        data = self._load_preprocessed_mmap(rec)
+        siglen = data.shape[1]
+        ext_len = self._sc_ext_len
+        ext_start = min(max(0, start_idx - (ext_len - self.seglen) // 2), max(0, siglen - ext_len))
+        ext_end = min(ext_start + ext_len, siglen)
+        ext_data = np.array(data[..., ext_start: ext_end], dtype=self.dtype)
+        if ext_end - ext_start < ext_len:
+            ext_data = np.pad(ext_data, ((0, 0), (0, ext_len - ext_end + ext_start)), mode="edge")
+        beat_ann = self.reader.load_beat_ann(rec)
+        rpeaks_mask = np.zeros((ext_len,), dtype=np.int8)
+        rpeaks_mask[
+            beat_ann.rpeaks[(beat_ann.rpeaks >= ext_start) & (beat_ann.rpeaks < ext_end)] - ext_start
+        ] = 1
+        af_mask = np.zeros((ext_len,), dtype=np.int8)
+        for itv in generalized_intervals_intersection(beat_ann.af_intervals.tolist(), [[ext_start, ext_end]]):
+            af_mask[itv[0]-ext_start: itv[1]-ext_start] = 1
+        return ext_data, rpeaks_mask, af_mask, np.array(start_idx - ext_start)
+
+    @property
+    def _sc_ext_len(self) -> int:
+        """
+        length of the extended windows, enough for the maximum compression of the segments
+        """
+        return int(np.ceil(self.seglen * (1 + self.config.stretch_compress / 100))) + 1
+
+    def _get_shard_dir(self, subject:str) -> str:
+        """ finished, NOT checked,
+
+        Parameters
+        ----------
+        subject: str,
+            the subject
+
+        Returns
+        -------
+        shard_dir: str,
+            directory of the packed shard of the segments of (all the records of) the subject
+        """
+        shard_dir = os.path.join(self.shards_base_dir, subject)
+        return shard_dir
+
+    @property
+    def _shard_staging_dir(self) -> str:
+        """
+        directory of the shards of single records, written by the (parallel) slicing jobs,
+        and merged into the shards of the subjects in the main process, ref. `_merge_staged_shards`
+        """
+        return os.path.join(self.shards_base_dir, ".staging")
+
+    def _get_seg_names(self, rec:str, index:Sequence[int]) -> List[str]:
+        """ finished, NOT checked,
+
+        Parameters
+        ----------
+        rec: str,
+            filename of the record
+        index: sequence of int,
+            the numbering (suffixes) of the segments
+
+        Returns
+        -------
+        list of str,
+            names of the segments, of pattern like "S_1_1_0000193"
+        """
+        return [f"{rec}_{i:07d}".replace("data", "S") for i in index]
+
+    def _write_seg_shard(self, rec:str, segments:List[ED], index:Optional[Sequence[int]]=None) -> NoReturn:
+        """ finished, NOT checked,
+
+        write the segments of one record into a packed shard, which is a directory containing
+        - rows.npy: a structured array, one row per segment, with the fields
+          "data" (n_leads, `self.seglen`), "qrs_mask", "af_mask" (`self.seglen`,),
+          and the reduced sequence labels "qrs_seq_lab_<reduction>", "af_seq_lab_<reduction>",
+          which is memory-mapped when loading, so that one segment is one contiguous read
+        - meta.npz: the index table, loaded into memory, with the arrays
+          "record", "index" (numbering, i.e. suffixes of names, of the segments), "interval",
+          and the concatenated rpeaks of the segments "rpeaks", "rpeaks_ptr",
+          rpeaks of the i-th segment are `rpeaks[rpeaks_ptr[i]:rpeaks_ptr[i+1]]`
+
+        the shard of the record is staged, and merged into the shard of the subject (of the same format)
+        right away, or after all the slicing jobs if they run in parallel, ref. `_merge_staged_shards`
+
+        Parameters
+        ----------
+        rec: str,
+            filename of the record
+        segments: list of dict,
+            list of the segments (meta-)data, ref. `self.__generate_segment`
+        index: sequence of int, optional,
+            numbering of the segments, defaults to `range(len(segments))`
+        """
+        index = np.arange(len(segments)) if index is None else np.array(index)
+        fields = [
+            ("data", self.dtype, segments[0].data.shape),
+            ("qrs_mask", np.int8, (self.seglen,)),
+            ("af_mask", np.int8, (self.seglen,)),
+        ] + [
+            (k, np.int8, (len(np.array(segments[0][k]).flatten()),)) \
+                for k in sorted(segments[0].keys()) if "_seq_lab_" in k
+        ]
+        rows = np.zeros((len(segments),), dtype=fields)
+        for name, _, shape in fields:
+            rows[name] = np.stack([np.array(seg[name]).reshape(shape) for seg in segments])
+        rpeaks = [np.array(seg.rpeaks, dtype=np.int32).flatten() for seg in segments]
+        meta = {
+            "record": np.array([rec] * len(segments)),
+            "index": index.astype(np.int32),
+            "interval": np.stack([np.array(seg.interval).flatten() for seg in segments]).astype(np.int64),
+            "rpeaks": np.concatenate(rpeaks) if len(rpeaks) > 0 else np.zeros((0,), dtype=np.int32),
+            "rpeaks_ptr": np.concatenate([[0], np.cumsum([len(r) for r in rpeaks])]).astype(np.int64),
+        }
+        shard_dir = os.path.join(self._shard_staging_dir, rec)
+        tmp_dir = f"{shard_dir}.{os.getpid()}.tmp"
+        os.makedirs(tmp_dir, exist_ok=True)
+        np.save(os.path.join(tmp_dir, "rows.npy"), rows)
+        np.savez(os.path.join(tmp_dir, "meta.npz"), **meta)  # written the last, marking the shard complete
+        _replace_dir(tmp_dir, shard_dir)
+        if not self._stage_shards:
+            self._merge_staged_shards()
+
+    def _merge_staged_shards(self) -> NoReturn:
+        """ finished, NOT checked,
+
+        merge the staged shards of single records into the shards of the subjects,
+        replacing the existing segments of these records
+        """
+        if not os.path.isdir(self._shard_staging_dir):
+            return
+        staged = {}  # subject --> records
+        for rec in sorted(os.listdir(self._shard_staging_dir)):
+            if not os.path.isfile(os.path.join(self._shard_staging_dir, rec, "meta.npz")):
+                continue  # incomplete, e.g. interrupted writing
+            staged.setdefault(self.reader.get_subject_id(rec), []).append(rec)
+        for subject, recs in staged.items():
+            self._rewrite_seg_shard(subject, staged_recs=recs)
+            for rec in recs:
+                shutil.rmtree(os.path.join(self._shard_staging_dir, rec))
+
+    def _rewrite_seg_shard(self,
+                           subject:str,
+                           staged_recs:Sequence[str]=(),
+                           drop_recs:Sequence[str]=()) -> NoReturn:
+        """ finished, NOT checked,
+
+        rewrite the shard of the subject, with the segments of `staged_recs` (staged shards)
+        replacing the existing ones, and the segments of `drop_recs` removed,
+        the rows are copied in chunks between memory-mapped arrays, rather than loaded as a whole,
+        and the old shard is swapped out only when the new one is complete
+
+        Parameters
+        ----------
+        subject: str,
+            the subject
+        staged_recs: sequence of str, default empty,
+            records whose staged shards are merged
+        drop_recs: sequence of str, default empty,
+            records whose segments are removed
+        """
+        shard_dir = self._get_shard_dir(subject)
+        sources = []  # (shard, rows of the shard to take)
+        current = _open_seg_shard(shard_dir)
+        if current is not None:
+            keep = ~np.isin(current.record, list(staged_recs) + list(drop_recs))
+            if keep.all() and len(staged_recs) == 0:
+                return  # nothing to drop
+            sources.append((current, np.where(keep)[0]))
+        elif len(staged_recs) == 0:
+            return
+        for rec in staged_recs:
+            shard = _open_seg_shard(os.path.join(self._shard_staging_dir, rec))
+            sources.append((shard, np.arange(len(shard.index))))
+        sources = [(shard, rows) for shard, rows in sources if len(rows) > 0]
+        self._shard_cache.pop(subject, None)
+        if len(sources) == 0:
+            if os.path.isdir(shard_dir):
+                shutil.rmtree(shard_dir)
+            return
+        # fields absent from some of the sources (e.g. sliced with other reductions) are left out,
+        # and computed from the masks when loading, ref. `_load_seg_seq_lab`
+        names = [n for n in sources[0][0].rows.dtype.names if all([n in s.rows.dtype.names for s, _ in sources])]
+        dtype = np.dtype([(n, sources[0][0].rows.dtype.fields[n][0]) for n in names])
+        tmp_dir = f"{shard_dir}.{os.getpid()}.tmp"
+        os.makedirs(tmp_dir, exist_ok=True)
+        rows_out = np.lib.format.open_memmap(
+            os.path.join(tmp_dir, "rows.npy"), mode="w+", dtype=dtype, shape=(sum([len(r) for _, r in sources]),),
+        )
+        meta = {k: [] for k in ["record", "index", "interval", "rpeaks",]}
+        rpeaks_len, start, chunk = [], 0, 256
+        for shard, rows in sources:
+            for i in range(0, len(rows), chunk):
+                sel = rows[i: i+chunk]
+                for n in names:
+                    rows_out[n][start+i: start+i+len(sel)] = shard.rows[n][sel]
+            for k in ["record", "index", "interval",]:
+                meta[k].append(shard[k][rows])
+            meta["rpeaks"].extend([shard.rpeaks[shard.rpeaks_ptr[r]: shard.rpeaks_ptr[r+1]] for r in rows])
+            rpeaks_len.append(shard.rpeaks_ptr[rows+1] - shard.rpeaks_ptr[rows])
+            start += len(rows)
+        rows_out.flush()
+        del rows_out
+        meta = {k: np.concatenate(v) for k, v in meta.items()}
+        meta["rpeaks"] = meta["rpeaks"].astype(np.int32)
+        meta["rpeaks_ptr"] = np.concatenate([[0], np.cumsum(np.concatenate(rpeaks_len))]).astype(np.int64)
+        np.savez(os.path.join(tmp_dir, "meta.npz"), **meta)
+        _replace_dir(tmp_dir, shard_dir)
+
+    def _load_seg_shard(self, subject:str) -> Optional[ED]:
+        """ finished, NOT checked,
+
+        Parameters
+        ----------
+        subject: str,
+            the subject
+
+        Returns
+        -------
+        shard: dict, or None,
+            the packed shard of the subject, ref. `_write_seg_shard`,
+            with the rows memory-mapped and the index table in memory,
+            along with `row_of`, mapping record names to arrays mapping numbering of segments to rows
+            (-1 for absent ones),
+            None if the subject has no (complete) shard, which is also cached,
+            one memory map per subject, hence the shards of all the subjects are kept open
+        """
+        if subject in self._shard_cache:
+            return self._shard_cache[subject]
+        shard = _open_seg_shard(self._get_shard_dir(subject))
+        if shard is not None:
+            shard.row_of = {}
+            for rec in np.unique(shard.record):
+                rows = np.where(shard.record == rec)[0]
+                row_of = np.full((shard.index[rows].max(initial=-1)+1,), -1, dtype=np.int64)
+                row_of[shard.index[rows]] = rows
+                shard.row_of[str(rec)] = row_of
+        self._shard_cache[subject] = shard
+        return shard
+
+    def _locate_seg(self, seg:str) -> Optional[Tuple[ED, int]]:
+        """ finished, NOT checked,
+
+        Parameters
+        ----------
+        seg: str,
+            name of the segment, of pattern like "S_1_1_0000193"
+
+        Returns
+        -------
+        2-tuple of (dict, int), or None,
+            the shard containing the segment, and the row of the segment in it,
+            None if the segment is not stored in shards
+        """
+        rec = self._get_rec_name(seg)
+        shard = self._load_seg_shard(self.reader.get_subject_id(rec))
+        if shard is None or rec not in shard.row_of:
+            return None
+        row_of = shard.row_of[rec]
+        i = int(seg[-7:])
+        if i >= len(row_of) or row_of[i] < 0:
+            return None
+        return shard, row_of[i]
+
+    def migrate_segments_to_shards(self, remove_legacy:bool=False, verbose:int=0) -> NoReturn:
+        """ finished, NOT checked,
+
+        pack the existing segments stored in .mat files into shards,
+        staged record by record, and merged subject by subject
+
+        Parameters
+        ----------
+        remove_legacy: bool, default False,
+            if True, the .mat files of the migrated segments will be removed
+        verbose: int, default 0,
+            print verbosity
+        """
+        self.__assert_task(["qrs_detection", "main",])
+        migrated = []
+        self._stage_shards = True
+        try:
+            for idx, rec in enumerate(self.reader.all_records):
+                rec_segs = sorted([
+                    item for item in self.__all_segments.get(rec) \
+                        if os.path.isfile(self._get_seg_data_path(item))
+                ])
+                if len(rec_segs) == 0:
+                    continue
+                segments = []
+                for seg in rec_segs:
+                    # read from the .mat files directly, in case of an existing shard of the record
+                    seg_ann = {k:v.flatten() for k,v in loadmat(self._get_seg_ann_path(seg)).items() if not k.startswith("__")}
+                    seg_ann.update(self._get_seq_labs(seg_ann["qrs_mask"], seg_ann["af_mask"]))
+                    segments.append(ED(data=loadmat(self._get_seg_data_path(seg))["ecg"], **seg_ann))
+                self._write_seg_shard(rec, segments, index=[int(seg[-7:]) for seg in rec_segs])
+                migrated.extend(rec_segs)
+                if verbose >= 1:
+                    print(f"{idx+1}/{len(self.reader.all_records)} records", end="\r")
+        finally:
+            self._stage_shards = False
+        self._merge_staged_shards()
+        if remove_legacy:
+            for seg in migrated:
+                os.remove(self._get_seg_data_path(seg))
+                os.remove(self._get_seg_ann_path(seg))
+
     def _load_seg_mask(self, seg:str, task:Optional[str]=None) -> Union[np.ndarray, Dict[str, np.ndarray]]:
         """ finished, checked,
 
@@ -414,7 +920,7 @@ class CPSC2021(Dataset):
             seg_mask = seg_mask["af_mask"]
         return seg_mask
 
-    def _load_seg_seq_lab(self, seg:str, reduction:int=8) -> np.ndarray:
+    def _load_seg_seq_lab(self, seg:str, reduction:int=8, task:Optional[str]=None) -> np.ndarray:
         """ finished, checked,
 
         Parameters
@@ -424,24 +930,52 @@ class CPSC2021(Dataset):
         reduction: int, default 8,
             reduction (granularity) of length of the model output,
             compared to the original signal length
+        task: str, optional,
+            if specified, overrides self.task,
+            one of "qrs_detection", "main"
 
         Returns
         -------
         seq_lab: np.ndarray,
             label of the sequence,
-            of shape (self.seglen//reduction, self.n_classes)
-        """
-        seg_mask = self._load_seg_mask(seg)
-        seg_len, n_classes = seg_mask.shape
-        seq_lab = np.stack(
-            arrays=[
-                np.mean(seg_mask[reduction*idx:reduction*(idx+1)],axis=0,keepdims=True).astype(int) \
-                    for idx in range(seg_len//reduction)
-            ],
-            axis=0,
-        ).squeeze(axis=1)
+            of shape (self.seglen//reduction, 1)
+        """
+        _task = (task or self.task).lower()
+        key = f"{'qrs' if _task == 'qrs_detection' else 'af'}_seq_lab_{reduction}"
+        located = None if self.virtual_segments else self._locate_seg(seg)
+        if located is not None and key in located[0].rows.dtype.names:
+            # precomputed at slicing time
+            shard, row = located
+            return np.array(shard.rows[key][row], dtype=int).reshape((self.seglen//reduction, -1))
+        seg_ann = self._load_seg_ann(seg)
+        if key in seg_ann:
+            return seg_ann[key].astype(int).reshape((self.seglen//reduction, -1))
+        # segments sliced without the reduced sequence labels
+        seg_mask = seg_ann["qrs_mask" if _task == "qrs_detection" else "af_mask"].reshape((self.seglen, -1))
+        seq_lab = _reduce_mask(seg_mask, reduction)
         return seq_lab
 
+    def _get_seq_labs(self, qrs_mask:np.ndarray, af_mask:np.ndarray) -> Dict[str, np.ndarray]:
+        """ finished, NOT checked,
+
+        Parameters
+        ----------
+        qrs_mask, af_mask: ndarray,
+            masks of the segment, of shape (self.seglen,)
+
+        Returns
+        -------
+        seq_labs: dict,
+            reduced sequence labels of the segment, for the reductions of the tasks "qrs_detection" and "main",
+            keyed by "qrs_seq_lab_<reduction>" and "af_seq_lab_<reduction>"
+        """
+        reductions = sorted(set([self.config[t].reduction for t in ["qrs_detection", "main", "multi_task",]]))
+        seq_labs = {}
+        for r in reductions:
+            seq_labs[f"qrs_seq_lab_{r}"] = _reduce_mask(np.asarray(qrs_mask), r)
+            seq_labs[f"af_seq_lab_{r}"] = _reduce_mask(np.asarray(af_mask), r)
+        return seq_labs
+
     def _get_rr_seq_path(self, seq_name:str) -> str:
         """ finished, checked,
 
@@ -475,6 +1009,16 @@ class CPSC2021(Dataset):
             - label: label of the rr intervals, 0 for normal, 1 for af, of shape (self.seglen, self.n_classes)
             - interval: interval of the current rr sequence in the whole rr sequence in the original record
         """
+        store = self._load_rr_seq_store()
+        if seq_name in store.row_of:
+            row = np.array(store.rows[store.row_of[seq_name]])
+            rr_seq = {
+                "rr": row[:, :1],
+                "label": row[:, 1:1+self.n_classes].astype(int),
+                "interval": np.array(store.intervals[store.row_of[seq_name]]),
+            }
+            return rr_seq
+        # the legacy .mat files
         rr_seq_path = self._get_rr_seq_path(seq_name)
         rr_seq = {k:v for k,v in loadmat(rr_seq_path).items() if not k.startswith("__")}
         rr_seq["rr"] = rr_seq["rr"].reshape((self.seglen, 1))
@@ -482,6 +1026,173 @@ class CPSC2021(Dataset):
         rr_seq["interval"] = rr_seq["interval"].flatten()
         return rr_seq
 
+    def _pack_rr_seq(self, force_recompute:bool=False, verbose:int=0) -> NoReturn:
+        """ finished, NOT checked,
+
+        pack the rr sequences of the split (`self.rr_seq`) into one contiguous float32 array,
+        of shape (n_rr_seq, self.seglen, 1 + self.n_classes + 1),
+        the channels being the rr intervals, the labels, and the (precomputed) weight masks,
+        selected from the rows of all records written at slicing time (ref. `_write_rr_seq_store`),
+        with rr sequences in the legacy .mat files read one by one,
+        stored in one .npy file (along with a .json file of the names of the rr sequences),
+        which is memory-mapped, hence shared by the DataLoader workers,
+        keyed by the slicing configurations (ref. `_get_rr_pack_hash`),
+        and is rebuilt if the rr sequences of the split change,
+        the packed files are removed whenever the rr sequences are re-sliced (ref. `_invalidate_rr_seq`)
+
+        Parameters
+        ----------
+        force_recompute: bool, default False,
+            if True, recompute regardless of possible existing files
+        verbose: int, default 0,
+            print verbosity
+
+        NOTE
+        ----
+        rr sequences of length other than `self.seglen` (which can not be loaded via `_load_rr_seq`) are skipped
+        """
+        self.__assert_task(["rr_lstm"])
+        split = f"{'train' if self.training else 'test'}_ratio_{int(self.config.train_ratio*100)}"
+        packed_fp = os.path.join(self.rr_seq_base_dir, f"packed_{split}_{self._get_rr_pack_hash()}.npy")
+        names_fp = f"{os.path.splitext(packed_fp)[0]}.json"
+        rr_seq = sorted(self.rr_seq)
+        if (not force_recompute) and os.path.isfile(packed_fp) and os.path.isfile(names_fp):
+            with open(names_fp, "r") as f:
+                packed_names = json.load(f)
+            if packed_names["all"] == rr_seq:
+                self.rr_seq = packed_names["packed"]
+                self._packed_rr_seq = np.load(packed_fp, mmap_mode="r")
+                return
+        if verbose >= 1:
+            print(f"packing {len(rr_seq)} rr sequences into {packed_fp}...")
+        store = self._load_rr_seq_store()
+        packed_names = [seq_name for seq_name in rr_seq if seq_name in store.row_of]
+        packed = [np.asarray(store.rows[[store.row_of[seq_name] for seq_name in packed_names]])] \
+            if len(packed_names) > 0 else []
+        for seq_name in rr_seq:
+            if seq_name in store.row_of or not os.path.isfile(self._get_rr_seq_path(seq_name)):
+                continue
+            # the legacy .mat files
+            item = {k:v for k,v in loadmat(self._get_rr_seq_path(seq_name)).items() if not k.startswith("__")}
+            if item["rr"].size != self.seglen:
+                continue
+            label = item["label"].reshape((self.seglen, self.n_classes))
+            weight_mask = _generate_weight_mask(target_mask=label[:, 0], **_RR_WEIGHT_MASK_KW)
+            packed.append(np.concatenate([
+                item["rr"].reshape((self.seglen, 1)), label, weight_mask.reshape((self.seglen, 1)),
+            ], axis=1)[np.newaxis, ...])
+            packed_names.append(seq_name)
+        packed = np.concatenate(packed).astype(np.float32) if len(packed) > 0 \
+            else np.zeros((0, self.seglen, self.n_classes+2), dtype=np.float32)
+        tmp_fp = f"{packed_fp}.{os.getpid()}.tmp.npy"
+        np.save(tmp_fp, packed)
+        os.replace(tmp_fp, packed_fp)
+        dump_json_atomic({"all": rr_seq, "packed": packed_names}, names_fp)
+        self.rr_seq = packed_names
+        self._packed_rr_seq = np.load(packed_fp, mmap_mode="r")
+
+    def _get_rr_pack_hash(self) -> str:
+        """ finished, NOT checked,
+
+        Returns
+        -------
+        str, (shortened) sha1 hash of the configurations of slicing (and packing) the rr sequences,
+        so that the names of the rr sequences (which are reused by the re-sliced ones)
+        are NOT the only key of the packed files
+        """
+        pack_config = json.dumps({
+            "seglen": int(self.seglen),
+            "overlap_len": int(self.config[self.task].overlap_len),
+            "critical_overlap_len": int(self.config[self.task].critical_overlap_len),
+            "classes": list(self.all_classes),
+            "weight_mask": _RR_WEIGHT_MASK_KW,
+        }, sort_keys=True)
+        return hashlib.sha1(pack_config.encode("utf-8")).hexdigest()[:12]
+
+    def _remove_packed_rr_seq(self) -> NoReturn:
+        """ finished, NOT checked,
+
+        remove the packed files of the rr sequences (of all splits and configurations),
+        which are outdated once (some of) the rr sequences are re-sliced
+        """
+        self._packed_rr_seq = None
+        for f in os.listdir(self.rr_seq_base_dir):
+            if f.startswith("packed_") and os.path.isfile(os.path.join(self.rr_seq_base_dir, f)):
+                os.remove(os.path.join(self.rr_seq_base_dir, f))
+
+    def _get_rr_seq_store_dir(self) -> str:
+        """ finished, NOT checked,
+
+        Returns
+        -------
+        str, directory of the rows of the rr sequences of all records,
+        keyed by the slicing configurations (ref. `_get_rr_pack_hash`)
+        """
+        return os.path.join(self.rr_seq_base_dir, f"rows_{self._get_rr_pack_hash()}")
+
+    def _load_rr_seq_store(self) -> ED:
+        """ finished, NOT checked,
+
+        Returns
+        -------
+        store: dict,
+            the rows of the rr sequences of all records (memory-mapped, None if not written yet),
+            of the layout of the packed array (ref. `_pack_rr_seq`),
+            the names and the intervals of the rr sequences, and `row_of`, mapping names to rows
+        """
+        if self._rr_seq_store is not None:
+            return self._rr_seq_store
+        store_dir = self._get_rr_seq_store_dir()
+        store = ED(rows=None, names=[], intervals=[])
+        if os.path.isfile(os.path.join(store_dir, "meta.json")):
+            with open(os.path.join(store_dir, "meta.json"), "r") as f:
+                store.update(json.load(f))
+            store.rows = np.load(os.path.join(store_dir, "rows.npy"), mmap_mode="r")
+        store.row_of = {}
+        for i, seq_name in enumerate(store.names):
+            store.row_of[seq_name] = i
+        self._rr_seq_store = store
+        return self._rr_seq_store
+
+    def _write_rr_seq_store(self, drop_recs:Sequence[str]=()) -> NoReturn:
+        """ finished, NOT checked,
+
+        write the rows of the rr sequences of all records into one .npy file (`rows.npy`),
+        along with the names and the intervals of the rr sequences (`meta.json`),
+        the staged rows (ref. `_slice_rr_seq_one_record`) replacing the existing rows of these records,
+        and the rows of `drop_recs` removed,
+        the directory of the store is swapped as a whole, and the packed arrays of the splits are removed
+
+        Parameters
+        ----------
+        drop_recs: sequence of str, default empty,
+            records whose rr sequences are removed
+        """
+        store = self._load_rr_seq_store()
+        drop = set(drop_recs).union(self._staged_rr_seq.keys())
+        keep = [i for i, seq_name in enumerate(store.names) if self._get_rec_name(seq_name) not in drop]
+        if len(keep) == len(store.names) and len(self._staged_rr_seq) == 0:
+            return
+        rows = [np.asarray(store.rows[keep])] if store.rows is not None else []
+        names = [store.names[i] for i in keep]
+        intervals = [store.intervals[i] for i in keep]
+        for rec in sorted(self._staged_rr_seq):
+            staged = self._staged_rr_seq[rec]
+            rows.append(staged.rows)
+            names.extend(staged.names)
+            intervals.extend(staged.intervals)
+        rows = np.concatenate(rows).astype(np.float32) if len(rows) > 0 \
+            else np.zeros((0, self.seglen, self.n_classes+2), dtype=np.float32)
+        store_dir = self._get_rr_seq_store_dir()
+        tmp_dir = f"{store_dir}.{os.getpid()}.tmp"
+        os.makedirs(tmp_dir, exist_ok=True)
+        np.save(os.path.join(tmp_dir, "rows.npy"), rows)
+        dump_json_atomic({"names": names, "intervals": intervals}, os.path.join(tmp_dir, "meta.json"))
+        _replace_dir(tmp_dir, store_dir)
+        self._rr_seq_store = None
+        self._staged_rr_seq = {}
+        self._remove_packed_rr_seq()
+
     def disable_data_augmentation(self) -> NoReturn:
         """
         """
@@ -496,10 +1207,36 @@ class CPSC2021(Dataset):
     def use_augmentation(self) -> bool:
         return self.__data_aug
 
-    def persistence(self, force_recompute:bool=False, verbose:int=0) -> NoReturn:
+    def enable_batch_augmentation(self) -> NoReturn:
+        """
+        the data augmentations are taken over by the consumer (e.g. `trainer.train`),
+        performed on whole batches via `augmentation.BatchAugmenter`
+        """
+        self.__batch_aug = True
+
+    def disable_batch_augmentation(self) -> NoReturn:
+        """
+        """
+        self.__batch_aug = False
+
+    @property
+    def use_batch_augmentation(self) -> bool:
+        return self.__batch_aug
+
+    @property
+    def online_stretch_compress(self) -> bool:
+        """
+        whether the stretch-or-compress is performed online on whole batches,
+        only if the batch augmentation is enabled
+        """
+        return self._online_stretch_compress and self.__batch_aug
+
+    def persistence(self, force_recompute:bool=False, verbose:int=0, n_workers:Optional[int]=None) -> NoReturn:
         """ finished, checked,
 
-        make the dataset persistent w.r.t. the ratios in `self.config`
+        make the dataset persistent w.r.t. the ratios in `self.config`,
+        records are processed in parallel by `n_workers` processes,
+        with the same output as processing them serially
 
         Parameters
         ----------
@@ -507,28 +1244,107 @@ class CPSC2021(Dataset):
             if True, recompute regardless of possible existing files
         verbose: int, default 0,
             print verbosity
+        n_workers: int, optional,
+            number of worker processes, defaults to `mp.cpu_count() - 3` (at least 1),
+            1 for processing in the current process
         """
+        n_workers = n_workers or max(1, mp.cpu_count()-3)
+        task = self.task
         if verbose >= 1:
-            print(" preprocessing data ".center("#", 110))
+            print(" preprocessing data ".center(110, "#"))
         self._preprocess_data(
             self.allowed_preproc,
             force_recompute=force_recompute,
             verbose=verbose,
+            n_workers=n_workers,
         )
         if verbose >= 1:
-            print("\n" + " slicing data into segments ".center("#", 110))
+            print("\n" + " slicing data into segments ".center(110, "#"))
+        if task not in ["qrs_detection", "main",]:
+            self.reset_task("main")
         self._slice_data(
             force_recompute=force_recompute,
             verbose=verbose,
+            n_workers=n_workers,
         )
         if verbose >= 1:
-            print("\n" + " generating rr sequences ".center("#", 110))
+            print("\n" + " generating rr sequences ".center(110, "#"))
+        self.reset_task("rr_lstm")
         self._slice_rr_seq(
             force_recompute=force_recompute,
             verbose=verbose,
+            n_workers=n_workers,
         )
+        self.reset_task(task)
+
+    def _run_persistence_jobs(self, job:str, n_workers:int=1, verbose:int=0, **kwargs) -> Dict[str, Any]:
+        """ finished, NOT checked,
 
-    def _preprocess_data(self, preproc:List[str], force_recompute:bool=False, verbose:int=0) -> NoReturn:
+        run the persistence job on all records, in parallel if `n_workers` > 1,
+        each record is processed with the random states seeded by `self._get_rec_seed`,
+        so that the output does not depend on the number of workers, nor the order of processing
+
+        Parameters
+        ----------
+        job: str,
+            name of the job, one of "preprocess", "slice_data", "slice_rr_seq",
+            ref. `_persistence_job`
+        n_workers: int, default 1,
+            number of worker processes
+        verbose: int, default 0,
+            print verbosity
+        kwargs: dict,
+            key word arguments for the job
+
+        Returns
+        -------
+        results: dict,
+            results of the job, keyed by record names
+        """
+        jobs = [(job, rec, kwargs) for rec in self.reader.all_records]
+        results = {}
+        if n_workers > 1:
+            with mp.Pool(processes=n_workers, initializer=_init_persistence_worker, initargs=(self,)) as pool:
+                for idx, (rec, res) in enumerate(pool.imap_unordered(_persistence_job, jobs)):
+                    results[rec] = res
+                    if verbose >= 1:
+                        print(f"{idx+1}/{len(jobs)} records", end="\r")
+            # shards (possibly cached as absent) written by the workers
+            self._shard_cache.clear()
+        else:
+            # the jobs run in the calling process, whose global random states are NOT to be affected
+            # by the per-record seeding of `_persistence_job`
+            random_state, np_random_state = random.getstate(), np.random.get_state()
+            _init_persistence_worker(self)
+            try:
+                for idx, item in enumerate(jobs):
+                    rec, res = _persistence_job(item)
+                    results[rec] = res
+                    if verbose >= 1:
+                        print(f"{idx+1}/{len(jobs)} records", end="\r")
+            finally:
+                _init_persistence_worker(None)
+                random.setstate(random_state)
+                np.random.set_state(np_random_state)
+        return results
+
+    def _get_rec_seed(self, rec:str) -> int:
+        """ finished, NOT checked,
+
+        Parameters
+        ----------
+        rec: str,
+            filename of the record
+
+        Returns
+        -------
+        seed: int,
+            deterministic seed of the random states for generating the segments (rr sequences) of the record
+        """
+        seed = (zlib.crc32(rec.encode()) + self.config.get("persistence_seed", 0)) % (2**32)
+        return seed
+
+    def _preprocess_data(self, preproc:List[str], force_recompute:bool=False, verbose:int=0, n_workers:int=1) -> NoReturn:
         """ finished, checked,
 
         preprocesses the ecg data in advance for further use,
@@ -543,19 +1359,17 @@ class CPSC2021(Dataset):
             if True, recompute regardless of possible existing files
         verbose: int, default 0,
             print verbosity
+        n_workers: int, default 1,
+            number of worker processes
         """
         preproc = self._normalize_preprocess_names(preproc, True)
-        for idx, rec in enumerate(self.reader.all_records):
-            self._preprocess_one_record(
-                rec=rec,
-                preproc=preproc,
-                force_recompute=force_recompute,
-                verbose=verbose,
-            )
-            if verbose >= 1:
-                print(f"{idx+1}/{len(self.reader.all_records)} records", end="\r")
+        self._run_persistence_jobs(
+            "preprocess", n_workers=n_workers, verbose=verbose,
+            preproc=preproc, force_recompute=force_recompute,
+        )
+        self._update_preprocess_manifest(preproc)
 
-    def _preprocess_one_record(self, rec:str, preproc:List[str], force_recompute:bool=False, verbose:int=0) -> NoReturn:
+    def _preprocess_one_record(self, rec:str, preproc:List[str], force_recompute:bool=False, verbose:int=0) -> Optional[bool]:
         """ finished, checked,
 
         preprocesses the ecg data in advance for further use,
@@ -572,11 +1386,15 @@ class CPSC2021(Dataset):
             if True, recompute regardless of possible existing files
         verbose: int, default 0,
             print verbosity
+
+        Returns
+        -------
+        computed: bool or None,
+            True if the record is (re)computed, None if the existing file is kept
         """
-        suffix = self._get_rec_suffix(preproc)
-        save_fp = os.path.join(self.preprocess_dir, f"{rec}-{suffix}.{self.segment_ext}")
+        save_fp = self._get_preprocessed_path(rec, preproc)
         if (not force_recompute) and os.path.isfile(save_fp):
-            return
+            return None
         # perform pre-process
         if "baseline" in preproc:
             bl_win = [self.config.baseline_window1, self.config.baseline_window2]
@@ -593,7 +1411,14 @@ class CPSC2021(Dataset):
             band_fs=band_fs,
             verbose=verbose,
         )
-        savemat(save_fp, {"ecg": pps["filtered_ecg"]}, format="5")
+        p_sig = np.asarray(pps["filtered_ecg"], dtype=np.float32)
+        if p_sig.shape[0] != 2:
+            p_sig = p_sig.T
+        tmp_fp = f"{save_fp}.{os.getpid()}.tmp.npy"
+        np.save(tmp_fp, p_sig)
+        os.replace(tmp_fp, save_fp)
+        self._preprocessed_cache.pop(save_fp, None)
+        return True
 
     def load_preprocessed_data(self, rec:str, preproc:Optional[List[str]]=None) -> np.ndarray:
         """ finished, checked,
@@ -610,18 +1435,148 @@ class CPSC2021(Dataset):
         Returns
         -------
         p_sig: ndarray,
-            the pre-computed processed ECG
+            the pre-computed processed ECG, of dtype float32
+        """
+        return np.array(self._load_preprocessed_mmap(rec, preproc))
+
+    def _load_preprocessed_mmap(self, rec:str, preproc:Optional[List[str]]=None) -> np.ndarray:
+        """ finished, NOT checked,
+
+        Parameters
+        ----------
+        rec: str,
+            filename of the record
+        preproc: list of str, optional
+            type of preprocesses to perform,
+            should be sublist of `self.allowed_preproc`,
+            defaults to `self.allowed_preproc`
+
+        Returns
+        -------
+        p_sig: ndarray,
+            the pre-computed processed ECG, memory-mapped from the .npy file
         """
         if preproc is None:
             preproc = self.allowed_preproc
-        suffix = self._get_rec_suffix(preproc)
-        fp = os.path.join(self.preprocess_dir, f"{rec}-{suffix}.{self.segment_ext}")
-        if not os.path.exists(fp):
+        fp = self._get_preprocessed_path(rec, preproc)
+        if fp in self._preprocessed_cache:
+            self._preprocessed_cache.move_to_end(fp)
+            return self._preprocessed_cache[fp]
+        if not os.path.isfile(fp):
             raise FileNotFoundError(f"preprocess(es) \042{preproc}\042 not done for {rec} yet")
-        p_sig = loadmat(fp)["ecg"]
-        if p_sig.shape[0] != 2:
-            p_sig = p_sig.T
-        return p_sig
+        self._preprocessed_cache[fp] = np.load(fp, mmap_mode="r")
+        while len(self._preprocessed_cache) > self._preprocessed_cache_size:
+            self._preprocessed_cache.popitem(last=False)
+        return self._preprocessed_cache[fp]
+
+    def _get_preproc_config(self, preproc:List[str]) -> dict:
+        """ finished, NOT checked,
+
+        Parameters
+        ----------
+        preproc: list of str,
+            type of preprocesses to perform,
+            should be sublist of `self.allowed_preproc`
+
+        Returns
+        -------
+        preproc_config: dict,
+            all the configurations that the preprocessed signals depend on
+        """
+        preproc = sorted([item.lower() for item in preproc])
+        preproc_config = {
+            "preproc": preproc,
+            "fs": self.reader.fs,
+            "dtype": "float32",
+        }
+        if "bandpass" in preproc:
+            preproc_config["filter_band"] = [float(f) for f in self.config.filter_band]
+        if "baseline" in preproc:
+            preproc_config["baseline_windows"] = [
+                int(self.config.baseline_window1), int(self.config.baseline_window2),
+            ]
+        return preproc_config
+
+    def _get_preproc_hash(self, preproc:List[str]) -> str:
+        """ finished, NOT checked,
+
+        Parameters
+        ----------
+        preproc: list of str,
+            type of preprocesses to perform,
+            should be sublist of `self.allowed_preproc`
+
+        Returns
+        -------
+        preproc_hash: str,
+            (shortened) sha1 hash of the configurations returned by `self._get_preproc_config`,
+            so that preprocessed signals of different configurations can coexist
+        """
+        preproc_config = json.dumps(self._get_preproc_config(preproc), sort_keys=True)
+        return hashlib.sha1(preproc_config.encode("utf-8")).hexdigest()[:12]
+
+    def get_segments_signature(self) -> dict:
+        """ finished, NOT checked,
+
+        Returns
+        -------
+        signature: dict,
+            the preprocessing and slicing configurations that the contents of the segments depend on,
+            along with the modification time of the file of the segments (rewritten when re-sliced),
+            for keying caches derived from the segments, e.g. `distillation.get_soft_target_key`
+        """
+        self.__assert_task(["qrs_detection", "main", "multi_task",])
+        segments_json = self.virtual_segments_json if self.virtual_segments else self.segments_json
+        signature = {
+            "preproc_hash": self._get_preproc_hash(self.config.preproc),
+            "fs": self.config.fs,
+            "input_len": int(self.seglen),
+            "overlap_len": int(self.config[self.task].overlap_len),
+            "critical_overlap_len": int(self.config[self.task].critical_overlap_len),
+            "virtual_segments": bool(self.virtual_segments),
+            "segments_mtime": os.stat(segments_json).st_mtime_ns if os.path.isfile(segments_json) else None,
+        }
+        return signature
+
+    def _get_preprocessed_path(self, rec:str, preproc:List[str]) -> str:
+        """ finished, NOT checked,
+
+        Parameters
+        ----------
+        rec: str,
+            filename of the record
+        preproc: list of str,
+            type of preprocesses to perform,
+            should be sublist of `self.allowed_preproc`
+
+        Returns
+        -------
+        fp: str,
+            path of the .npy file of the preprocessed signal
+        """
+        suffix = self._get_rec_suffix(preproc)
+        return os.path.join(self.preprocess_dir, f"{rec}-{suffix}-{self._get_preproc_hash(preproc)}.npy")
+
+    def _update_preprocess_manifest(self, preproc:List[str]) -> NoReturn:
+        """ finished, NOT checked,
+
+        record the configurations and the (already) preprocessed records in the manifest,
+        one manifest per hash (`manifest-<hash>.json`), written atomically as a whole,
+        so that concurrent preprocessing with different configurations never loses entries
+
+        Parameters
+        ----------
+        preproc: list of str,
+            type of preprocesses performed,
+            should be sublist of `self.allowed_preproc`
+        """
+        entry = self._get_preproc_config(preproc)
+        entry["records"] = [
+            rec for rec in self.reader.all_records \
+                if os.path.isfile(self._get_preprocessed_path(rec, preproc))
+        ]
+        manifest_path = os.path.join(self.preprocess_dir, f"manifest-{self._get_preproc_hash(preproc)}.json")
+        dump_json_atomic(entry, manifest_path)
 
     def _normalize_preprocess_names(self, preproc:List[str], ensure_nonempty:bool) -> List[str]:
         """ finished, checked,
@@ -668,7 +1623,7 @@ class CPSC2021(Dataset):
         suffix = "-".join(sorted([item.lower() for item in operations]))
         return suffix
 
-    def _slice_data(self, force_recompute:bool=False, verbose:int=0) -> NoReturn:
+    def _slice_data(self, force_recompute:bool=False, verbose:int=0, n_workers:int=1) -> NoReturn:
         """ finished, checked,
 
         slice all records into segments of length `self.seglen`,
@@ -680,29 +1635,33 @@ class CPSC2021(Dataset):
             if True, recompute regardless of possible existing files
         verbose: int, default 0,
             print verbosity
+        n_workers: int, default 1,
+            number of worker processes,
+            workers return the names of the segments (or the virtual segments),
+            which are merged here
         """
         self.__assert_task(["qrs_detection", "main",])
         if force_recompute:
             self._clear_cached_segments()
-        for idx, rec in enumerate(self.reader.all_records):
-            self._slice_one_record(
-                rec=rec,
-                force_recompute=False,
-                update_segments_json=False,
-                verbose=verbose,
-            )
-            if verbose >= 1:
-                print(f"{idx+1}/{len(self.reader.all_records)} records", end="\r")
-        # with mp.Pool(processes=max(1, mp.cpu_count()-3)) as pool:
-        #     pool.starmap(
-        #         func=self._slice_one_record,
-        #         iterable=[(rec, force_recompute, False, verbose) for rec in self.reader.all_records]
-        #     )
-        if force_recompute:
-            with open(self.segments_json, "w") as f:
-                json.dump(self.__all_segments, f)
-
-    def _slice_one_record(self, rec:str, force_recompute:bool=False, update_segments_json:bool=False, verbose:int=0) -> NoReturn:
+        # the workers write shards of single records, merged into the shards of the subjects afterwards
+        self._stage_shards = True
+        try:
+            results = self._run_persistence_jobs("slice_data", n_workers=n_workers, verbose=verbose)
+        finally:
+            self._stage_shards = False
+        self._merge_staged_shards()
+        results = {rec: res for rec, res in results.items() if res is not None}
+        for rec, (seg_names, seg_intervals) in results.items():
+            self.__all_segments.set(self.reader.get_subject_id(rec), rec, seg_names)
+            if self.virtual_segments:
+                self._virtual_segments[rec] = seg_intervals
+        self.segments = list(chain.from_iterable(self.__all_segments[subject] for subject in self.subjects))
+        if self.virtual_segments:
+            self._dump_virtual_segments()
+        elif force_recompute or len(results) > 0:
+            self.__all_segments.dump(self.segments_json)
+
+    def _slice_one_record(self, rec:str, force_recompute:bool=False, update_segments_json:bool=False, verbose:int=0) -> Optional[List[str]]:
         """ finished, checked,
 
         slice one record into segments of length `self.seglen`,
@@ -720,93 +1679,121 @@ class CPSC2021(Dataset):
             useful when slicing not all records
         verbose: int, default 0,
             print verbosity
+
+        Returns
+        -------
+        seg_names: list of str, or None,
+            names of the segments of the record, None if existing segments are kept
         """
         self.__assert_task(["qrs_detection", "main",])
-        subject = self.reader.get_subject_id(rec)
-        rec_segs = [item for item in self.__all_segments[subject] if item.startswith(rec.replace("data", "S"))]
-        if (not force_recompute) and len(rec_segs) > 0:
-            return
+        if (not force_recompute) and len(self.__all_segments.get(rec)) > 0:
+            return None
         elif force_recompute:
-            self._clear_cached_segments([rec])
+            self._invalidate_segments(rec)
+
+        if self.virtual_segments:
+            # only the intervals of the segments are stored
+            siglen = self._load_preprocessed_mmap(rec).shape[1]
+            seg_intervals = self._gen_segment_intervals(rec, siglen)
+            return self.__save_virtual_segments(rec, seg_intervals, update_segments_json)
 
         # data = self.reader.load_data(rec, units="mV")
         data = self.load_preprocessed_data(rec)
         siglen = data.shape[1]
-        rpeaks = self.reader.load_rpeaks(rec)
-        af_mask = self.reader.load_af_episodes(rec, fmt="mask")
+        segments = [
+            self._build_segment(rec, start_idx, end_idx, sc_ratio, data=data) \
+                for start_idx, end_idx, sc_ratio in self._gen_segment_intervals(rec, siglen)
+        ]
+        if len(segments) == 0:  # records that are too short
+            return []
+        
+        # return segments
+        return self.__save_segments(rec, segments, update_segments_json)
+
+    def _gen_segment_intervals(self, rec:str, siglen:int) -> List[Tuple[int, int, float]]:
+        """ finished, checked,
+
+        generate the intervals of the segments of one record,
+        with the stretch-or-compress augmentation specified in `self.config`,
+        ordinary ones with constant forward length,
+        and special ones around critical points (where af episodes start or end) with random forward length
+
+        Parameters
+        ----------
+        rec: str,
+            filename of the record
+        siglen: int,
+            length of the (preprocessed) record
+
+        Returns
+        -------
+        seg_intervals: list of 3-tuple,
+            the segments in terms of (start_idx, end_idx, sc_ratio),
+            ref. `self._get_segment_interval`
+        """
+        af_intervals = self.reader.load_beat_ann(rec).af_intervals
         forward_len = self.seglen - self.config[self.task].overlap_len
         critical_forward_len = self.seglen - self.config[self.task].critical_overlap_len
         critical_forward_len = [critical_forward_len//4, critical_forward_len]
 
         # skip those records that are too short
         if siglen < self.seglen:
-            return
-
-        # find critical points
-        critical_points = np.where(np.diff(af_mask)!=0)[0]
+            return []
+
+        # find critical points, i.e. the indices where the af mask changes,
+        # which are `start-1` and `end-1` of the af intervals,
+        # coinciding points of adjacent intervals cancel out
+        critical_points = np.concatenate([
+            af_intervals[af_intervals[:, 0] > 0, 0] - 1,
+            af_intervals[af_intervals[:, 1] < siglen, 1] - 1,
+        ])
+        critical_points, counts = np.unique(critical_points, return_counts=True)
+        critical_points = critical_points[counts % 2 == 1]
         critical_points = [p for p in critical_points if critical_forward_len[1]<=p<siglen-critical_forward_len[1]]
 
-        segments = []
+        seg_intervals = []
 
         # ordinary segments with constant forward_len
         for idx in range((siglen-self.seglen)//forward_len + 1):
             start_idx = idx * forward_len
-            new_seg = self.__generate_segment(
-                rec=rec, data=data, start_idx=start_idx,
-            )
-            segments.append(new_seg)
+            seg_intervals.append(self._get_segment_interval(siglen, start_idx=start_idx))
         # the tail segment
-        new_seg = self.__generate_segment(
-            rec=rec, data=data, end_idx=siglen,
-        )
-        segments.append(new_seg)
+        seg_intervals.append(self._get_segment_interval(siglen, end_idx=siglen))
 
         # special segments around critical_points with random forward_len in critical_forward_len
         for cp in critical_points:
             start_idx = max(0, cp - self.seglen + random.randint(critical_forward_len[0], critical_forward_len[1]))
             while start_idx <= min(cp - critical_forward_len[1], siglen - self.seglen):
-                new_seg = self.__generate_segment(
-                    rec=rec, data=data, start_idx=start_idx,
-                )
-                segments.append(new_seg)
+                seg_intervals.append(self._get_segment_interval(siglen, start_idx=start_idx))
                 start_idx += random.randint(critical_forward_len[0], critical_forward_len[1])
-        
-        # return segments
-        self.__save_segments(rec, segments, update_segments_json)
+        return seg_intervals
 
-    def __generate_segment(self, rec:str, data:np.ndarray, start_idx:Optional[int]=None, end_idx:Optional[int]=None) -> ED:
+    def _get_segment_interval(self, siglen:int, start_idx:Optional[int]=None, end_idx:Optional[int]=None) -> Tuple[int, int, float]:
         """ finished, checked,
 
-        generate segment, with possible data augmentation
+        get the interval of a segment, with possible (random) stretch-or-compress
 
         Parameter
         ---------
-        rec: str,
-            filename of the record
-        data: ndarray,
-            the whole of (preprocessed) ECG record
+        siglen: int,
+            length of the (preprocessed) record
         start_idx: int, optional,
-            start index of the signal of `rec` for generating the segment
+            start index of the signal of the record for generating the segment
         end_idx: int, optional,
-            end index of the signal of `rec` for generating the segment,
+            end index of the signal of the record for generating the segment,
             if `start_idx` is set, `end_idx` is ignored,
             at least one of `start_idx` and `end_idx` should be set
 
         Returns
         -------
-        new_seg: dict,
-            segments (meta-)data, containing:
-            - data: values of the segment, with units in mV
-            - rpeaks: indices of rpeaks of the segment
-            - qrs_mask: mask of qrs complexes of the segment
-            - af_mask: mask of af episodes of the segment
-            - interval: interval ([start_idx, end_idx]) in the original ECG record of the segment
+        (start_idx, end_idx, sc_ratio): 3-tuple,
+            interval in the original ECG record of the segment,
+            and the ratio of stretch-or-compress (1 for no augmentation)
         """
         assert not all([start_idx is None, end_idx is None]), \
             "at least one of `start_idx` and `end_idx` should be set"
-        siglen = data.shape[1]
         # offline augmentations are done, including strech-or-compress, ...
-        if self.config.stretch_compress != 0:
+        if self.config.stretch_compress != 0 and not self.online_stretch_compress:
             sign = random.sample(self.config.stretch_compress_choices, 1)[0]
             if sign != 0:
                 sc_ratio = self.config.stretch_compress
@@ -820,39 +1807,57 @@ class CPSC2021(Dataset):
                     end_idx = siglen
                     start_idx = max(0, end_idx - sc_len)
                     sc_ratio = (end_idx - start_idx) / self.seglen
-                aug_seg = data[..., start_idx: end_idx]
-                aug_seg = SS.resample(x=aug_seg, num=self.seglen, axis=1)
-            else:
-                if start_idx is not None:
-                    end_idx = start_idx + self.seglen
-                    if end_idx > siglen:
-                        end_idx = siglen
-                        start_idx = end_idx - self.seglen
-                else:
-                    start_idx = end_idx - self.seglen
-                    if start_idx < 0:
-                        start_idx = 0
-                        end_idx = self.seglen
-                # the segment of original signal, with no augmentation
-                aug_seg = data[..., start_idx: end_idx]
-                sc_ratio = 1
-        else:
-            if start_idx is not None:
-                end_idx = start_idx + self.seglen
-                if end_idx > siglen:
-                    end_idx = siglen
-                    start_idx = end_idx - self.seglen
-            else:
+                return start_idx, end_idx, sc_ratio
+        if start_idx is not None:
+            end_idx = start_idx + self.seglen
+            if end_idx > siglen:
+                end_idx = siglen
                 start_idx = end_idx - self.seglen
-                if start_idx < 0:
-                    start_idx = 0
-                    end_idx = self.seglen
-            aug_seg = data[..., start_idx: end_idx]
-            sc_ratio = 1
-        # adjust rpeaks
-        seg_rpeaks = self.reader.load_rpeaks(
-            rec=rec, sampfrom=start_idx, sampto=end_idx, zero_start=True,
-        )
+        else:
+            start_idx = end_idx - self.seglen
+            if start_idx < 0:
+                start_idx = 0
+                end_idx = self.seglen
+        return start_idx, end_idx, 1
+
+    def _build_segment(self,
+                       rec:str,
+                       start_idx:int,
+                       end_idx:int,
+                       sc_ratio:float,
+                       data:Optional[np.ndarray]=None) -> ED:
+        """ finished, checked,
+
+        build the segment (stretched or compressed if `sc_ratio` is not 1),
+        with the masks generated from the precomputed beat annotations
+
+        Parameter
+        ---------
+        rec: str,
+            filename of the record
+        start_idx, end_idx: int,
+            interval in the original ECG record of the segment
+        sc_ratio: float,
+            ratio of stretch-or-compress
+        data: ndarray, optional,
+            the whole of (preprocessed) ECG record,
+            if not given, the segment would contain no signal values
+
+        Returns
+        -------
+        new_seg: dict,
+            segments (meta-)data, containing:
+            - data: values of the segment, with units in mV (if `data` is given)
+            - rpeaks: indices of rpeaks of the segment
+            - qrs_mask: mask of qrs complexes of the segment
+            - af_mask: mask of af episodes of the segment
+            - interval: interval ([start_idx, end_idx]) in the original ECG record of the segment
+            - qrs_seq_lab_<reduction>, af_seq_lab_<reduction>: reduced sequence labels of the segment
+        """
+        # adjust rpeaks, using the precomputed beat annotations,
+        # in accordance with `self.reader.load_rpeaks` (with `sampto` inclusive)
+        beat_ann = self.reader.load_beat_ann(rec)
+        seg_rpeaks = beat_ann.rpeaks[(beat_ann.rpeaks >= start_idx) & (beat_ann.rpeaks <= end_idx)] - start_idx
         seg_rpeaks = [
             int(round(r/sc_ratio)) for r in seg_rpeaks \
                 if self.config.rpeaks_dist2border <= r < self.seglen-self.config.rpeaks_dist2border
@@ -862,11 +1867,12 @@ class CPSC2021(Dataset):
         for r in seg_rpeaks:
             seg_qrs_mask[r-self.config.qrs_mask_bias:r+self.config.qrs_mask_bias] = 1
         # adjust af_intervals
-        seg_af_intervals = self.reader.load_af_episodes(
-            rec=rec, sampfrom=start_idx, sampto=end_idx, zero_start=True, fmt="intervals",
+        seg_af_intervals = generalized_intervals_intersection(
+            beat_ann.af_intervals.tolist(), [[start_idx, end_idx]],
         )
         seg_af_intervals = [
-            [int(round(itv[0]/sc_ratio)), int(round(itv[1]/sc_ratio))] for itv in seg_af_intervals
+            [int(round((itv[0]-start_idx)/sc_ratio)), int(round((itv[1]-start_idx)/sc_ratio))] \
+                for itv in seg_af_intervals
         ]
         # generate af_mask from af_intervals
         seg_af_mask = np.zeros((self.seglen,), dtype=int)
@@ -874,15 +1880,110 @@ class CPSC2021(Dataset):
             seg_af_mask[itv[0]:itv[1]] = 1
 
         new_seg = ED(
-            data=aug_seg,
             rpeaks=seg_rpeaks,
             qrs_mask=seg_qrs_mask,
             af_mask=seg_af_mask,
             interval=[start_idx, end_idx],
         )
+        # reduced sequence labels, so that loading is just reading
+        new_seg.update(self._get_seq_labs(seg_qrs_mask, seg_af_mask))
+        if data is not None:
+            new_seg.data = self._get_segment_data(data, start_idx, end_idx)
         return new_seg
 
-    def __save_segments(self, rec:str, segments:List[ED], update_segments_json:bool=False) -> NoReturn:
+    def _get_segment_data(self, data:np.ndarray, start_idx:int, end_idx:int) -> np.ndarray:
+        """ finished, checked,
+
+        Parameter
+        ---------
+        data: ndarray,
+            the whole of (preprocessed) ECG record, possibly memory-mapped
+        start_idx, end_idx: int,
+            interval in the original ECG record of the segment
+
+        Returns
+        -------
+        seg_data: ndarray,
+            values of the segment, resampled to `self.seglen` if stretched or compressed
+        """
+        seg_data = np.array(data[..., start_idx: end_idx], dtype=self.dtype)
+        if end_idx - start_idx != self.seglen:
+            seg_data = SS.resample(x=seg_data, num=self.seglen, axis=1)
+        return seg_data
+
+    def __save_virtual_segments(self, rec:str, seg_intervals:List[Tuple[int, int, float]], update_segments_json:bool=False) -> List[str]:
+        """ finished, NOT checked,
+
+        Parameters
+        ----------
+        rec: str,
+            filename of the record
+        seg_intervals: list of 3-tuple,
+            the segments in terms of (start_idx, end_idx, sc_ratio)
+        update_segments_json: bool, default False,
+            if True, the file `self.virtual_segments_json` will be updated
+
+        Returns
+        -------
+        seg_names: list of str,
+            names of the virtual segments
+        """
+        subject = self.reader.get_subject_id(rec)
+        seg_names = self._get_seg_names(rec, range(len(seg_intervals)))
+        self._virtual_segments[rec] = [[int(s), int(e), float(r)] for s, e, r in seg_intervals]
+        self.__all_segments.set(subject, rec, seg_names)
+        if update_segments_json:
+            self._dump_virtual_segments()
+        return seg_names
+
+    def _ls_virtual_segments(self) -> NoReturn:
+        """ finished, NOT checked,
+
+        list all the virtual segments, which are (start_idx, end_idx, sc_ratio) triples of the records
+        """
+        self._virtual_segments = {}
+        if os.path.isfile(self.virtual_segments_json):
+            with open(self.virtual_segments_json, "r") as f:
+                self._virtual_segments = json.load(f)
+        self.__all_segments = _NameRegistry(self.reader.all_subjects)
+        for rec, seg_intervals in self._virtual_segments.items():
+            self.__all_segments.set(
+                self.reader.get_subject_id(rec), rec, self._get_seg_names(rec, range(len(seg_intervals)))
+            )
+
+    def _dump_virtual_segments(self) -> NoReturn:
+        """ finished, NOT checked,
+        """
+        dump_json_atomic(self._virtual_segments, self.virtual_segments_json)
+
+    def regenerate_virtual_segments(self, verbose:int=0) -> NoReturn:
+        """ finished, NOT checked,
+
+        re-randomize the virtual segments (stretch-or-compress, and those around critical points)
+        of the records of `self.subjects`, typically called at the beginning of each epoch,
+        the file `self.virtual_segments_json` is left untouched
+
+        Parameters
+        ----------
+        verbose: int, default 0,
+            print verbosity
+        """
+        self.__assert_task(["qrs_detection", "main", "multi_task",])
+        assert self.virtual_segments, "only virtual segments can be regenerated"
+        subjects = set(self.subjects)
+        for rec in self.reader.all_records:
+            if self.reader.get_subject_id(rec) not in subjects:
+                continue
+            siglen = self._load_preprocessed_mmap(rec).shape[1]
+            self.__save_virtual_segments(rec, self._gen_segment_intervals(rec, siglen))
+        self._drop_cached_weight_masks()
+        self.segments = list(chain.from_iterable(self.__all_segments[subject] for subject in self.subjects))
+        if self.training:
+            random.shuffle(self.segments)
+        if verbose >= 1:
+            print(f"{len(self.segments)} virtual segments regenerated")
+
+    def __save_segments(self, rec:str, segments:List[ED], update_segments_json:bool=False) -> List[str]:
         """ finished, checked,
 
         Parameters
@@ -893,21 +1994,30 @@ class CPSC2021(Dataset):
             list of the segments (meta-)data
         update_segments_json: bool, default False,
             if True, the file `self.segments_json` will be updated
+
+        Returns
+        -------
+        seg_names: list of str,
+            names of the saved segments
         """
         subject = self.reader.get_subject_id(rec)
         ordering = list(range(len(segments)))
         random.shuffle(ordering)
+        seg_names = self._get_seg_names(rec, range(len(segments)))
+        if self.segment_storage == "shards":
+            self._write_seg_shard(rec, [segments[idx] for idx in ordering])
+            ordering = []  # nothing to write into .mat files
         for i, idx in enumerate(ordering):
             seg = segments[idx]
-            filename = f"{rec}_{i:07d}.{self.segment_ext}".replace("data", "S")
+            filename = f"{seg_names[i]}.{self.segment_ext}"
             data_path = os.path.join(self.segments_dirs.data[subject], filename)
             savemat(data_path, {"ecg": seg.data})
-            self.__all_segments[subject].append(os.path.splitext(filename)[0])
             ann_path = os.path.join(self.segments_dirs.ann[subject], filename)
             savemat(ann_path, {k:v for k,v in seg.items() if k not in ["data",]})
+        self.__all_segments.set(subject, rec, seg_names)
         if update_segments_json:
-            with open(self.segments_json, "w") as f:
-                json.dump(self.__all_segments, f)
+            self.__all_segments.dump(self.segments_json)
+        return seg_names
 
     def _clear_cached_segments(self, recs:Optional[Sequence[str]]=None) -> NoReturn:
         """ finished, checked,
@@ -921,23 +2031,51 @@ class CPSC2021(Dataset):
         self.__assert_task(["qrs_detection", "main",])
         if recs is not None:
             for rec in recs:
-                subject = self.reader.get_subject_id(rec)
-                for item in ["data", "ann",]:
-                    path = self.segments_dirs[item][subject]
-                    for f in [n for n in os.listdir(path) if n.endswith(self.segment_ext)]:
-                        if self._get_rec_name(f) == rec:
-                            os.remove(os.path.join(path, f))
-                            self.__all_segments[subject].remove(os.path.splitext(f)[0])
+                self._invalidate_segments(rec)
+        elif self.virtual_segments:
+            self._virtual_segments = {}
+            self.__all_segments.clear()
+            self._drop_cached_weight_masks()
         else:
+            self._drop_cached_weight_masks()
+            self._shard_cache.clear()
+            if os.path.isdir(self.shards_base_dir):
+                shutil.rmtree(self.shards_base_dir)
+            self.__all_segments.clear()
             for subject in self.reader.all_subjects:
                 for item in ["data", "ann",]:
                     path = self.segments_dirs[item][subject]
                     for f in [n for n in os.listdir(path) if n.endswith(self.segment_ext)]:
                         os.remove(os.path.join(path, f))
-                        self.__all_segments[subject].remove(os.path.splitext(f)[0])
-        self.segments = list_sum([self.__all_segments[subject] for subject in self.subjects])
+        self.segments = list(chain.from_iterable(self.__all_segments[subject] for subject in self.subjects))
+
+    def _invalidate_segments(self, rec:str) -> NoReturn:
+        """ finished, NOT checked,
+
+        remove the segments (files, shard, or virtual segments) of one record,
+        located via the registry of the segments, without listing directories,
+        `self.segments` is NOT updated
 
-    def _slice_rr_seq(self, force_recompute:bool=False, verbose:int=0) -> NoReturn:
+        Parameters
+        ----------
+        rec: str,
+            filename of the record
+        """
+        seg_names = self.__all_segments.pop(rec)
+        self._drop_cached_weight_masks(rec)
+        if self.virtual_segments:
+            self._virtual_segments.pop(rec, None)
+            return
+        staged_dir = os.path.join(self._shard_staging_dir, rec)
+        if os.path.isdir(staged_dir):
+            shutil.rmtree(staged_dir)
+        self._rewrite_seg_shard(self.reader.get_subject_id(rec), drop_recs=[rec])
+        for seg in seg_names:
+            for path in [self._get_seg_data_path(seg), self._get_seg_ann_path(seg),]:
+                if os.path.isfile(path):
+                    os.remove(path)
+
+    def _slice_rr_seq(self, force_recompute:bool=False, verbose:int=0, n_workers:int=1) -> NoReturn:
         """ finished, checked,
 
         slice sequences of rr intervals into fixed length (sub)sequences
@@ -948,44 +2086,60 @@ class CPSC2021(Dataset):
             if True, recompute regardless of possible existing files
         verbose: int, default 0,
             print verbosity
+        n_workers: int, default 1,
+            number of worker processes,
+            workers return the names and the rows of the rr sequences,
+            which are merged here and written into the store once (ref. `_write_rr_seq_store`)
         """
         self.__assert_task(["rr_lstm"])
         if force_recompute:
             self._clear_cached_rr_seq()
-        for idx, rec in enumerate(self.reader.all_records):
-            self._slice_rr_seq_one_record(
-                rec=rec,
-                force_recompute=False,
-                update_rr_seq_json=False,
-                verbose=verbose,
-            )
-            if verbose >= 1:
-                print(f"{idx+1}/{len(self.reader.all_records)} records", end="\r")
-        if force_recompute:
-            with open(self.rr_seq_json, "w") as f:
-                json.dump(self.__all_rr_seq, f)
-
-    def _slice_rr_seq_one_record(self, rec:str, force_recompute:bool=False, update_rr_seq_json:bool=False, verbose:int=0) -> NoReturn:
+        results = self._run_persistence_jobs("slice_rr_seq", n_workers=n_workers, verbose=verbose)
+        results = {rec: res for rec, res in results.items() if res is not None}
+        for rec, (rr_seq_names, staged) in results.items():
+            self.__all_rr_seq.set(self.reader.get_subject_id(rec), rec, rr_seq_names)
+            if staged is not None:
+                self._staged_rr_seq[rec] = staged
+        self._write_rr_seq_store()
+        self.rr_seq = list(chain.from_iterable(self.__all_rr_seq[subject] for subject in self.subjects))
+        if force_recompute or len(results) > 0:
+            self.__all_rr_seq.dump(self.rr_seq_json)
+
+    def _slice_rr_seq_one_record(self, rec:str, force_recompute:bool=False, update_rr_seq_json:bool=False, verbose:int=0) -> Optional[List[str]]:
         """ finished, checked,
+
+        Parameters
+        ----------
+        rec: str,
+            filename of the record
+        force_recompute: bool, default False,
+            if True, recompute regardless of possible existing files
+        update_rr_seq_json: bool, default False,
+            if True, the file `self.rr_seq_json` will be updated
+        verbose: int, default 0,
+            print verbosity
+
+        Returns
+        -------
+        rr_seq_names: list of str, or None,
+            names of the rr sequences of the record, None if existing rr sequences are kept
         """
         self.__assert_task(["rr_lstm"])
         subject = self.reader.get_subject_id(rec)
-        rec_rr_seq = [item for item in self.__all_rr_seq[subject] if item.startswith(rec.replace("data", "R"))]
-        if (not force_recompute) and len(rec_rr_seq) > 0:
-            return
+        if (not force_recompute) and len(self.__all_rr_seq.get(rec)) > 0:
+            return None
         elif force_recompute:
-            self._clear_cached_rr_seq([rec])
+            self._invalidate_rr_seq(rec)
 
         forward_len = self.seglen - self.config[self.task].overlap_len
         critical_forward_len = self.seglen - self.config[self.task].critical_overlap_len
         critical_forward_len = [critical_forward_len-2, critical_forward_len]
             
-        rpeaks = self.reader.load_rpeaks(rec)
-        rr = np.diff(rpeaks) / self.config.fs
+        beat_ann = self.reader.load_beat_ann(rec)
+        rr = beat_ann.rr
         if len(rr) < self.seglen:
-            return
-        af_mask = self.reader.load_af_episodes(rec, fmt="mask")
-        label_seq = af_mask[rpeaks][:-1]
+            return []
+        label_seq = beat_ann.af_label[:-1]
 
         # find critical points
         critical_points = np.where(np.diff(label_seq)!=0)[0]
@@ -1025,18 +2179,28 @@ class CPSC2021(Dataset):
                 )
                 rr_seq.append(new_rr_seq)
                 start_idx += random.randint(critical_forward_len[0], critical_forward_len[1])
-        # save rr sequences
-        ordering = list(range(len(rr_seq)))
-        random.shuffle(ordering)
-        for i, idx in enumerate(ordering):
-            item = rr_seq[idx]
-            filename = f"{rec}_{i:07d}.{self.rr_seq_ext}".replace("data", "R")
-            data_path = os.path.join(self.rr_seq_dirs[subject], filename)
-            savemat(data_path, item)
-            self.__all_rr_seq[subject].append(os.path.splitext(filename)[0])
+        # stage rows of the rr sequences, the tail segment shorter than `self.seglen` discarded
+        rr_seq = [item for item in rr_seq if len(item.rr) == self.seglen]
+        random.shuffle(rr_seq)
+        rr_seq_names, rows = [], []
+        for i, item in enumerate(rr_seq):
+            rr_seq_names.append(f"{rec}_{i:07d}".replace("data", "R"))
+            label = np.asarray(item.label).reshape((self.seglen, self.n_classes))
+            weight_mask = _generate_weight_mask(target_mask=label[:, 0], **_RR_WEIGHT_MASK_KW)
+            rows.append(np.concatenate([
+                np.asarray(item.rr).reshape((self.seglen, 1)), label, weight_mask.reshape((self.seglen, 1)),
+            ], axis=1))
+        self._staged_rr_seq[rec] = ED(
+            names=rr_seq_names,
+            rows=np.stack(rows).astype(np.float32) if len(rows) > 0 \
+                else np.zeros((0, self.seglen, self.n_classes+2), dtype=np.float32),
+            intervals=[[int(idx) for idx in item.interval] for item in rr_seq],
+        )
+        self.__all_rr_seq.set(subject, rec, rr_seq_names)
         if update_rr_seq_json:
-            with open(self.rr_seq_json, "w") as f:
-                json.dump(self.__all_rr_seq, f)
+            self._write_rr_seq_store()
+            self.__all_rr_seq.dump(self.rr_seq_json)
+        return rr_seq_names
 
     def _clear_cached_rr_seq(self, recs:Optional[Sequence[str]]=None) -> NoReturn:
         """ finished, checked,
@@ -1050,19 +2214,44 @@ class CPSC2021(Dataset):
         self.__assert_task(["rr_lstm"])
         if recs is not None:
             for rec in recs:
-                subject = self.reader.get_subject_id(rec)
-                path = self.rr_seq_dirs[subject]
-                for f in [n for n in os.listdir(path) if n.endswith(self.rr_seq_ext)]:
-                    if self._get_rec_name(f) == rec:
-                        os.remove(os.path.join(path, f))
-                        self.__all_rr_seq[subject].remove(os.path.splitext(f)[0])
+                self._invalidate_rr_seq(rec)
         else:
+            self.__all_rr_seq.clear()
+            self._drop_cached_weight_masks()
+            self._remove_packed_rr_seq()
+            self._rr_seq_store = None
+            self._staged_rr_seq = {}
+            for f in os.listdir(self.rr_seq_base_dir):
+                if f.startswith("rows_") and os.path.isdir(os.path.join(self.rr_seq_base_dir, f)):
+                    shutil.rmtree(os.path.join(self.rr_seq_base_dir, f))
+            # the legacy .mat files
             for subject in self.reader.all_subjects:
-                    path = self.rr_seq_dirs[subject]
-                    for f in [n for n in os.listdir(path) if n.endswith(self.rr_seq_ext)]:
-                        os.remove(os.path.join(path, f))
-                        self.__all_rr_seq[subject].remove(os.path.splitext(f)[0])
-        self.rr_seq = list_sum([self.__all_rr_seq[subject] for subject in self.subjects])
+                path = self.rr_seq_dirs[subject]
+                for f in [n for n in os.listdir(path) if n.endswith(self.rr_seq_ext)]:
+                    os.remove(os.path.join(path, f))
+        self.rr_seq = list(chain.from_iterable(self.__all_rr_seq[subject] for subject in self.subjects))
+
+    def _invalidate_rr_seq(self, rec:str) -> NoReturn:
+        """ finished, NOT checked,
+
+        remove the rr sequences of one record,
+        located via the registry of the rr sequences, without listing directories,
+        `self.rr_seq` is NOT updated
+
+        Parameters
+        ----------
+        rec: str,
+            filename of the record
+        """
+        self._drop_cached_weight_masks(rec)
+        self._staged_rr_seq.pop(rec, None)
+        self._write_rr_seq_store(drop_recs=[rec])
+        self._remove_packed_rr_seq()
+        # the legacy .mat files
+        for seq_name in self.__all_rr_seq.pop(rec):
+            path = self._get_rr_seq_path(seq_name)
+            if os.path.isfile(path):
+                os.remove(path)
 
     def _get_rec_name(self, seg_or_rr:str) -> str:
         """ finished, checked,
@@ -1164,7 +2353,7 @@ class CPSC2021(Dataset):
         assert self.task in tasks, \
             f"DO NOT call this method when the current task is {self.task}. Switch task using `reset_task`"
 
-    def plot_seg(self, seg:str, ticks_granularity:int=0) -> NoReturn:
+    def plot_seg(self, seg:str, ticks_granularity:int=0, **kwargs) -> NoReturn:
         """ finished, checked,
 
         Parameters
@@ -1174,6 +2363,9 @@ class CPSC2021(Dataset):
         ticks_granularity: int, default 0,
             the granularity to plot axis ticks, the higher the more,
             0 (no ticks) --> 1 (major ticks) --> 2 (major + minor ticks)
+        kwargs: dict,
+            key word arguments passed to `self.reader.plot`,
+            e.g. "decimate", "n_pixels"
         """
         seg_data = self._load_seg_data(seg)
         print(f"seg_data.shape = {seg_data.shape}")
@@ -1186,9 +2378,294 @@ class CPSC2021(Dataset):
             data=seg_data,
             ann=seg_ann,
             ticks_granularity=ticks_granularity,
+            **kwargs,
         )
 
 
+def _reduce_mask(mask:np.ndarray, reduction:int) -> np.ndarray:
+    """ finished, checked,
+
+    reduce the mask to sequence labels, via one reshape-and-reduce,
+    a label is 1 only if the whole block of `reduction` samples is 1
+
+    Parameters
+    ----------
+    mask: ndarray,
+        the mask, of shape (seglen,) or (seglen, n_classes)
+    reduction: int,
+        reduction (granularity) of length of the model output,
+        compared to the original signal length
+
+    Returns
+    -------
+    seq_lab: ndarray,
+        the sequence labels, of shape (seglen//reduction,) or (seglen//reduction, n_classes)
+    """
+    n_blocks = mask.shape[0] // reduction
+    seq_lab = mask[:n_blocks*reduction].reshape((n_blocks, reduction) + mask.shape[1:])
+    seq_lab = np.mean(seq_lab, axis=1).astype(int)
+    return seq_lab
+
+
+def _open_seg_shard(shard_dir:str) -> Optional[ED]:
+    """ finished, NOT checked,
+
+    Parameters
+    ----------
+    shard_dir: str,
+        directory of the packed shard, ref. `CPSC2021._write_seg_shard`
+
+    Returns
+    -------
+    shard: dict, or None,
+        the rows (memory-mapped) and the index table (in memory) of the shard,
+        None if the shard does not exist (or is incomplete)
+    """
+    meta_fp = os.path.join(shard_dir, "meta.npz")
+    if not os.path.isfile(meta_fp):
+        return None
+    with np.load(meta_fp) as meta:
+        shard = ED({k: meta[k] for k in meta.files})
+    shard.rows = np.load(os.path.join(shard_dir, "rows.npy"), mmap_mode="r")
+    return shard
+
+
+def _replace_dir(src:str, dst:str) -> NoReturn:
+    """ finished, NOT checked,
+
+    replace the directory `dst` by `src`, the old `dst` is moved aside (atomically) first,
+    so that `dst` is never partially removed,
+    and memory-mapped files of the old `dst` remain valid for the readers having them opened
+    """
+    old_dir = f"{dst}.{os.getpid()}.old"
+    if os.path.isdir(old_dir):  # left by an interrupted writing
+        shutil.rmtree(old_dir)
+    if os.path.isdir(dst):
+        os.replace(dst, old_dir)
+    os.replace(src, dst)
+    if os.path.isdir(old_dir):
+        shutil.rmtree(old_dir)
+
+
+class _NameRegistry(object):
+    """ finished, NOT checked,
+
+    registry of the names of the segments (or rr sequences), grouped by subject and keyed by record,
+    so that the names of one record are looked up, replaced, or invalidated
+    in time proportional to the number of names of this record,
+    serialized in the (legacy) format of {subject: [names]}
+    """
+    __name__ = "_NameRegistry"
+
+    def __init__(self, subjects:Sequence[str]) -> NoReturn:
+        """
+
+        Parameters
+        ----------
+        subjects: sequence of str,
+            all the subjects
+        """
+        self._records = {s: {} for s in subjects}  # subject --> {record name --> names}
+        self._subject_of = {}  # record name --> subject
+
+    @classmethod
+    def from_dict(cls, names:Dict[str, List[str]], get_rec_name:callable) -> "_NameRegistry":
+        """
+
+        Parameters
+        ----------
+        names: dict,
+            names of the segments (or rr sequences) of the subjects, in the format of {subject: [names]}
+        get_rec_name: callable,
+            function to get the record name from the name of a segment (or rr sequence)
+        """
+        registry = cls(names.keys())
+        for subject, subject_names in names.items():
+            for name in subject_names:
+                rec = get_rec_name(name)
+                if rec not in registry._subject_of:
+                    registry.set(subject, rec, [])
+                registry._records[subject][rec].append(name)
+        return registry
+
+    def __getitem__(self, subject:str) -> List[str]:
+        return list(chain.from_iterable(self._records[subject].values()))
+
+    def get(self, rec:str) -> List[str]:
+        if rec not in self._subject_of:
+            return []
+        return self._records[self._subject_of[rec]][rec]
+
+    def set(self, subject:str, rec:str, names:List[str]) -> NoReturn:
+        self.pop(rec)
+        self._records[subject][rec] = list(names)
+        self._subject_of[rec] = subject
+
+    def pop(self, rec:str) -> List[str]:
+        if rec not in self._subject_of:
+            return []
+        return self._records[self._subject_of.pop(rec)].pop(rec)
+
+    def clear(self) -> NoReturn:
+        for subject in self._records:
+            self._records[subject] = {}
+        self._subject_of = {}
+
+    def to_dict(self) -> ED:
+        return ED({subject: self[subject] for subject in self._records})
+
+    def dump(self, filename:str) -> NoReturn:
+        """ atomically write the registry into the json file `filename`
+        """
+        dump_json_atomic(self.to_dict(), filename)
+
+
+# parameters of the weight masks of the rr sequences, ref. `_generate_weight_mask`
+_RR_WEIGHT_MASK_KW = dict(fg_weight=2, fs=1/0.8, reduction=1, radius=2, boundary_weight=5)
+
+
+class RRSeqBatchSampler(Sampler):
+    """ finished, NOT checked,
+
+    batch sampler for the task "rr_lstm" with packed rr sequences (`CPSC2021.rr_seq_packed`),
+    which yields whole batches of indices at once, to be used with `batch_size=None` of `DataLoader`,
+    so that each batch is fetched via one slicing (or fancy indexing) of the packed array,
+    and which can be restricted to one shard of the dataset for distributed training,
+    in the way of `torch.utils.data.distributed.DistributedSampler`
+    """
+    __name__ = "RRSeqBatchSampler"
+
+    def __init__(self,
+                 data_len:int,
+                 batch_size:int,
+                 shuffle:bool=True,
+                 drop_last:bool=False,
+                 num_replicas:int=1,
+                 rank:int=0,
+                 seed:Optional[int]=None) -> NoReturn:
+        """
+
+        Parameters
+        ----------
+        data_len: int,
+            number of the rr sequences, i.e. length of the dataset
+        batch_size: int,
+            the batch size
+        shuffle: bool, default True,
+            if True, batches are of random indices (re-drawn every epoch),
+            otherwise, batches are consecutive slices (or strided indices of the shard)
+        drop_last: bool, default False,
+            if True, the last incomplete batch will be dropped
+        num_replicas: int, default 1,
+            number of processes of distributed training
+        rank: int, default 0,
+            rank of the current process, whose shard is sampled
+        seed: int, optional,
+            seed of the (per-epoch) permutations, ref. `self.set_epoch`,
+            which should be the same for all processes of distributed training
+        """
+        self.data_len = data_len
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.drop_last = drop_last
+        self.num_replicas = num_replicas
+        self.rank = rank
+        self.seed = seed
+        self.epoch = 0
+        if self.num_replicas > 1 and self.shuffle:
+            # padded so that all processes have the same number of batches
+            self.shard_len = (self.data_len + self.num_replicas - 1) // self.num_replicas
+        else:
+            self.shard_len = len(range(self.rank, self.data_len, self.num_replicas))
+
+    def set_epoch(self, epoch:int) -> NoReturn:
+        """
+        """
+        self.epoch = epoch
+
+    def __iter__(self):
+        if self.shuffle:
+            if self.seed is None:
+                ordering = torch.randperm(self.data_len).numpy()
+            else:
+                generator = torch.Generator()
+                generator.manual_seed(self.seed + self.epoch)
+                ordering = torch.randperm(self.data_len, generator=generator).numpy()
+        elif self.num_replicas > 1:
+            ordering = np.arange(self.data_len)
+        if self.num_replicas > 1 and self.shuffle:
+            ordering = np.resize(ordering, self.shard_len * self.num_replicas)[self.rank::self.num_replicas]
+        elif self.num_replicas > 1:
+            ordering = ordering[self.rank::self.num_replicas]
+        for start in range(0, len(self) * self.batch_size, self.batch_size):
+            end = min(start + self.batch_size, self.shard_len)
+            if self.shuffle:
+                # sorted for better locality of reading the memory-mapped array
+                yield np.sort(ordering[start:end])
+            elif self.num_replicas > 1:
+                yield ordering[start:end]
+            else:
+                yield slice(start, end)
+
+    def __len__(self) -> int:
+        if self.drop_last:
+            return self.shard_len // self.batch_size
+        return (self.shard_len + self.batch_size - 1) // self.batch_size
+
+
+_PERSISTENCE_DS = None  # the dataset in the worker processes of `CPSC2021._run_persistence_jobs`
+
+
+def _init_persistence_worker(ds:CPSC2021) -> NoReturn:
+    """ finished, NOT checked,
+
+    initializer of the worker processes of `CPSC2021._run_persistence_jobs`,
+    the dataset is passed (pickled) once per worker, rather than once per record
+    """
+    global _PERSISTENCE_DS
+    _PERSISTENCE_DS = ds
+
+
+def _persistence_job(job:Tuple[str, str, dict]) -> Tuple[str, Any]:
+    """ finished, NOT checked,
+
+    run one persistence job on one record, in a worker process of `CPSC2021._run_persistence_jobs`
+
+    Parameters
+    ----------
+    job: 3-tuple,
+        name of the job ("preprocess", "slice_data", "slice_rr_seq"),
+        name of the record, and key word arguments of the job
+
+    Returns
+    -------
+    (rec, res): 2-tuple,
+        name of the record, and result of the job,
+        which is None if nothing is (re)computed for the record, otherwise
+        - "preprocess": True (computed) or None (existing)
+        - "slice_data": 2-tuple of the names of the segments, and the virtual segments (None if not virtual)
+        - "slice_rr_seq": 2-tuple of the names of the rr sequences, and their staged rows
+    """
+    name, rec, kwargs = job
+    ds = _PERSISTENCE_DS
+    seed = ds._get_rec_seed(rec)
+    random.seed(seed)
+    np.random.seed(seed)
+    if name == "preprocess":
+        return rec, ds._preprocess_one_record(rec=rec, **kwargs)
+    elif name == "slice_data":
+        seg_names = ds._slice_one_record(rec=rec, force_recompute=False, update_segments_json=False)
+        if seg_names is None:
+            return rec, None
+        return rec, (seg_names, ds._virtual_segments.get(rec, None) if ds.virtual_segments else None)
+    elif name == "slice_rr_seq":
+        rr_seq_names = ds._slice_rr_seq_one_record(rec=rec, force_recompute=False, update_rr_seq_json=False)
+        if rr_seq_names is None:
+            return rec, None
+        return rec, (rr_seq_names, ds._staged_rr_seq.pop(rec, None))
+    raise ValueError(f"unknown persistence job \042{name}\042")
+
+
 def _generate_weight_mask(target_mask:np.ndarray,
                           fg_weight:float,
                           fs:int,
@@ -1226,12 +2703,10 @@ def _generate_weight_mask(target_mask:np.ndarray,
     weight = np.full_like(target_mask, fg_weight) - 1
     weight_mask += (target_mask > 0.5) * weight
     border = np.where(np.diff(target_mask)!=0)[0]
-    for idx in border:
-        # weight = np.zeros_like(target_mask, dtype=float)
-        # weight[max(0, idx-sigma): (idx+sigma)] = boundary_weight
-        weight = np.full_like(target_mask, boundary_weight, dtype=float)
-        weight = weight * np.exp(-np.power(np.arange(len(target_mask)) - idx, 2) / sigma**2)
-        weight_mask += weight
+    if len(border) > 0:
+        # gaussians centered at all the borders at once, of shape (n_borders, len(target_mask))
+        dist = np.arange(len(target_mask))[np.newaxis, :] - border[:, np.newaxis]
+        weight_mask += boundary_weight * np.exp(-np.power(dist, 2) / sigma**2).sum(axis=0)
     if plot:
         import matplotlib.pyplot as plt
         fig, ax = plt.subplots(figsize=(12,6))
@@ -1242,3 +2717,29 @@ def _generate_weight_mask(target_mask:np.ndarray,
         ax.legend(loc="best")
         plt.show()
     return weight_mask
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(
+        description="pack the existing segments (.mat files) of CPSC2021 into shards",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument(
+        "-d", "--db-dir", type=str, default=TrainCfg.db_dir,
+        help="directory of the database, under which the segments are stored",
+        dest="db_dir")
+    parser.add_argument(
+        "--remove-legacy", action="store_true",
+        help="remove the .mat files of the migrated segments",
+        dest="remove_legacy")
+    args = parser.parse_args()
+
+    config = deepcopy(TrainCfg)
+    config.db_dir = args.db_dir
+    ds = CPSC2021(config, task="main", training=True)
+    ds.migrate_segments_to_shards(remove_legacy=args.remove_legacy, verbose=1)
+    # update the list of segments
+    if os.path.isfile(ds.segments_json):
+        os.remove(ds.segments_json)
+    ds._ls_segments()
+    print("\nmigration finished")
@@ -0,0 +1,345 @@
+"""
+knowledge distillation of the (heavy) SeqLab models into compact students,
+with the soft targets produced by a frozen teacher, optionally cached per segment,
+and the latency of the models, so that the teacher and the students can be compared side by side
+"""
+
+import os
+import json
+import time
+import hashlib
+from copy import deepcopy
+from typing import Any, Optional, Sequence, List, Dict, NoReturn
+
+import numpy as np
+from tqdm import tqdm
+import torch
+from torch import nn
+from torch import Tensor
+import torch.nn.functional as F
+from torch.utils.data import DataLoader
+
+from utils.misc import dump_json_atomic
+
+
+__all__ = [
+    "freeze_teacher",
+    "distillation_loss",
+    "SoftTargetCache",
+    "get_soft_target_key",
+    "compute_soft_targets",
+    "measure_latency",
+    "comparison_to_str",
+]
+
+
+def freeze_teacher(teacher:nn.Module, device:torch.device) -> nn.Module:
+    """ finished, NOT checked,
+
+    Parameters
+    ----------
+    teacher: Module,
+        the teacher model, typically loaded via `from_checkpoint`
+    device: torch.device,
+        device on which the teacher produces the soft targets
+
+    Returns
+    -------
+    teacher: Module,
+        the teacher, in eval mode, with no gradient required
+    """
+    teacher = teacher.to(device=device)
+    teacher.eval()
+    for p in teacher.parameters():
+        p.requires_grad_(False)
+    return teacher
+
+
+def distillation_loss(student_logits:Tensor,
+                      teacher_logits:Tensor,
+                      temperature:float=1.0,
+                      weight:Optional[Tensor]=None) -> Tensor:
+    """ finished, NOT checked,
+
+    binary cross entropy between the (temperature-scaled) sigmoid outputs of the student and of the teacher,
+    scaled by `temperature**2` so that the magnitude of the gradients is independent of the temperature
+
+    Parameters
+    ----------
+    student_logits: Tensor,
+        logits of the student, of shape (batch_size, seq_len, n_classes)
+    teacher_logits: Tensor,
+        logits of the teacher, of the same shape as `student_logits`
+    temperature: float, default 1.0,
+        the temperature
+    weight: Tensor, optional,
+        weights of the elements, broadcastable to the shape of `student_logits`,
+        e.g. the weight masks of the main task
+
+    Returns
+    -------
+    loss: Tensor,
+        the distillation loss
+    """
+    soft_targets = torch.sigmoid(teacher_logits.detach() / temperature)
+    loss = F.binary_cross_entropy_with_logits(
+        student_logits / temperature, soft_targets, weight=weight, reduction="mean",
+    )
+    return loss * temperature ** 2
+
+
+class SoftTargetCache(object):
+    """ finished, NOT checked,
+
+    logits of the teacher of the segments, packed into one (memory-mapped) .npy file in float16,
+    with the names of the segments stored in a .json file alongside,
+    the memory-mapped array is NOT pickled (e.g. for worker processes), but re-opened lazily
+    """
+    __name__ = "SoftTargetCache"
+
+    def __init__(self, path:str, names:Sequence[str]) -> NoReturn:
+        """
+
+        Parameters
+        ----------
+        path: str,
+            path of the .npy file of the logits, of shape (n_segments, seq_len, n_classes)
+        names: sequence of str,
+            names of the segments, in the order of the rows of the array
+        """
+        self.path = path
+        self.index = {name: idx for idx, name in enumerate(names)}
+        self._array = None
+
+    @staticmethod
+    def names_path(path:str) -> str:
+        """
+        """
+        return f"{os.path.splitext(path)[0]}.json"
+
+    @classmethod
+    def open(cls, path:str) -> Optional["SoftTargetCache"]:
+        """ finished, NOT checked,
+
+        Parameters
+        ----------
+        path: str,
+            path of the .npy file of the logits
+
+        Returns
+        -------
+        SoftTargetCache, or None if the cache does not exist (or is incomplete)
+        """
+        if not (os.path.isfile(path) and os.path.isfile(cls.names_path(path))):
+            return None
+        with open(cls.names_path(path), "r") as f:
+            names = json.load(f)
+        return cls(path, names)
+
+    def __getstate__(self) -> dict:
+        """
+        """
+        state = self.__dict__.copy()
+        state["_array"] = None
+        return state
+
+    def __contains__(self, name:str) -> bool:
+        return name in self.index
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def __getitem__(self, name:str) -> np.ndarray:
+        """
+        logits of the segment `name`, of shape (seq_len, n_classes)
+        """
+        if self._array is None:
+            self._array = np.load(self.path, mmap_mode="r")
+        return np.asarray(self._array[self.index[name]], dtype=np.float32)
+
+
+def get_soft_target_key(teacher_path:str,
+                        task:str,
+                        names:Sequence[str],
+                        data_signature:Optional[dict]=None) -> str:
+    """ finished, NOT checked,
+
+    Parameters
+    ----------
+    teacher_path: str,
+        path of the checkpoint of the teacher
+    task: str,
+        the task
+    names: sequence of str,
+        names of the segments
+    data_signature: dict, optional,
+        the preprocessing and slicing configurations of the segments,
+        ref. `CPSC2021.get_segments_signature`,
+        since the names of the segments are reused when the segments are re-sliced
+
+    Returns
+    -------
+    key: str,
+        (shortened) sha1 hash of the teacher checkpoint (path, size and modification time),
+        the task, the segments and their signature, so that soft targets of different teachers can coexist
+    """
+    stat = os.stat(teacher_path)
+    key = json.dumps({
+        "teacher": os.path.abspath(teacher_path),
+        "size": stat.st_size,
+        "mtime": int(stat.st_mtime),
+        "task": task,
+        "segments": hashlib.sha1("\n".join(sorted(names)).encode("utf-8")).hexdigest(),
+        "data": data_signature,
+    }, sort_keys=True)
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()[:12]
+
+
+@torch.no_grad()
+def compute_soft_targets(teacher:nn.Module,
+                         dataset:Any,
+                         path:str,
+                         batch_size:int,
+                         collate_fn:Optional[callable]=None,
+                         num_workers:int=4,
+                         verbose:int=0) -> SoftTargetCache:
+    """ finished, NOT checked,
+
+    compute the logits of the teacher of all the segments of `dataset`, with the data augmentation disabled,
+    and write them to `path` (atomically, via a temporary file)
+
+    Parameters
+    ----------
+    teacher: Module,
+        the (frozen) teacher
+    dataset: CPSC2021,
+        the dataset, of the task "qrs_detection", "main" or "multi_task"
+    path: str,
+        path of the .npy file of the logits
+    batch_size: int,
+        batch size of the forward passes of the teacher
+    collate_fn: callable, optional,
+        collate function of the data loader
+    num_workers: int, default 4,
+        number of worker processes of the data loader
+    verbose: int, default 0,
+        print verbosity
+
+    Returns
+    -------
+    SoftTargetCache, of the computed logits
+    """
+    _device = next(teacher.parameters()).device
+    _dtype = next(teacher.parameters()).dtype
+    names = list(dataset.segments)
+    prev_aug_status = dataset.use_augmentation
+    dataset.disable_data_augmentation()
+    loader = DataLoader(
+        dataset=dataset,
+        batch_size=batch_size,
+        shuffle=False,
+        num_workers=num_workers,
+        pin_memory=True,
+        drop_last=False,
+        collate_fn=collate_fn,
+    )
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{os.path.splitext(path)[0]}.tmp.npy"
+    logits, start = None, 0
+    try:
+        for data in tqdm(loader, desc="soft targets", mininterval=10, disable=verbose < 1):
+            pred = teacher(data[0].to(device=_device, dtype=_dtype)).cpu().numpy()
+            if logits is None:
+                logits = np.lib.format.open_memmap(
+                    tmp_path, mode="w+", dtype=np.float16, shape=(len(names),) + pred.shape[1:],
+                )
+            logits[start: start+pred.shape[0]] = pred
+            start += pred.shape[0]
+        logits.flush()
+        del logits
+    finally:
+        if prev_aug_status:
+            dataset.enable_data_augmentation()
+    os.replace(tmp_path, path)
+    dump_json_atomic(names, SoftTargetCache.names_path(path))
+    return SoftTargetCache(path, names)
+
+
+@torch.no_grad()
+def measure_latency(model:nn.Module,
+                    n_leads:int,
+                    input_len:int,
+                    batch_size:int=1,
+                    device:Optional[torch.device]=None,
+                    n_warmup:int=3,
+                    n_runs:int=20) -> Dict[str, float]:
+    """ finished, NOT checked,
+
+    Parameters
+    ----------
+    model: Module,
+        the model, copied (onto `device`) for the measurement
+    n_leads: int,
+        number of leads of the input
+    input_len: int,
+        length of the input
+    batch_size: int, default 1,
+        batch size of the input
+    device: torch.device, optional,
+        device on which the latency is measured, defaults to "cpu"
+    n_warmup: int, default 3,
+        number of forward passes before the measurement
+    n_runs: int, default 20,
+        number of the measured forward passes
+
+    Returns
+    -------
+    dict, of the median latency of a forward pass in milliseconds ("latency_ms"),
+    and the number of parameters ("n_params")
+    """
+    _device = device or torch.device("cpu")
+    _model = deepcopy(model).to(device=_device)
+    _model.eval()
+    _dtype = next(_model.parameters()).dtype
+    _input = torch.randn(batch_size, n_leads, input_len, device=_device, dtype=_dtype)
+    _sync = _device.type == "cuda" and torch.cuda.is_available()
+    elapsed = []
+    for idx in range(n_warmup + n_runs):
+        if _sync:
+            torch.cuda.synchronize(_device)
+        start = time.perf_counter()
+        _model(_input)
+        if _sync:
+            torch.cuda.synchronize(_device)
+        if idx >= n_warmup:
+            elapsed.append(time.perf_counter() - start)
+    return {
+        "latency_ms": 1000 * float(np.median(elapsed)),
+        "n_params": float(sum(p.numel() for p in _model.parameters())),
+    }
+
+
+def comparison_to_str(results:Dict[str, Dict[str, float]]) -> str:
+    """ finished, NOT checked,
+
+    Parameters
+    ----------
+    results: dict,
+        metrics (evaluation results, latency, etc.) of the models, keyed by the names of the models,
+        e.g. {"teacher": {...}, "student": {...}}
+
+    Returns
+    -------
+    str, the metrics of the models as a table, one column per model
+    """
+    names = list(results)
+    metrics = []
+    for res in results.values():
+        metrics.extend([k for k in res if k not in metrics])
+    width = max([len(m) for m in metrics] + [6])
+    col_width = max([len(n) for n in names] + [12])
+    lines = [f"{'':<{width}}  " + "  ".join(f"{n:>{col_width}}" for n in names)]
+    for m in metrics:
+        values = [results[n].get(m, np.nan) for n in names]
+        lines.append(f"{m:<{width}}  " + "  ".join(f"{v:>{col_width}.4f}" for v in values))
+    return "\n".join(lines)
@@ -15,6 +15,7 @@ from easydict import EasyDict as ED
 from utils.misc import save_dict
 from model import (
     ECG_SEQ_LAB_NET_CPSC2021,
+    ECG_SEQ_LAB_NET_MULTI_TASK_CPSC2021,
     ECG_UNET_CPSC2021,
     RR_LSTM_CPSC2021,
     _qrs_detection_post_process,
@@ -39,6 +40,7 @@ Save answers to '.json' files, the format is as {‘predict_endpoints’: [[s0,
 
 
 ECG_SEQ_LAB_NET_CPSC2021.__DEBUG__ = False
+ECG_SEQ_LAB_NET_MULTI_TASK_CPSC2021.__DEBUG__ = False
 ECG_UNET_CPSC2021.__DEBUG__ = False
 RR_LSTM_CPSC2021.__DEBUG__ = False
 _BASE_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -53,6 +55,9 @@ _ENTRY_CONFIG = ED()
 _ENTRY_CONFIG.use_rr_lstm_model = True
 _ENTRY_CONFIG.use_main_seq_lab_model = True
 _ENTRY_CONFIG.use_main_unet_model = False
+# rpeaks and af probabilities from one forward pass of the multi-task model (one shared backbone),
+# in place of the qrs detection model and the main task (SeqLab or UNet) model
+_ENTRY_CONFIG.use_multi_task_model = False
 _ENTRY_CONFIG.merge_rule = "union"
 
 _MODEL_FILENAME = ED(
@@ -61,6 +66,7 @@ _MODEL_FILENAME = ED(
     main_seq_lab="BestModel_main_seq_lab.pth.tar",
     main_unet="BestModel_main_unet.pth.tar",  # BestModel_main_unet_deconv.pth.tar
     # it seems that the unet_deconv model is completely useless
+    multi_task="BestModel_multi_task.pth.tar",
 )
 
 
@@ -72,7 +78,8 @@ def challenge_entry(sample_path):
     assert any([
         _ENTRY_CONFIG.use_rr_lstm_model,
         _ENTRY_CONFIG.use_main_seq_lab_model,
-        _ENTRY_CONFIG.use_main_unet_model
+        _ENTRY_CONFIG.use_main_unet_model,
+        _ENTRY_CONFIG.use_multi_task_model,
     ]), "NO model is used, please check `_ENTRY_CONFIG`"
 
     print("\n" + "*"*100)
@@ -85,14 +92,18 @@ def challenge_entry(sample_path):
 
     # all models are loaded into cpu
     # when using, move to gpu
-    rpeak_model, rpeak_cfg = ECG_SEQ_LAB_NET_CPSC2021.from_checkpoint(
-        os.path.join(_BASE_DIR, "saved_models", _MODEL_FILENAME.qrs_detection),
-        device=_CPU,
-    )
-    rpeak_model.eval()
-    rpeak_cfg = ED(rpeak_cfg)
-    if _VERBOSE >= 1:
-        print("QRS detection model is loaded")
+    if _ENTRY_CONFIG.use_multi_task_model:
+        # the multi-task model also serves as the main task model
+        rpeak_model, rpeak_cfg = None, None
+    else:
+        rpeak_model, rpeak_cfg = ECG_SEQ_LAB_NET_CPSC2021.from_checkpoint(
+            os.path.join(_BASE_DIR, "saved_models", _MODEL_FILENAME.qrs_detection),
+            device=_CPU,
+        )
+        rpeak_model.eval()
+        rpeak_cfg = ED(rpeak_cfg)
+        if _VERBOSE >= 1:
+            print("QRS detection model is loaded")
     rr_lstm_model, rr_cfg = RR_LSTM_CPSC2021.from_checkpoint(
         os.path.join(_BASE_DIR, "saved_models", _MODEL_FILENAME.rr_lstm),
         device=_CPU,
@@ -101,7 +112,15 @@ def challenge_entry(sample_path):
     rr_cfg = ED(rr_cfg)
     if _VERBOSE >= 1:
         print("RR LSTM model is loaded")
-    if _ENTRY_CONFIG.use_main_seq_lab_model:
+    if _ENTRY_CONFIG.use_multi_task_model:
+        # SeqLab model with a shared backbone for qrs detection and the main task
+        main_task_model, main_task_cfg = ECG_SEQ_LAB_NET_MULTI_TASK_CPSC2021.from_checkpoint(
+            os.path.join(_BASE_DIR, "saved_models", _MODEL_FILENAME.multi_task),
+            device=_CPU,
+        )
+        if _VERBOSE >= 1:
+            print("Multi-task SeqLab model is loaded")
+    elif _ENTRY_CONFIG.use_main_seq_lab_model:
         # SeqLab (SeqTag) model for the main task
         main_task_model, main_task_cfg = ECG_SEQ_LAB_NET_CPSC2021.from_checkpoint(
             os.path.join(_BASE_DIR, "saved_models", _MODEL_FILENAME.main_seq_lab),
@@ -213,13 +232,23 @@ def challenge_entry(sample_path):
 
     # detect rpeaks
     # finished, checked,
-    rpeaks = _detect_rpeaks(
-        model=rpeak_model,
-        sig=dl_input,
-        siglen=sig.shape[1],
-        overlap_len=overlap_len,
-        config=rpeak_cfg,
-    )
+    if _ENTRY_CONFIG.use_multi_task_model:
+        # also the af episodes of the main task, from the same forward pass
+        rpeaks, main_pred = _multi_task(
+            model=main_task_model,
+            sig=dl_input,
+            siglen=original_siglen,
+            overlap_len=overlap_len,
+            config=main_task_cfg,
+        )
+    else:
+        rpeaks = _detect_rpeaks(
+            model=rpeak_model,
+            sig=dl_input,
+            siglen=sig.shape[1],
+            overlap_len=overlap_len,
+            config=rpeak_cfg,
+        )
     # return rpeaks
 
     # rr_lstm
@@ -246,15 +275,16 @@ def challenge_entry(sample_path):
 
     # main_task
     # finished, checked,
-    if any([_ENTRY_CONFIG.use_main_seq_lab_model, _ENTRY_CONFIG.use_main_seq_lab_model]):
-        main_pred = _main_task(
-            model=main_task_model,
-            sig=dl_input,
-            siglen=original_siglen,
-            overlap_len=overlap_len,
-            rpeaks=rpeaks,
-            config=main_task_cfg,
-        )
+    if any([_ENTRY_CONFIG.use_main_seq_lab_model, _ENTRY_CONFIG.use_main_seq_lab_model, _ENTRY_CONFIG.use_multi_task_model]):
+        if not _ENTRY_CONFIG.use_multi_task_model:  # otherwise obtained along with the rpeaks
+            main_pred = _main_task(
+                model=main_task_model,
+                sig=dl_input,
+                siglen=original_siglen,
+                overlap_len=overlap_len,
+                rpeaks=rpeaks,
+                config=main_task_cfg,
+            )
         if len(main_pred) == 0:
             main_pred_cls = "N"
         elif len(main_pred) == 1 and np.diff(main_pred[0])[0] == original_siglen-1:
@@ -323,58 +353,11 @@ def _detect_rpeaks(model, sig, siglen, overlap_len, config):
     NOTE: sig are sliced data with overlap,
     hence DO NOT directly use model's inference method
     """
-    try:
-        model = model.to(_CUDA)
-    except:
-        pass
-    _device = next(model.parameters()).device
-    _dtype = next(model.parameters()).dtype
-    sig = torch.as_tensor(sig, device=_device, dtype=_dtype)
-    if sig.ndim == 2:
-        sig = sig.unsqueeze(0)  # add a batch dimension
-    batch_size, channels, seq_len = sig.shape
-
-    l_pred = []
-    for idx in range(batch_size//_BATCH_SIZE):
-        pred = model.forward(sig[_BATCH_SIZE*idx:_BATCH_SIZE*(idx+1), ...])
-        pred = model.sigmoid(pred)
-        pred = pred.cpu().detach().numpy().squeeze(-1)
-        l_pred.append(pred)
-    if batch_size % _BATCH_SIZE != 0:
-        pred = model.forward(sig[batch_size//_BATCH_SIZE * _BATCH_SIZE:, ...])
-        pred = model.sigmoid(pred)
-        pred = pred.cpu().detach().numpy().squeeze(-1)
-        l_pred.append(pred)
-    pred = np.concatenate(l_pred)
-
-    # merge the prob array
-    seglen = config[config.task].input_len // config[config.task].reduction
-    qua_overlap_len = overlap_len // 4 // config[config.task].reduction
-    forward_len = seglen - overlap_len // config[config.task].reduction
-    _siglen = siglen // config[config.task].reduction
+    pred = _forward_segments(model, sig).squeeze(-1)
 
     if _VERBOSE >= 2:
         print("\nin function _detect_rpeaks...")
-        print(f"pred.shape = {pred.shape}")
-        print(f"seglen = {seglen}, qua_overlap_len = {qua_overlap_len}, forward_len = {forward_len}")
-
-    merged_pred = np.zeros((_siglen,))
-    if pred.shape[0] > 1:
-        merged_pred[:seglen-qua_overlap_len] = pred[0, :seglen-qua_overlap_len]
-        merged_pred[_siglen-(seglen-qua_overlap_len):] = pred[-1,qua_overlap_len:]
-        for idx in range(1,pred.shape[0]-1):
-            to_compare = np.zeros((_siglen,))
-            start_idx = forward_len*idx + qua_overlap_len
-            end_idx = forward_len*idx + seglen - qua_overlap_len
-            to_compare[start_idx: end_idx] = pred[idx,qua_overlap_len: seglen-qua_overlap_len]
-            merged_pred = np.maximum(merged_pred, to_compare)
-        # tail
-        to_compare = np.zeros((_siglen,))
-        to_compare[_siglen-seglen+qua_overlap_len:] = pred[-1, qua_overlap_len:]
-        merged_pred = np.maximum(merged_pred, to_compare,)
-    else:  # too short to form one slice
-        merged_pred = pred[0, ...]
-    merged_pred = merged_pred[np.newaxis, ...]
+    merged_pred = _merge_segment_preds(pred, siglen, overlap_len, config)
     
     rpeaks = _qrs_detection_post_process(
         pred=merged_pred,
@@ -416,6 +399,62 @@ def _rr_lstm(model, rpeaks, siglen, config):
 def _main_task(model, sig, siglen, overlap_len, rpeaks, config):
     """ finished, checked,
     """
+    pred = _forward_segments(model, sig).squeeze(-1)
+
+    if _VERBOSE >= 2:
+        print("\nin function _main_task...")
+    merged_pred = _merge_segment_preds(pred, siglen, overlap_len, config)
+
+    af_episodes = _main_task_post_process(
+        pred=merged_pred,
+        fs=config.fs, 
+        reduction=config[config.task].reduction,
+        bin_pred_thr=0.5,
+        rpeaks=[rpeaks],
+        siglens=[siglen],
+    )[0]
+
+    return af_episodes
+
+
+def _multi_task(model, sig, siglen, overlap_len, config):
+    """ finished, NOT checked,
+
+    rpeaks and af episodes from one forward pass of the multi-task model,
+    the same as `_detect_rpeaks` followed by `_main_task`
+    """
+    pred = _forward_segments(model, sig)  # channel 0 for qrs, channel 1 for af
+
+    if _VERBOSE >= 2:
+        print("\nin function _multi_task...")
+    # `siglen // reduction` is the same as that of the (truncated) signal used in `_detect_rpeaks`
+    merged_qrs_pred = _merge_segment_preds(pred[..., 0], siglen, overlap_len, config)
+    merged_af_pred = _merge_segment_preds(pred[..., 1], siglen, overlap_len, config)
+
+    rpeaks = _qrs_detection_post_process(
+        pred=merged_qrs_pred,
+        fs=config.fs, 
+        reduction=config[config.task].reduction,
+        bin_pred_thr=0.5,
+    )[0]
+    af_episodes = _main_task_post_process(
+        pred=merged_af_pred,
+        fs=config.fs, 
+        reduction=config[config.task].reduction,
+        bin_pred_thr=0.5,
+        rpeaks=[rpeaks],
+        siglens=[siglen],
+    )[0]
+
+    return rpeaks, af_episodes
+
+
+def _forward_segments(model, sig):
+    """ finished, checked,
+
+    probabilities of the segments `sig`, computed batch by batch,
+    of shape (n_segments, seq_len // reduction, n_classes)
+    """
     try:
         model = model.to(_CUDA)
     except:
@@ -426,28 +465,34 @@ def _main_task(model, sig, siglen, overlap_len, rpeaks, config):
     if sig.ndim == 2:
         sig = sig.unsqueeze(0)  # add a batch dimension
     batch_size, channels, seq_len = sig.shape
-    
+
     l_pred = []
     for idx in range(batch_size//_BATCH_SIZE):
         pred = model.forward(sig[_BATCH_SIZE*idx:_BATCH_SIZE*(idx+1), ...])
         pred = model.sigmoid(pred)
-        pred = pred.cpu().detach().numpy().squeeze(-1)
+        pred = pred.cpu().detach().numpy()
         l_pred.append(pred)
     if batch_size % _BATCH_SIZE != 0:
         pred = model.forward(sig[batch_size//_BATCH_SIZE * _BATCH_SIZE:, ...])
         pred = model.sigmoid(pred)
-        pred = pred.cpu().detach().numpy().squeeze(-1)
+        pred = pred.cpu().detach().numpy()
         l_pred.append(pred)
     pred = np.concatenate(l_pred)
+    return pred
 
-    # merge the prob array
+
+def _merge_segment_preds(pred, siglen, overlap_len, config):
+    """ finished, checked,
+
+    merge the probabilities of the overlapping segments, of shape (n_segments, seq_len // reduction),
+    into that of the whole signal, of shape (1, siglen // reduction)
+    """
     seglen = config[config.task].input_len // config[config.task].reduction
     qua_overlap_len = overlap_len // 4 // config[config.task].reduction
     forward_len = seglen - overlap_len // config[config.task].reduction
     _siglen = siglen // config[config.task].reduction
 
     if _VERBOSE >= 2:
-        print("\nin function _main_task...")
         print(f"pred.shape = {pred.shape}")
         print(f"seglen = {seglen}, qua_overlap_len = {qua_overlap_len}, forward_len = {forward_len}")
 
@@ -468,17 +513,7 @@ def _main_task(model, sig, siglen, overlap_len, rpeaks, config):
     else:  # too short to form one slice
         merged_pred = pred[0, ...]
     merged_pred = merged_pred[np.newaxis, ...]
-
-    af_episodes = _main_task_post_process(
-        pred=merged_pred,
-        fs=config.fs, 
-        reduction=config[config.task].reduction,
-        bin_pred_thr=0.5,
-        rpeaks=[rpeaks],
-        siglens=[siglen],
-    )[0]
-
-    return af_episodes
+    return merged_pred
 
 
 def _merge_rule_union(rr_pred, rr_pred_cls, main_pred, main_pred_cls):
@@ -41,6 +41,7 @@ def gather_val_res(dataset_dir:Optional[str]=None) -> Tuple[pd.DataFrame, np.nda
             for item in glob.glob(os.path.join(_UNION_RES_DIR, "*.json"))
     ]
     dr = DR(dataset_dir or BaseCfg.db_dir)
+    truths = dr.load_many(val_set, fields=["af_episodes", "label",])
 
     agg_res = []
     for item in val_set:
@@ -81,8 +82,8 @@ def gather_val_res(dataset_dir:Optional[str]=None) -> Tuple[pd.DataFrame, np.nda
             val_res_main_seq_cls = "AFf"
         else:
             val_res_main_seq_cls = "AFp"
-        truth = dr.load_af_episodes(item)
-        truth_cls = dr.load_label(item)
+        truth = truths[item].af_episodes
+        truth_cls = truths[item].label
         agg_res.append({
             "record": item,
             "final_pred": val_res_final,
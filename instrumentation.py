@@ -0,0 +1,237 @@
+"""
+instrumentation of the training steps, for telling whether training is starved by data loading
+(`CPSC2021.__getitem__`) or bound by the computation (forward, backward, etc.)
+"""
+
+import os
+import time
+import logging
+from collections import OrderedDict
+from typing import Optional, Sequence, Dict, NoReturn
+
+import torch
+
+
+__all__ = [
+    "StepTimer",
+    "StepProfiler",
+]
+
+
+class StepTimer(object):
+    """ finished, NOT checked,
+
+    wall-clock time of the phases of the training steps, via laps,
+    each lap is the time elapsed since the previous lap (or `reset`),
+    accumulated per phase over a window of steps (typically `log_step` steps)
+    and over the epoch,
+    cuda is synchronized at every lap (if on cuda), so that the time of the asynchronous kernels
+    is attributed to the phases launching them
+
+    the phases of a step are
+    "data": blocked on the data loader (iterator) for the next batch,
+    "h2d": host-to-device copy of the batch (and the batch augmentations on the device),
+    "forward": forward pass and the loss,
+    "backward": backward pass,
+    "optimizer": optimizer step,
+    "other": logging, checkpointing, etc.
+    """
+    __name__ = "StepTimer"
+    phases = ["data", "h2d", "forward", "backward", "optimizer", "other",]
+
+    def __init__(self, device:torch.device, enabled:bool=True) -> NoReturn:
+        """
+
+        Parameters
+        ----------
+        device: torch.device,
+            device on which the model trains
+        enabled: bool, default True,
+            if False, all methods are no-ops
+        """
+        self.device = device
+        self.enabled = enabled
+        self._sync = self.enabled and self.device.type == "cuda" and torch.cuda.is_available()
+        self._last = None
+        self._window = self._empty_record()
+        self._epoch = self._empty_record()
+
+    def _empty_record(self) -> dict:
+        """
+        """
+        return {"time": OrderedDict((p, 0.0) for p in self.phases), "n_steps": 0, "n_samples": 0, "start": None}
+
+    def reset(self) -> NoReturn:
+        """ (re-)start timing, typically before fetching the first batch of an epoch,
+        the window and epoch records are cleared
+        """
+        if not self.enabled:
+            return
+        self._synchronize()
+        self._last = time.perf_counter()
+        self._window = self._empty_record()
+        self._epoch = self._empty_record()
+        self._window["start"] = self._epoch["start"] = self._last
+
+    def lap(self, phase:str) -> NoReturn:
+        """ attribute the time elapsed since the previous lap to `phase`
+        """
+        if not self.enabled:
+            return
+        self._synchronize()
+        now = time.perf_counter()
+        elapsed = now - self._last
+        self._last = now
+        self._window["time"][phase] += elapsed
+        self._epoch["time"][phase] += elapsed
+
+    def end_step(self, n_samples:int) -> NoReturn:
+        """ end a step of `n_samples` samples, with the time since the previous lap attributed to "other"
+        """
+        if not self.enabled:
+            return
+        self.lap("other")
+        for record in [self._window, self._epoch]:
+            record["n_steps"] += 1
+            record["n_samples"] += n_samples
+
+    def window_summary(self, reset:bool=True) -> Dict[str, float]:
+        """ finished, NOT checked,
+
+        Parameters
+        ----------
+        reset: bool, default True,
+            if True, the window is restarted
+
+        Returns
+        -------
+        summary: dict,
+            mean time (in milliseconds) per step of the phases (keys "time_{phase}"),
+            fraction of the time blocked on data loading ("data_wait_ratio"),
+            and the throughput ("samples_per_sec"), over the window
+        """
+        summary = self._summarize(self._window)
+        if reset and self.enabled:
+            self._window = self._empty_record()
+            self._window["start"] = self._last
+        return summary
+
+    def epoch_summary(self) -> Dict[str, float]:
+        """ the same as `window_summary`, over the epoch
+        """
+        return self._summarize(self._epoch)
+
+    def _summarize(self, record:dict) -> Dict[str, float]:
+        """
+        """
+        if not self.enabled or record["n_steps"] == 0:
+            return {}
+        n_steps = record["n_steps"]
+        total = sum(record["time"].values())
+        summary = OrderedDict(
+            (f"time_{p}", 1000 * t / n_steps) for p, t in record["time"].items()
+        )
+        summary["data_wait_ratio"] = record["time"]["data"] / max(total, 1e-12)
+        summary["samples_per_sec"] = record["n_samples"] / max(self._last - record["start"], 1e-12)
+        return summary
+
+    def _synchronize(self) -> NoReturn:
+        """
+        """
+        if self._sync:
+            torch.cuda.synchronize(self.device)
+
+
+class StepProfiler(object):
+    """ finished, NOT checked,
+
+    capture a profile (via `torch.profiler`, or `torch.autograd.profiler` for torch < 1.8.1) of a window of training steps,
+    exported as a chrome trace (viewable in chrome://tracing, or via the pytorch profiler plugin of TensorBoard),
+    with a summary table of the operators logged
+    """
+    __name__ = "StepProfiler"
+
+    def __init__(self,
+                 steps:Optional[Sequence[int]],
+                 trace_dir:str,
+                 device:torch.device,
+                 logger:Optional[logging.Logger]=None) -> NoReturn:
+        """
+
+        Parameters
+        ----------
+        steps: sequence of int, optional,
+            (global) steps [start, end] (inclusive) to profile,
+            if None, nothing is profiled
+        trace_dir: str,
+            directory to save the trace
+        device: torch.device,
+            device on which the model trains, cuda activities are also recorded if on cuda
+        logger: Logger, optional,
+            logger
+        """
+        self.steps = list(steps) if steps else None
+        if self.steps:
+            assert len(self.steps) == 2 and 1 <= self.steps[0] <= self.steps[1], \
+                f"`steps` should be [start, end] with 1 <= start <= end, but got {steps}"
+        self.trace_dir = trace_dir
+        self.device = device
+        self.logger = logger
+        self._profiler = None
+
+    @property
+    def active(self) -> bool:
+        return self._profiler is not None
+
+    def step(self, global_step:int) -> bool:
+        """ called at the beginning of every training step, starts or stops profiling,
+        returns True if profiling is started or stopped
+        """
+        if not self.steps:
+            return False
+        if global_step == self.steps[0] and not self.active:
+            try:
+                import torch.profiler  # available since torch 1.8.1
+                activities = [torch.profiler.ProfilerActivity.CPU]
+                if self.device.type == "cuda":
+                    activities.append(torch.profiler.ProfilerActivity.CUDA)
+                self._profiler = torch.profiler.profile(activities=activities, record_shapes=True)
+                self._profiler.start()
+            except ImportError:  # torch 1.8.0 (the pinned version), via the legacy autograd profiler
+                self._profiler = torch.autograd.profiler.profile(
+                    use_cuda=self.device.type == "cuda", record_shapes=True,
+                )
+                self._profiler.__enter__()
+            self._log(f"profiling of the training steps {self.steps[0]} - {self.steps[1]} started")
+            return True
+        if global_step > self.steps[1] and self.active:
+            self.close()
+            return True
+        return False
+
+    def close(self) -> NoReturn:
+        """ stop profiling (if active), export the trace and log the summary
+        """
+        if not self.active:
+            return
+        profiler, self._profiler = self._profiler, None
+        if hasattr(profiler, "stop"):
+            profiler.stop()
+        else:  # the legacy autograd profiler
+            profiler.__exit__(None, None, None)
+        os.makedirs(self.trace_dir, exist_ok=True)
+        trace_path = os.path.join(self.trace_dir, f"trace_steps_{self.steps[0]}-{self.steps[1]}.json")
+        profiler.export_chrome_trace(trace_path)
+        sort_by = "self_cuda_time_total" if self.device.type == "cuda" else "self_cpu_time_total"
+        self._log(
+            f"profile of the training steps {self.steps[0]} - {self.steps[1]} saved to {trace_path}\n"
+            f"{profiler.key_averages().table(sort_by=sort_by, row_limit=20)}"
+        )
+
+    def _log(self, msg:str) -> NoReturn:
+        """
+        """
+        if self.logger:
+            self.logger.info(msg)
+        else:
+            print(msg)
@@ -17,6 +17,7 @@ import numpy as np
 import pandas as pd
 import torch
 from torch import Tensor
+import torch.nn.functional as F
 from easydict import EasyDict as ED
 
 # models from torch_ecg
@@ -32,6 +33,7 @@ from utils.utils_interval import intervals_union
 
 __all__ = [
     "ECG_SEQ_LAB_NET_CPSC2021",
+    "ECG_SEQ_LAB_NET_MULTI_TASK_CPSC2021",
     "ECG_UNET_CPSC2021",
     "ECG_SUBTRACT_UNET_CPSC2021",
     "RR_LSTM_CPSC2021",
@@ -226,6 +228,165 @@ class ECG_SEQ_LAB_NET_CPSC2021(ECG_SEQ_LAB_NET):
         return model, aux_config
 
 
+class ECG_SEQ_LAB_NET_MULTI_TASK_CPSC2021(ECG_SEQ_LAB_NET_CPSC2021):
+    """
+    one shared backbone (cnn, rnn, attn) with two sequence labelling heads,
+    the qrs head (`self.clf`) and the af head (`self.af_clf`),
+    so that the rpeaks and the af episodes are obtained from one forward pass,
+    the output of `forward` is of shape (batch_size, seq_len//reduction, 2),
+    the channels being the logits of the qrs complexes and of af respectively
+    """
+    __DEBUG__ = True
+    __name__ = "ECG_SEQ_LAB_NET_MULTI_TASK_CPSC2021"
+
+    def __init__(self, config:ED, **kwargs:Any) -> NoReturn:
+        """ finished, NOT checked,
+
+        Parameters
+        ----------
+        config: dict,
+            other hyper-parameters, including kernel sizes, etc.
+            ref. the corresponding config file
+
+        Usage
+        -----
+        from cfg import ModelCfg
+        task = "multi_task"
+        model_cfg = deepcopy(ModelCfg[task])
+        model = ECG_SEQ_LAB_NET_MULTI_TASK_CPSC2021(model_cfg)
+        """
+        assert config.model_name == "seq_lab" and len(config.classes) == 2, \
+            "the multi-task model has one (1-class) sequence labelling head for each of the qrs complexes and af"
+        # the backbone and the qrs head
+        head_config = deepcopy(config)
+        head_config.classes = config.classes[:1]
+        super().__init__(head_config, **kwargs)
+        # the af head, of the same structure as the qrs head (with independent initialization),
+        # taken from a model of the same config, whose backbone is dropped
+        head_config.classes = config.classes[1:]
+        self.af_clf = ECG_SEQ_LAB_NET_CPSC2021(head_config, **kwargs).clf
+        self.classes = list(config.classes)
+        self.n_classes = len(self.classes)
+        self.task = config.task
+
+    def forward(self, input:Tensor) -> Tensor:
+        """ finished, NOT checked,
+
+        Parameters
+        ----------
+        input: Tensor,
+            input tensor, of shape (batch_size, channels, seq_len)
+
+        Returns
+        -------
+        pred: Tensor,
+            logits of the qrs complexes (channel 0) and of af (channel 1),
+            of shape (batch_size, seq_len//reduction, 2)
+        """
+        batch_size, channels, seq_len = input.shape
+        features = self.extract_features(input)  # (batch_size, seq_len//reduction, channels)
+        pred = torch.cat([self.clf(features), self.af_clf(features)], dim=-1)
+        if self.config.get("recover_length", False):
+            pred = F.interpolate(
+                pred.permute(0,2,1), size=seq_len, mode="linear", align_corners=True,
+            ).permute(0,2,1)
+        return pred
+
+    @torch.no_grad()
+    def inference(self,
+                  input:Union[Sequence[float],np.ndarray,Tensor],
+                  bin_pred_thr:float=0.5,
+                  duration_thr:int=4*16,
+                  dist_thr:Union[int,Sequence[int]]=200,
+                  episode_len_thr:int=5,) -> Tuple[np.ndarray, List[np.ndarray], List[List[List[int]]]]:
+        """ finished, NOT checked,
+
+        the rpeaks, and the af episodes (filtered by the rpeaks),
+        from one forward pass
+
+        Parameters
+        ----------
+        input: array_like,
+            input tensor, of shape (..., channels, seq_len)
+        bin_pred_thr: float, default 0.5,
+            the threshold for making binary predictions from scalar predictions
+        duration_thr: int, default 4*16,
+            minimum duration for a "true" qrs complex, units in ms
+        dist_thr: int or sequence of int, default 200,
+            minimum (and maximum) distance of consecutive qrs complexes, units in ms,
+            ref. `_qrs_detection_post_process`
+        episode_len_thr: int, default 5,
+            minimal length of (both af and normal) episodes,
+            with units in number of beats (rpeaks)
+
+        Returns
+        -------
+        pred: ndarray,
+            the array of scalar predictions, of shape (batch_size, seq_len//reduction, 2),
+            the channels being the predictions of the qrs complexes and of af respectively
+        rpeaks: list of ndarray,
+            list of rpeak indices for each batch element
+        af_episodes: list of list of intervals,
+            af episodes, in the form of intervals of [start, end]
+        """
+        self.eval()
+        _device = next(self.parameters()).device
+        _dtype = next(self.parameters()).dtype
+        _input = torch.as_tensor(input, dtype=_dtype, device=_device)
+        if _input.ndim == 2:
+            _input = _input.unsqueeze(0)  # add a batch dimension
+        batch_size, n_leads, seq_len = _input.shape
+        pred = self.forward(_input)
+        pred = self.sigmoid(pred)
+        pred = pred.cpu().detach().numpy()
+
+        rpeaks = _qrs_detection_post_process(
+            pred=pred[..., 0],
+            fs=self.config.fs,
+            reduction=self.config.reduction,
+            bin_pred_thr=bin_pred_thr,
+            duration_thr=duration_thr,
+            dist_thr=dist_thr,
+        )
+        af_episodes = _main_task_post_process(
+            pred=pred[..., 1],
+            fs=self.config.fs,
+            reduction=self.config.reduction,
+            bin_pred_thr=bin_pred_thr,
+            rpeaks=rpeaks,
+            siglens=list(repeat(seq_len, batch_size)),
+            episode_len_thr=episode_len_thr,
+        )
+        return pred, rpeaks, af_episodes
+
+    @staticmethod
+    def from_checkpoint(path:str, device:Optional[torch.device]=None) -> Tuple[torch.nn.Module, dict]:
+        """ finished, NOT checked,
+
+        Parameters
+        ----------
+        path: str,
+            path of the checkpoint
+        device: torch.device, optional,
+            map location of the model parameters,
+            defaults "cuda" if available, otherwise "cpu"
+
+        Returns
+        -------
+        model: Module,
+            the model loaded from a checkpoint
+        aux_config: dict,
+            auxiliary configs that are needed for data preprocessing, etc.
+        """
+        _device = device or (torch.device("cuda") if torch.cuda.is_available() else torch.device("cpu"))
+        ckpt = torch.load(path, map_location=_device)
+        aux_config = ckpt.get("train_config", None) or ckpt.get("config", None)
+        assert aux_config is not None, "input checkpoint has no sufficient data to recover a model"
+        model = ECG_SEQ_LAB_NET_MULTI_TASK_CPSC2021(config=ckpt["model_config"])
+        model.load_state_dict(ckpt["model_state_dict"])
+        return model, aux_config
+
+
 class ECG_UNET_CPSC2021(ECG_UNET):
     """
     """
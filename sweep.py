@@ -0,0 +1,416 @@
+"""
+hyperparameter sweeps, with several trials (configurations of `TrainCfg`) trained concurrently,
+each in a forked process with its own share of the cpu threads,
+the datasets (and the readers) are created once in the main process,
+and shared (copy-on-write) by the trials, along with the memory-mapped caches (preprocessed records, shards, etc.),
+losing trials are stopped early via the median stopping rule on the monitored metric,
+and the results of the trials are written to a table
+
+usage:
+python sweep.py --task main --grid '{"learning_rate": [1e-3, 3e-4], "main.overlap_len": [2000, 3000]}'
+"""
+
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import traceback
+import subprocess
+import multiprocessing as mp
+from multiprocessing.connection import wait
+from copy import deepcopy
+from itertools import product
+from collections import OrderedDict
+from typing import Any, List, Dict, Optional, NoReturn
+
+import numpy as np
+import pandas as pd
+import torch
+from easydict import EasyDict as ED
+
+from torch_ecg.torch_ecg.utils.misc import init_logger, get_date_str, dict_to_str
+from cfg import TrainCfg, SweepCfg
+from dataset import CPSC2021
+from trainer import train, _get_model, _set_task
+
+
+__all__ = [
+    "run_sweep",
+    "MedianStoppingRule",
+]
+
+
+# keys copied from `config[task]` to `config` in `trainer._set_task`,
+# hence are overridden in `config[task]`
+_TASK_KEYS = ["classes", "monitor", "final_model_name", "loss",]
+# keys of the segmentation, which change the (virtual) segments regenerated every epoch
+_SEGMENT_KEYS = ["overlap_len", "critical_overlap_len", "stretch_compress",]
+# keys that can NOT be swept, since the datasets and the labels are shared by the trials
+_FIXED_KEYS = ["input_len", "reduction", "model_name", "classes", "db_dir", "preproc", "virtual_segments",]
+
+
+def get_trials(grid:Dict[str, List[Any]]) -> List[Dict[str, Any]]:
+    """ finished, NOT checked,
+
+    Parameters
+    ----------
+    grid: dict,
+        candidate values, keyed by (dotted) keys of `TrainCfg`
+
+    Returns
+    -------
+    list of dict, the overrides of the trials, the cartesian product of the grid
+    """
+    keys = list(grid)
+    return [OrderedDict(zip(keys, values)) for values in product(*[grid[k] for k in keys])]
+
+
+def _apply_overrides(config:ED, overrides:Dict[str, Any], task:str) -> NoReturn:
+    """ finished, NOT checked,
+
+    Parameters
+    ----------
+    config: dict,
+        the configurations (of training, or of a dataset), modified in place
+    overrides: dict,
+        values keyed by (dotted) keys, e.g. "learning_rate", "main.overlap_len"
+    task: str,
+        the task, whose sub-config holds the keys of `_TASK_KEYS`
+    """
+    for key, value in overrides.items():
+        if "." not in key and key in _TASK_KEYS:
+            key = f"{task}.{key}"
+        *parents, name = key.split(".")
+        cfg = config
+        for p in parents:
+            cfg = cfg[p]
+        cfg[name] = value
+
+
+class MedianStoppingRule(object):
+    """ finished, NOT checked,
+
+    the median stopping rule, used as the `epoch_callback` of `trainer.train`:
+    after `grace_epochs` epochs, a trial is stopped if its best monitored metric so far
+    is below the median of the best monitored metrics of the other trials up to the same epoch,
+    computed over at least `min_trials` other trials that have reached the epoch,
+    the evaluation results of all the trials are shared via a (manager) dict
+    """
+    __name__ = "MedianStoppingRule"
+
+    def __init__(self,
+                 records:Dict[str, List[dict]],
+                 trial:str,
+                 monitor:str,
+                 grace_epochs:int=3,
+                 min_trials:int=2) -> NoReturn:
+        """
+
+        Parameters
+        ----------
+        records: dict,
+            evaluation results of the epochs, keyed by the names of the trials,
+            typically a dict of a `multiprocessing.Manager`, shared by the trials
+        trial: str,
+            name of the current trial
+        monitor: str,
+            the monitored metric, the larger the better
+        grace_epochs: int, default 3,
+            number of epochs during which no trial is stopped
+        min_trials: int, default 2,
+            minimum number of other trials for computing the median
+        """
+        self.records = records
+        self.trial = trial
+        self.monitor = monitor
+        self.grace_epochs = grace_epochs
+        self.min_trials = min_trials
+        self.stopped = False
+
+    def __call__(self, epoch:int, eval_res:Dict[str, float]) -> bool:
+        """
+        """
+        # reassigned, so that the update is propagated by the manager
+        history = list(self.records.get(self.trial, [])) + [{k: float(v) for k, v in eval_res.items()}]
+        self.records[self.trial] = history
+        if epoch <= self.grace_epochs:
+            return False
+        best = max([r[self.monitor] for r in history])
+        others = [
+            max([r[self.monitor] for r in h[:epoch]]) \
+                for t, h in self.records.items() if t != self.trial and len(h) >= epoch
+        ]
+        if len(others) < self.min_trials:
+            return False
+        self.stopped = best < np.median(others)
+        return self.stopped
+
+
+def _run_trial(trial:str,
+               overrides:Dict[str, Any],
+               config:ED,
+               sweep_config:ED,
+               train_dataset:CPSC2021,
+               val_dataset:CPSC2021,
+               records:Dict[str, List[dict]],
+               status:Dict[str, dict],
+               n_threads:int,
+               device:torch.device) -> NoReturn:
+    """ finished, NOT checked,
+
+    train one trial, in a forked process of `run_sweep`,
+    the datasets are inherited from the main process, and modified (copy-on-write) only in this process
+    """
+    start = time.time()
+    torch.set_num_threads(n_threads)
+    config = deepcopy(config)
+    _apply_overrides(config, overrides, config.task)
+    _set_task(config.task, config)
+    for ds in [train_dataset, val_dataset]:
+        _apply_overrides(ds.config, overrides, config.task)
+    trial_dir = os.path.join(sweep_config.sweep_dir, trial)
+    config.log_dir = os.path.join(trial_dir, "log")
+    config.checkpoints = os.path.join(trial_dir, "checkpoints")
+    config.model_dir = os.path.join(trial_dir, "saved_models")
+    config.num_workers = sweep_config.workers_per_trial
+
+    # the handlers of the logger of the main process are inherited via fork
+    logger = logging.getLogger("CPSC2021")
+    for h in list(logger.handlers):
+        logger.removeHandler(h)
+    logger = init_logger(log_dir=config.log_dir, verbose=1)
+    logger.info(f"trial {trial}, with overrides\n{dict_to_str(overrides)}\nusing {n_threads} threads on {device}")
+
+    rule = MedianStoppingRule(
+        records, trial, config.monitor,
+        grace_epochs=sweep_config.grace_epochs, min_trials=sweep_config.min_trials,
+    )
+    try:
+        model, model_config = _get_model(config.task, config)
+        model.to(device=device)
+        train(
+            model=model,
+            model_config=model_config,
+            config=config,
+            device=device,
+            logger=logger,
+            debug=False,
+            train_dataset=train_dataset,
+            val_dataset=val_dataset,
+            epoch_callback=rule,
+        )
+        trial_status = "stopped" if rule.stopped else "finished"
+    except Exception:
+        trial_status = "failed"
+        traceback.print_exc()
+    status[trial] = {"status": trial_status, "time_min": (time.time() - start) / 60}
+    if trial_status == "failed":
+        sys.exit(1)
+
+
+def _results_table(trials:Dict[str, Dict[str, Any]],
+                   records:Dict[str, List[dict]],
+                   status:Dict[str, dict],
+                   monitor:str) -> pd.DataFrame:
+    """ finished, NOT checked,
+
+    Parameters
+    ----------
+    trials: dict,
+        overrides of the trials, keyed by the names of the trials
+    records: dict,
+        evaluation results of the epochs of the trials
+    status: dict,
+        status and time of the (ended) trials
+    monitor: str,
+        the monitored metric
+
+    Returns
+    -------
+    df: DataFrame,
+        one row per trial, with the overrides, the status, and the evaluation results of the best epoch,
+        sorted by the monitored metric (descending)
+    """
+    rows = []
+    for trial, overrides in trials.items():
+        history = list(records.get(trial, []))
+        row = OrderedDict(trial=trial)
+        row.update(overrides)
+        row.update(status.get(trial, {"status": "running"}))
+        row["n_epochs"] = len(history)
+        if history:
+            best_idx = int(np.argmax([r[monitor] for r in history]))
+            row["best_epoch"] = best_idx + 1
+            row.update(history[best_idx])
+        rows.append(row)
+    df = pd.DataFrame(rows)
+    if monitor in df.columns:
+        df = df.sort_values(by=monitor, ascending=False, na_position="last")
+    return df
+
+
+def _count_gpus() -> int:
+    """ finished, NOT checked,
+
+    count the visible GPUs WITHOUT initializing CUDA in the current process,
+    which would break CUDA in the forked trials
+
+    Returns
+    -------
+    int, number of the visible GPUs,
+        from `CUDA_VISIBLE_DEVICES` if set, otherwise from `nvidia-smi`
+    """
+    visible = os.environ.get("CUDA_VISIBLE_DEVICES", None)
+    if visible is not None:
+        return len([d for d in visible.split(",") if d.strip() and d.strip() != "-1"])
+    try:
+        out = subprocess.run(
+            ["nvidia-smi", "-L"], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True,
+        ).stdout.decode("utf-8")
+    except (OSError, subprocess.CalledProcessError):
+        return 0
+    return len([l for l in out.splitlines() if l.startswith("GPU ")])
+
+
+def run_sweep(config:ED, sweep_config:ED, logger:Optional[logging.Logger]=None) -> pd.DataFrame:
+    """ finished, NOT checked,
+
+    Parameters
+    ----------
+    config: dict,
+        the base configurations of training, ref. `TrainCfg`
+    sweep_config: dict,
+        configurations of the sweep, ref. `SweepCfg`
+    logger: Logger, optional,
+        logger
+
+    Returns
+    -------
+    df: DataFrame,
+        the results of the trials, also written to "results.csv" in `sweep_config.sweep_dir`
+    """
+    config = deepcopy(config)
+    task = sweep_config.task
+    _set_task(task, config)
+    for key in sweep_config.grid:
+        name = key.split(".")[-1]
+        assert name not in _FIXED_KEYS, \
+            f"`{key}` can not be swept, since the datasets are shared by the trials"
+        assert name not in _SEGMENT_KEYS or config.virtual_segments, \
+            f"`{key}` can be swept only with `virtual_segments`, which are regenerated every epoch"
+    trials = OrderedDict(
+        (f"trial_{idx:03d}", overrides) for idx, overrides in enumerate(get_trials(sweep_config.grid))
+    )
+    assert len(trials) > 0, "the grid of the sweep is empty"
+    os.makedirs(sweep_config.sweep_dir, exist_ok=True)
+    results_path = os.path.join(sweep_config.sweep_dir, "results.csv")
+
+    n_parallel = max(1, min(sweep_config.n_parallel, len(trials)))
+    n_threads = sweep_config.threads_per_trial \
+        or max(1, (os.cpu_count() - n_parallel * sweep_config.workers_per_trial) // n_parallel)
+    # NOT `torch.cuda.device_count()`, CUDA can NOT be initialized before the fork
+    n_gpus = _count_gpus()
+
+    msg = f"{len(trials)} trials of task \042{task}\042, {n_parallel} in parallel, each with {n_threads} threads"
+    if logger:
+        logger.info(msg)
+    else:
+        print(msg)
+
+    # created once, the trials share them (and the memory-mapped caches) via fork
+    train_dataset = CPSC2021(config=config, task=task, training=True)
+    val_dataset = CPSC2021(config=config, task=task, training=False)
+
+    ctx = mp.get_context("fork")
+    manager = ctx.Manager()
+    records, status = manager.dict(), manager.dict()
+    pending = list(trials.items())
+    running = {}  # sentinel --> (trial, process)
+    n_started = 0
+    while pending or running:
+        while pending and len(running) < n_parallel:
+            trial, overrides = pending.pop(0)
+            device = torch.device(f"cuda:{n_started % n_gpus}") if n_gpus > 0 else torch.device("cpu")
+            p = ctx.Process(
+                target=_run_trial,
+                args=(trial, overrides, config, sweep_config, train_dataset, val_dataset, records, status, n_threads, device),
+                name=trial,
+            )
+            p.start()
+            running[p.sentinel] = (trial, p)
+            n_started += 1
+        for sentinel in wait(list(running)):
+            trial, p = running.pop(sentinel)
+            p.join()
+            if trial not in status:  # e.g. killed
+                status[trial] = {"status": "failed", "time_min": np.nan}
+            msg = f"{trial} {status[trial]['status']}, with exit code {p.exitcode}"
+            if logger:
+                logger.info(msg)
+            else:
+                print(msg)
+        # partial results are kept if the sweep is interrupted
+        df = _results_table(trials, records, status, config.monitor)
+        df.to_csv(results_path, index=False)
+
+    msg = f"results of the sweep, saved to {results_path}:\n{df.to_string(index=False)}"
+    if logger:
+        logger.info(msg)
+    else:
+        print(msg)
+    manager.shutdown()
+    return df
+
+
+def get_args(**kwargs:Any) -> ED:
+    """ NOT checked,
+    """
+    cfg = deepcopy(kwargs)
+    parser = argparse.ArgumentParser(
+        description="Hyperparameter sweep of the Models on CPSC2021",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument(
+        "--task", type=str, default=cfg.get("task", "main"),
+        choices=TrainCfg.tasks,
+        help="the task to train",
+        dest="task")
+    parser.add_argument(
+        "--grid", type=str, default=None,
+        help="the grid, a json string or the path of a json file, keyed by (dotted) keys of `TrainCfg`",
+        dest="grid")
+    parser.add_argument(
+        "--n-parallel", type=int, default=cfg.get("n_parallel", 4),
+        help="number of trials trained concurrently",
+        dest="n_parallel")
+    parser.add_argument(
+        "--threads-per-trial", type=int, default=cfg.get("threads_per_trial", None),
+        help="torch threads of each trial, defaults to the cpus evenly partitioned",
+        dest="threads_per_trial")
+    parser.add_argument(
+        "--sweep-dir", type=str, default=cfg.get("sweep_dir", None),
+        help="directory of the logs, checkpoints, models and results of the trials",
+        dest="sweep_dir")
+
+    args = vars(parser.parse_args())
+    grid = args.pop("grid")
+    if grid is not None:
+        if os.path.isfile(grid):
+            with open(grid, "r") as f:
+                grid = json.load(f)
+        else:
+            grid = json.loads(grid)
+        cfg["grid"] = ED(grid)
+    if args["sweep_dir"] is None:
+        args["sweep_dir"] = os.path.join(cfg.get("sweep_dir", "sweeps"), f"{args['task']}_{get_date_str()}")
+    cfg.update(args)
+
+    return ED(cfg)
+
+
+if __name__ == "__main__":
+    sweep_config = get_args(**SweepCfg)
+    logger = init_logger(log_dir=sweep_config.sweep_dir, verbose=1)
+    logger.info(f"sweep with configuration\n{dict_to_str(sweep_config)}")
+    run_sweep(TrainCfg, sweep_config, logger=logger)
@@ -4,11 +4,14 @@
 import os
 import sys
 import time
+import random
+import signal
 import logging
 import argparse
 import textwrap
 from copy import deepcopy
-from collections import deque, OrderedDict
+from itertools import islice
+from collections import OrderedDict
 from typing import Any, Union, Optional, Tuple, Sequence, NoReturn, Dict
 from numbers import Real, Number
 
@@ -23,8 +26,10 @@ import torch
 from torch import nn
 from torch import optim
 from torch import Tensor
-from torch.utils.data import DataLoader
+from torch.utils.data import DataLoader, Sampler
+from torch.utils.data.distributed import DistributedSampler
 import torch.nn.functional as F
+import torch.distributed as dist
 from torch.nn.parallel import DistributedDataParallel as DDP, DataParallel as DP
 from tensorboardX import SummaryWriter
 from easydict import EasyDict as ED
@@ -38,20 +43,28 @@ from torch_ecg.torch_ecg.utils.misc import (
     init_logger, get_date_str, dict_to_str, str2bool,
 )
 from model import (
-    ECG_SEQ_LAB_NET_CPSC2021,
+    ECG_SEQ_LAB_NET_CPSC2021, ECG_SEQ_LAB_NET_MULTI_TASK_CPSC2021,
     ECG_UNET_CPSC2021, ECG_SUBTRACT_UNET_CPSC2021,
     RR_LSTM_CPSC2021,
     _qrs_detection_post_process,
 )
 from utils.scoring_metrics import compute_challenge_metric
 from utils.aux_metrics import (
-    compute_rpeak_metric,
-    compute_rr_metric,
-    compute_main_task_metric,
+    RPeakMetricAccumulator,
+    RRMetricAccumulator,
+    MainTaskMetricAccumulator,
 )
 from utils.misc import mask_to_intervals
 from cfg import BaseCfg, TrainCfg, ModelCfg
-from dataset import CPSC2021
+from dataset import CPSC2021, RRSeqBatchSampler
+from augmentation import BatchAugmenter
+from checkpoint import CheckpointManager, snapshot_state, get_rng_states, set_rng_states
+from instrumentation import StepTimer, StepProfiler
+from distillation import (
+    freeze_teacher, distillation_loss,
+    SoftTargetCache, get_soft_target_key, compute_soft_targets,
+    measure_latency, comparison_to_str,
+)
 
 if BaseCfg.torch_dtype.lower() == "double":
     torch.set_default_tensor_type(torch.DoubleTensor)
@@ -70,7 +83,10 @@ def train(model:nn.Module,
           device:torch.device,
           config:dict,
           logger:Optional[logging.Logger]=None,
-          debug:bool=False) -> OrderedDict:
+          debug:bool=False,
+          train_dataset:Optional[CPSC2021]=None,
+          val_dataset:Optional[CPSC2021]=None,
+          epoch_callback:Optional[callable]=None) -> OrderedDict:
     """ finished, checked,
 
     Parameters
@@ -88,6 +104,14 @@ def train(model:nn.Module,
     debug: bool, default False,
         if True, the training set itself would be evaluated 
         to check if the model really learns from the training set
+    train_dataset: CPSC2021, optional,
+        the training dataset, created from `config` if not given,
+        e.g. shared by the trials of `sweep.run_sweep`
+    val_dataset: CPSC2021, optional,
+        the validation dataset, created from `config` if not given
+    epoch_callback: callable, optional,
+        called with the (1-based) epoch and the evaluation results after the checkpoint of each epoch is saved,
+        training is stopped (as early stopping) if it returns True
 
     Returns
     -------
@@ -100,17 +124,33 @@ def train(model:nn.Module,
     else:
         print(msg)
 
-    if type(model).__name__ in ["DataParallel",]:  # TODO: further consider "DistributedDataParallel"
+    if type(model).__name__ in ["DataParallel", "DistributedDataParallel",]:
         _model = model.module
     else:
         _model = model
 
-    train_dataset = CPSC2021(config=config, task=config.task, training=True)
+    # distributed training (launched via `torchrun`), ref. `_init_distributed`
+    world_size, rank = _get_world_size(), _get_rank()
+    distributed = world_size > 1
+    is_main_process = rank == 0
+    if distributed and not is_main_process:
+        # wait for the main process to create (or check) the cached files
+        dist.barrier()
+
+    if train_dataset is None:
+        train_dataset = CPSC2021(config=config, task=config.task, training=True)
 
     if debug:
         val_train_dataset = CPSC2021(config=config, task=config.task, training=True)
         val_train_dataset.disable_data_augmentation()
-    val_dataset = CPSC2021(config=config, task=config.task, training=False)
+    if val_dataset is None:
+        val_dataset = CPSC2021(config=config, task=config.task, training=False)
+
+    if distributed and is_main_process:
+        dist.barrier()
+    # the items are shuffled by the samplers (reproducibly), ref. `_sync_item_order`
+    for ds in [train_dataset, val_dataset] + ([val_train_dataset] if debug else []):
+        _sync_item_order(ds)
 
     n_train = len(train_dataset)
     n_val = len(val_dataset)
@@ -120,47 +160,27 @@ def train(model:nn.Module,
     lr = config.learning_rate
 
     # https://discuss.pytorch.org/t/guidelines-for-assigning-num-workers-to-dataloader/813/4
-    num_workers = 4
-
-    train_loader = DataLoader(
-        dataset=train_dataset,
-        batch_size=batch_size,
-        shuffle=True,
-        num_workers=num_workers,
-        pin_memory=True,
-        drop_last=False,
-        collate_fn=collate_fn,
-    )
+    num_workers = config.get("num_workers", 4)
 
+    # seed of the (per-epoch) permutations of the training items, stored into the checkpoints
+    sampler_seed = config.dist_seed if distributed else random.randrange(2**31)
+    train_loader = _get_train_loader(train_dataset, config, num_workers, sampler_seed)
     if debug:
-        val_train_loader = DataLoader(
-            dataset=val_train_dataset,
-            batch_size=batch_size*4,
-            shuffle=True,
-            num_workers=num_workers,
-            pin_memory=True,
-            drop_last=False,
-            collate_fn=collate_fn,
-        )
-    val_loader = DataLoader(
-        dataset=val_dataset,
-        batch_size=batch_size*4,
-        shuffle=True,
-        num_workers=num_workers,
-        pin_memory=True,
-        drop_last=False,
-        collate_fn=collate_fn,
-    )
+        val_train_loader = _get_eval_loader(val_train_dataset, config, num_workers)
+    val_loader = _get_eval_loader(val_dataset, config, num_workers)
 
     cnn_name = "_" + config.cnn_name if hasattr(config, "cnn_name") else ""
     rnn_name = "_" + config.rnn_name if hasattr(config, "rnn_name") else ""
     attn_name = "_" + config.attn_name if hasattr(config, "attn_name") else ""
     
-    writer = SummaryWriter(
-        log_dir=config.log_dir,
-        filename_suffix=f"OPT_{config.task}_{_model.__name__}{cnn_name}{rnn_name}{attn_name}_{config.train_optimizer}_LR_{lr}_BS_{batch_size}",
-        comment=f"OPT_{config.task}_{_model.__name__}{cnn_name}{rnn_name}{attn_name}_{config.train_optimizer}_LR_{lr}_BS_{batch_size}",
-    )
+    if is_main_process:
+        writer = SummaryWriter(
+            log_dir=config.log_dir,
+            filename_suffix=f"OPT_{config.task}_{_model.__name__}{cnn_name}{rnn_name}{attn_name}_{config.train_optimizer}_LR_{lr}_BS_{batch_size}",
+            comment=f"OPT_{config.task}_{_model.__name__}{cnn_name}{rnn_name}{attn_name}_{config.train_optimizer}_LR_{lr}_BS_{batch_size}",
+        )
+    else:  # only the main process writes
+        writer = None
 
     msg = textwrap.dedent(f"""
         Starting training:
@@ -172,6 +192,7 @@ def train(model:nn.Module,
         Training size:   {n_train}
         Validation size: {n_val}
         Device:          {device.type}
+        Processes:       {world_size}
         Optimizer:       {config.train_optimizer}
         Dataset classes: {train_dataset.all_classes}
         ---------------------------------------------------
@@ -237,10 +258,57 @@ def train(model:nn.Module,
         criterion = MaskedBCEWithLogitsLoss()
     else:
         raise NotImplementedError(f"loss `{config.loss}` not implemented!")
+    if config.task == "multi_task":
+        # `criterion` for the af head (with the weight masks), and `BCEWithLogitsLoss` for the qrs head
+        assert config.loss == "MaskedBCEWithLogitsLoss", \
+            f"the af head of the multi-task model should be trained with `MaskedBCEWithLogitsLoss`, but got `{config.loss}`"
+        qrs_criterion = nn.BCEWithLogitsLoss()
+
+    # knowledge distillation from a frozen teacher, of the same model class as the (student) model,
+    # ref. `TrainCfg.distillation`
+    distill_config = config.get("distillation", None) or ED()
+    teacher, soft_target_cache, teacher_res = None, None, dict()
+    if distill_config.get("teacher", None):
+        assert config.task in ["qrs_detection", "main", "multi_task",], \
+            f"knowledge distillation is not implemented for task \042{config.task}\042"
+        teacher, teacher_config = type(_model).from_checkpoint(distill_config.teacher, device=device)
+        teacher = freeze_teacher(teacher, device)
+        assert teacher_config.get("task", config.task) == config.task, \
+            f"the teacher is trained for task \042{teacher_config.get('task')}\042, but the student for \042{config.task}\042"
+        if distill_config.get("cache_soft_targets", False) and not train_dataset.virtual_segments:
+            soft_target_key = get_soft_target_key(
+                distill_config.teacher, config.task, train_dataset.segments,
+                data_signature=train_dataset.get_segments_signature(),
+            )
+            soft_target_path = os.path.join(config.checkpoints, "soft_targets", f"{config.task}_{soft_target_key}.npy")
+            if is_main_process and SoftTargetCache.open(soft_target_path) is None:
+                compute_soft_targets(
+                    teacher, train_dataset, soft_target_path, batch_size=batch_size*4,
+                    collate_fn=collate_fn, num_workers=num_workers, verbose=1,
+                )
+            if distributed:
+                dist.barrier()
+            soft_target_cache = SoftTargetCache.open(soft_target_path)
+            train_dataset.soft_targets = soft_target_cache
+        # the teacher is evaluated once, to be compared with the student
+        teacher_res = evaluate(teacher, val_loader, config, device, debug, logger=logger)
+        teacher.eval()
+        if is_main_process:
+            teacher_res.update(measure_latency(
+                teacher, config.n_leads, config[config.task].input_len,
+                batch_size=distill_config.get("latency_batch_size", 1),
+                device=torch.device(distill_config.get("latency_device", "cpu")),
+            ))
+            msg = f"teacher loaded from {distill_config.teacher}, with\n{dict_to_str(teacher_res)}"
+            if logger:
+                logger.info(msg)
+            else:
+                print(msg)
     # scheduler = ReduceLROnPlateau(optimizer, mode="max", verbose=True, patience=6, min_lr=1e-7)
     # scheduler = CosineAnnealingWarmRestarts(optimizer, 0.001, 1e-6, 20)
 
-    save_prefix = f"{config.task}_{_model.__name__}{cnn_name}{rnn_name}{attn_name}_epoch"
+    student_name = f"_{distill_config.student}" if teacher is not None else ""
+    save_prefix = f"{config.task}_{_model.__name__}{cnn_name}{rnn_name}{attn_name}{student_name}_epoch"
 
     os.makedirs(config.checkpoints, exist_ok=True)
     os.makedirs(config.model_dir, exist_ok=True)
@@ -252,186 +320,418 @@ def train(model:nn.Module,
     best_epoch = -1
     pseudo_best_epoch = -1
 
-    saved_models = deque()
+    if is_main_process:  # only the main process saves checkpoints
+        ckpt_manager = CheckpointManager(
+            checkpoint_dir=config.checkpoints,
+            keep_checkpoint_max=config.keep_checkpoint_max,
+            policy=config.get("checkpoint_policy", "all"),
+            asynchronous=config.get("async_checkpoint", True),
+            logger=logger,
+        )
+    else:
+        ckpt_manager = None
     model.train()
     global_step = 0
+    # where to start, for resumed training
+    start_epoch, start_epoch_step, start_epoch_loss = 0, 0, 0
+    train_state = dict()
 
     batch_dim = 1 if config.task in ["rr_lstm"] else 0
 
-    for epoch in range(n_epochs):
-        # train one epoch
-        model.train()
-        epoch_loss = 0
-
-        with tqdm(total=n_train, desc=f"Epoch {epoch + 1}/{n_epochs}", ncols=100) as pbar:
-            for epoch_step, data in enumerate(train_loader):
-                global_step += 1
-                if config.task == "rr_lstm":
-                    signals, labels, weight_masks = data
-                    # (batch_size, seq_len, n_channel) -> (seq_len, batch_size, n_channel)
-                    signals = signals.permute(1,0,2)
-                    weight_masks = weight_masks.to(device=device, dtype=_DTYPE)
-                elif config.task == "qrs_detection":
-                    signals, labels = data
-                else:  # main task
-                    signals, labels, weight_masks = data
-                    weight_masks = weight_masks.to(device=device, dtype=_DTYPE)
-                signals = signals.to(device=device, dtype=_DTYPE)
-                labels = labels.to(device=device, dtype=_DTYPE)
-                    
-
-                preds = model(signals)
-                if config.loss == "MaskedBCEWithLogitsLoss":
-                    loss = criterion(preds, labels, weight_masks).to(_DTYPE)
-                else:
-                    loss = criterion(preds, labels).to(_DTYPE)
-                if config.flooding_level > 0:
-                    flood = (loss - config.flooding_level).abs() + config.flooding_level
-                    epoch_loss += loss.item()
-                    optimizer.zero_grad()
-                    flood.backward()
-                else:
-                    epoch_loss += loss.item()
-                    optimizer.zero_grad()
-                    loss.backward()
-                optimizer.step()
-
-                if global_step % config.log_step == 0:
-                    writer.add_scalar("train/loss", loss.item(), global_step)
-                    if scheduler:
-                        writer.add_scalar("lr", scheduler.get_lr()[0], global_step)
-                        pbar.set_postfix(**{
-                            "loss (batch)": loss.item(),
-                            "lr": scheduler.get_lr()[0],
-                        })
-                        msg = f"Train step_{global_step}: loss : {loss.item()}, lr : {scheduler.get_lr()[0] * batch_size}"
+    if config.task in ["qrs_detection", "main", "multi_task",] and config.get("batch_augmentation", False):
+        # different (random) augmentations in different processes
+        aug_seed = config.get("augmentation_seed", None)
+        batch_augmenter = BatchAugmenter(
+            config, task=config.task, seed=None if aug_seed is None else aug_seed + rank,
+        )
+        # the per-sample augmentations in `CPSC2021.__getitem__` are skipped
+        train_dataset.enable_batch_augmentation()
+    else:
+        batch_augmenter = None
+    # the training samples are extended windows, to be stretched or compressed online
+    online_stretch_compress = batch_augmenter is not None \
+        and train_dataset.online_stretch_compress and train_dataset.use_augmentation
+
+    if config.get("resume", None):
+        # checkpoints are loaded in all processes
+        ckpt = torch.load(config.resume, map_location=torch.device("cpu"))
+        ckpt_task = (ckpt.get("train_config", None) or ckpt.get("config", None) or ED()).get("task", config.task)
+        assert ckpt_task == config.task, \
+            f"the checkpoint {config.resume} is of task \042{ckpt_task}\042, but the current task is \042{config.task}\042"
+        _model.load_state_dict(ckpt["model_state_dict"])
+        if ckpt.get("optimizer_state_dict", None) is not None:
+            optimizer.load_state_dict(ckpt["optimizer_state_dict"])
+        if scheduler is not None and ckpt.get("scheduler_state_dict", None) is not None:
+            scheduler.load_state_dict(ckpt["scheduler_state_dict"])
+        start_epoch = ckpt.get("epoch", 0)
+        train_state = ckpt.get("train_state", dict())
+        if train_state:
+            start_epoch_step = train_state["epoch_step"]
+            start_epoch_loss = train_state["epoch_loss"]
+            global_step = train_state["global_step"]
+            sampler_seed = train_state["sampler_seed"]
+            best_metric = train_state["best_metric"]
+            best_eval_res = train_state["best_eval_res"]
+            best_epoch = train_state["best_epoch"]
+            pseudo_best_epoch = train_state["pseudo_best_epoch"]
+            best_state_dict = ckpt["best_model_state_dict"]
+        else:  # checkpoints of older versions, with only the states of the model and the optimizer
+            global_step = start_epoch * len(train_loader)
+        msg = f"training resumed from {config.resume}, at step {start_epoch_step} of epoch {start_epoch + 1}"
+        if logger:
+            logger.info(msg)
+        else:
+            print(msg)
+        del ckpt
+
+    # the generator of the batch augmenter is stored into the checkpoints only for non-distributed training
+    aug_generator = None if distributed or batch_augmenter is None else batch_augmenter.generator
+
+    def _make_checkpoint(n_finished_epochs:int,
+                         epoch_step:int,
+                         epoch_loss:float,
+                         n_finished_steps:int,
+                         epoch_rng_states:dict) -> dict:
+        """ checkpoint with the full states of training, from which training can be resumed
+        """
+        return {
+            "model_state_dict": _model.state_dict(),
+            "optimizer_state_dict": optimizer.state_dict(),
+            "scheduler_state_dict": scheduler.state_dict() if scheduler is not None else None,
+            "model_config": model_config,
+            "train_config": config,
+            "epoch": n_finished_epochs,
+            "best_model_state_dict": best_state_dict,
+            "train_state": {
+                "epoch_step": epoch_step,  # number of finished steps of the epoch `n_finished_epochs + 1`
+                "epoch_loss": epoch_loss,
+                "global_step": n_finished_steps,
+                "sampler_seed": sampler_seed,
+                "best_metric": best_metric,
+                "best_eval_res": best_eval_res,
+                "best_epoch": best_epoch,
+                "pseudo_best_epoch": pseudo_best_epoch,
+                # states at the beginning of the epoch, to replay the shuffling, virtual segments, etc.
+                "epoch_rng_states": epoch_rng_states,
+                "rng_states": get_rng_states(aug_generator),
+            },
+        }
+
+    # mid-epoch checkpoints (of the latest step), overwritten every `checkpoint_step` steps
+    latest_ckpt_path = os.path.join(config.checkpoints, f"{save_prefix}_latest.pth.tar")
+    # progress of training, for the checkpoint when interrupted
+    progress = None
+
+    # time of the phases of the training steps (data loading, forward, backward, etc.),
+    # and the optional profile of a window of steps, only in the main process
+    step_timer = StepTimer(device, enabled=config.get("step_timing", False) and is_main_process)
+    step_profiler = StepProfiler(
+        steps=config.get("profile_steps", None) if is_main_process else None,
+        trace_dir=os.path.join(config.log_dir, "profile"),
+        device=device,
+        logger=logger,
+    )
+
+    try:
+        for epoch in range(start_epoch, n_epochs):
+            # train one epoch
+            model.train()
+            resumed_epoch = epoch == start_epoch and train_state
+            epoch_loss = start_epoch_loss if resumed_epoch else 0
+            n_skipped_steps = start_epoch_step if resumed_epoch else 0
+            if resumed_epoch:
+                set_rng_states(train_state["epoch_rng_states"], aug_generator)
+            epoch_rng_states = get_rng_states(aug_generator)
+
+            if config.task in ["qrs_detection", "main", "multi_task",] and train_dataset.virtual_segments:
+                # re-randomize the virtual segments, nearly free of cost
+                if distributed:  # identically in all processes
+                    random.seed(config.dist_seed + epoch)
+                train_dataset.regenerate_virtual_segments()
+                n_train = len(train_dataset)
+                _sync_item_order(train_dataset)
+            # the samplers fix the length of the dataset, and the finished steps of a resumed epoch are skipped
+            train_loader = _get_train_loader(train_dataset, config, num_workers, sampler_seed, n_skipped_steps)
+            train_loader.sampler.set_epoch(epoch)
+            # starting the worker processes is also counted as data loading
+            step_timer.reset()
+            train_iter = iter(train_loader)
+            if resumed_epoch and n_skipped_steps > 0:
+                set_rng_states(train_state["rng_states"], aug_generator)
+            if resumed_epoch and distributed and batch_augmenter is not None and aug_seed is not None:
+                # the generators of different processes are NOT stored into the checkpoints
+                batch_augmenter.generator.manual_seed(aug_seed + rank + world_size * global_step)
+
+            n_per_process = (n_train + world_size - 1) // world_size
+            with tqdm(total=n_per_process, initial=min(n_per_process, n_skipped_steps * batch_size), desc=f"Epoch {epoch + 1}/{n_epochs}", ncols=100, disable=not is_main_process) as pbar:
+                for epoch_step, data in enumerate(train_iter, start=n_skipped_steps):
+                    global_step += 1
+                    step_timer.lap("data")
+                    if step_profiler.step(global_step):  # profiler started or stopped
+                        step_timer.lap("other")
+                    soft_targets = None
+                    if soft_target_cache is not None:  # cached logits of the teacher
+                        *data, soft_targets = data
+                    if config.task == "rr_lstm":
+                        signals, labels, weight_masks = data
+                        # (batch_size, seq_len, n_channel) -> (seq_len, batch_size, n_channel)
+                        signals = signals.permute(1,0,2)
+                        weight_masks = weight_masks.to(device=device, dtype=_DTYPE)
+                    elif online_stretch_compress:
+                        signals, labels, weight_masks = batch_augmenter.stretch_compress(
+                            *[item.to(device=device) for item in data]
+                        )
+                        if weight_masks is not None:
+                            weight_masks = weight_masks.to(dtype=_DTYPE)
+                    elif config.task == "qrs_detection":
+                        signals, labels = data
+                    else:  # main task, multi_task
+                        signals, labels, weight_masks = data
+                        weight_masks = weight_masks.to(device=device, dtype=_DTYPE)
+                    signals = signals.to(device=device, dtype=_DTYPE)
+                    labels = labels.to(device=device, dtype=_DTYPE)
+                    if batch_augmenter is not None:
+                        signals, labels = batch_augmenter(signals, labels)
+                    step_timer.lap("h2d")
+
+                    preds = model(signals)
+                    if config.task == "multi_task":
+                        # channel 0 for the qrs head, channel 1 for the af head
+                        loss = (
+                            config.multi_task.loss_weights.qrs_detection * qrs_criterion(preds[..., :1], labels[..., :1]) \
+                                + config.multi_task.loss_weights.main * criterion(preds[..., 1:], labels[..., 1:], weight_masks)
+                        ).to(_DTYPE)
+                    elif config.loss == "MaskedBCEWithLogitsLoss":
+                        loss = criterion(preds, labels, weight_masks).to(_DTYPE)
                     else:
-                        pbar.set_postfix(**{
-                            "loss (batch)": loss.item(),
-                        })
-                        msg = f"Train step_{global_step}: loss : {loss.item()}"
-                    # print(msg)  # in case no logger
+                        loss = criterion(preds, labels).to(_DTYPE)
+                    if teacher is not None:
+                        if soft_targets is not None:
+                            teacher_logits = soft_targets.to(device=device, dtype=_DTYPE)
+                        else:
+                            with torch.no_grad():
+                                teacher_logits = teacher(signals)
+                        if config.task == "main":
+                            distill_weight = weight_masks
+                        elif config.task == "multi_task":  # only the af head is weighted
+                            distill_weight = torch.cat([torch.ones_like(weight_masks), weight_masks], dim=-1)
+                        else:
+                            distill_weight = None
+                        loss = (1 - distill_config.alpha) * loss + distill_config.alpha * distillation_loss(
+                            preds, teacher_logits, distill_config.temperature, distill_weight,
+                        ).to(_DTYPE)
+                    step_timer.lap("forward")
                     if config.flooding_level > 0:
-                        writer.add_scalar("train/flood", flood.item(), global_step)
-                        msg = f"{msg}\nflood : {flood.item()}"
+                        flood = (loss - config.flooding_level).abs() + config.flooding_level
+                        epoch_loss += loss.item()
+                        optimizer.zero_grad()
+                        flood.backward()
+                    else:
+                        epoch_loss += loss.item()
+                        optimizer.zero_grad()
+                        loss.backward()
+                    step_timer.lap("backward")
+                    optimizer.step()
+                    step_timer.lap("optimizer")
+                    progress = (epoch, epoch_step + 1, epoch_loss, global_step, epoch_rng_states)
+
+                    if is_main_process and config.get("checkpoint_step", 0) > 0 \
+                            and global_step % config.checkpoint_step == 0:
+                        ckpt_manager.write(_make_checkpoint(*progress), latest_ckpt_path)
+                    step_timer.end_step(signals.shape[batch_dim])
+
+                    if global_step % config.log_step == 0 and is_main_process:
+                        writer.add_scalar("train/loss", loss.item(), global_step)
+                        if scheduler:
+                            writer.add_scalar("lr", scheduler.get_lr()[0], global_step)
+                            pbar.set_postfix(**{
+                                "loss (batch)": loss.item(),
+                                "lr": scheduler.get_lr()[0],
+                            })
+                            msg = f"Train step_{global_step}: loss : {loss.item()}, lr : {scheduler.get_lr()[0] * batch_size}"
+                        else:
+                            pbar.set_postfix(**{
+                                "loss (batch)": loss.item(),
+                            })
+                            msg = f"Train step_{global_step}: loss : {loss.item()}"
+                        # print(msg)  # in case no logger
+                        if config.flooding_level > 0:
+                            writer.add_scalar("train/flood", flood.item(), global_step)
+                            msg = f"{msg}\nflood : {flood.item()}"
+                        timing = step_timer.window_summary()
+                        for k, v in timing.items():
+                            writer.add_scalar(f"train/{k}", v, global_step)
+                        if timing:
+                            msg = f"{msg}\n{_timing_to_str(timing)}"
+                        if logger:
+                            logger.info(msg)
+                        else:
+                            print(msg)
+                    pbar.update(signals.shape[batch_dim])
+                    step_timer.lap("other")
+
+                epoch_timing = step_timer.epoch_summary()
+                if is_main_process and epoch_timing:
+                    for k, v in epoch_timing.items():
+                        writer.add_scalar(f"train/epoch_{k}", v, global_step)
+                    msg = f"Train epoch_{epoch + 1} timing:\n{_timing_to_str(epoch_timing)}"
                     if logger:
                         logger.info(msg)
                     else:
                         print(msg)
-                pbar.update(signals.shape[batch_dim])
-
-            writer.add_scalar("train/epoch_loss", epoch_loss, global_step)
-
-            # eval for each epoch using `evaluate`
-            if debug:
-                eval_train_res = evaluate(model, val_train_loader, config, device, debug, logger=logger)
-                for k,v in eval_train_res.items():
-                    writer.add_scalar(f"train/task_metric_{k}", v, global_step)
 
-            eval_res = evaluate(model, val_loader, config, device, debug, logger=logger)
-            model.train()
-            for k,v in eval_res.items():
-                writer.add_scalar(f"test/task_metric_{k}", v, global_step)
-
-            if config.lr_scheduler is None:
-                pass
-            elif config.lr_scheduler.lower() == "plateau":
-                scheduler.step(metrics=eval_res)
-            elif config.lr_scheduler.lower() == "step":
-                scheduler.step()
-            elif config.lr_scheduler.lower() in ["one_cycle", "onecycle",]:
-                scheduler.step()
-
-            if debug:
-                eval_train_msg = ""
-                for k,v in eval_train_res.items():
-                    eval_train_msg += f"""
-                    train/task_metric_{k}:       {v}
-                    """
-            else:
-                eval_train_msg = ""
-            for k,v in eval_res.items():
-                msg = textwrap.dedent(f"""
-                    Train epoch_{epoch + 1}:
-                    --------------------
-                    train/epoch_loss:        {epoch_loss}{eval_train_msg}
-                    test/task_metric_{k}:    {v}
-                    ---------------------------------
-                    """)
-            if logger:
-                logger.info(msg)
-            else:
-                print(msg)
-
-            if eval_res[config.monitor] > best_metric:
-                best_metric = eval_res[config.monitor]
-                best_state_dict = _model.state_dict()
-                best_eval_res = deepcopy(eval_res)
-                best_epoch = epoch + 1
-                pseudo_best_epoch = epoch + 1
-            elif config.early_stopping:
-                if eval_res[config.monitor] >= best_metric - config.early_stopping.min_delta:
+                if is_main_process:
+                    writer.add_scalar("train/epoch_loss", epoch_loss, global_step)
+
+                # eval for each epoch using `evaluate`,
+                # results are aggregated over all processes, hence the same in all processes
+                if debug:
+                    eval_train_res = evaluate(model, val_train_loader, config, device, debug, logger=logger)
+                    if is_main_process:
+                        for k,v in eval_train_res.items():
+                            writer.add_scalar(f"train/task_metric_{k}", v, global_step)
+
+                eval_res = evaluate(model, val_loader, config, device, debug, logger=logger)
+                model.train()
+                if is_main_process:
+                    for k,v in eval_res.items():
+                        writer.add_scalar(f"test/task_metric_{k}", v, global_step)
+
+                if config.lr_scheduler is None:
+                    pass
+                elif config.lr_scheduler.lower() == "plateau":
+                    scheduler.step(metrics=eval_res)
+                elif config.lr_scheduler.lower() == "step":
+                    scheduler.step()
+                elif config.lr_scheduler.lower() in ["one_cycle", "onecycle",]:
+                    scheduler.step()
+
+                if debug:
+                    eval_train_msg = ""
+                    for k,v in eval_train_res.items():
+                        eval_train_msg += f"""
+                        train/task_metric_{k}:       {v}
+                        """
+                else:
+                    eval_train_msg = ""
+                for k,v in eval_res.items():
+                    msg = textwrap.dedent(f"""
+                        Train epoch_{epoch + 1}:
+                        --------------------
+                        train/epoch_loss:        {epoch_loss}{eval_train_msg}
+                        test/task_metric_{k}:    {v}
+                        ---------------------------------
+                        """)
+                if logger:
+                    logger.info(msg)
+                else:
+                    print(msg)
+
+                if eval_res[config.monitor] > best_metric:
+                    best_metric = eval_res[config.monitor]
+                    # snapshot, otherwise the tensors are updated by the subsequent training steps
+                    best_state_dict = snapshot_state(_model.state_dict())
+                    best_eval_res = deepcopy(eval_res)
+                    best_epoch = epoch + 1
                     pseudo_best_epoch = epoch + 1
-                elif epoch - pseudo_best_epoch >= config.early_stopping.patience:
-                    msg = f"early stopping is triggered at epoch {epoch + 1}"
+                elif config.early_stopping:
+                    if eval_res[config.monitor] >= best_metric - config.early_stopping.min_delta:
+                        pseudo_best_epoch = epoch + 1
+                    elif epoch - pseudo_best_epoch >= config.early_stopping.patience:
+                        msg = f"early stopping is triggered at epoch {epoch + 1}"
+                        if logger:
+                            logger.info(msg)
+                        else:
+                            print(msg)
+                        break
+                msg = textwrap.dedent(f"""
+                    best metric = {best_metric},
+                    obtained at epoch {best_epoch}
+                """)
+                if logger:
+                    logger.info(msg)
+                else:
+                    print(msg)
+
+                progress = (epoch + 1, 0, 0, global_step, get_rng_states(aug_generator))
+                if is_main_process:  # only the main process saves checkpoints
+                    save_suffix = f"epochloss_{epoch_loss:.5f}_metric_{eval_res[config.monitor]:.2f}"
+                    save_filename = f"{save_prefix}{epoch + 1}_{get_date_str()}_{save_suffix}.pth.tar"
+                    # snapshotted into CPU memory here, written to disk in the background
+                    ckpt_manager.save(
+                        _make_checkpoint(*progress),
+                        save_filename,
+                        is_best=best_epoch == epoch + 1,
+                        msg=f"Checkpoint {epoch + 1} saved!",
+                    )
+                    if config.get("checkpoint_step", 0) > 0:
+                        ckpt_manager.write(_make_checkpoint(*progress), latest_ckpt_path)
+
+                # called after the checkpoint of this epoch is saved
+                if epoch_callback is not None and epoch_callback(epoch + 1, eval_res):
+                    msg = f"training is stopped by the epoch callback at epoch {epoch + 1}"
                     if logger:
                         logger.info(msg)
                     else:
                         print(msg)
                     break
-
-            msg = textwrap.dedent(f"""
-                best metric = {best_metric},
-                obtained at epoch {best_epoch}
-            """)
-            if logger:
-                logger.info(msg)
-            else:
-                print(msg)
-
-            try:
-                os.makedirs(config.checkpoints, exist_ok=True)
-            except OSError:
-                pass
-            save_suffix = f"epochloss_{epoch_loss:.5f}_metric_{eval_res[config.monitor]:.2f}"
-            save_filename = f"{save_prefix}{epoch + 1}_{get_date_str()}_{save_suffix}.pth.tar"
-            save_path = os.path.join(config.checkpoints, save_filename)
-            torch.save({
-                "model_state_dict": _model.state_dict(),
-                "optimizer_state_dict": optimizer.state_dict(),
-                "model_config": model_config,
-                "train_config": config,
-                "epoch": epoch+1,
-            }, save_path)
-            if logger:
-                logger.info(f"Checkpoint {epoch + 1} saved!")
-            saved_models.append(save_path)
-            # remove outdated models
-            if len(saved_models) > config.keep_checkpoint_max > 0:
-                model_to_remove = saved_models.popleft()
-                try:
-                    os.remove(model_to_remove)
-                except:
-                    logger.info(f"failed to remove {model_to_remove}")
+        step_profiler.close()
+    except KeyboardInterrupt:
+        # also raised by SIGTERM (e.g. preemption), ref. `__main__`
+        step_profiler.close()
+        if is_main_process and progress is not None:
+            save_path = os.path.join(config.checkpoints, "INTERRUPTED.pth.tar")
+            ckpt_manager.write(_make_checkpoint(*progress), save_path, msg=f"Interrupted, states saved to {save_path}")
+        if is_main_process:
+            ckpt_manager.close()
+        raise
 
     # save the best model
-    if best_metric > -np.inf:
+    if best_metric > -np.inf and is_main_process:
         if config.final_model_name:
             save_filename = config.final_model_name
         else:
             save_suffix = f"metric_{best_eval_res[config.monitor]:.2f}"
             save_filename = f"BestModel_{save_prefix}{best_epoch}_{get_date_str()}_{save_suffix}.pth.tar"
         save_path = os.path.join(config.model_dir, save_filename)
-        torch.save({
-            "model_state_dict": best_state_dict,
-            "model_config": model_config,
-            "train_config": config,
-            "epoch": best_epoch,
-        }, save_path)
+        ckpt_manager.write(
+            {
+                "model_state_dict": best_state_dict,
+                "model_config": model_config,
+                "train_config": config,
+                "epoch": best_epoch,
+            },
+            save_path,
+            msg=f"Best model saved to {save_path}!",
+        )
+
+    if teacher is not None and best_metric > -np.inf and is_main_process:
+        # the teacher and the (best) student side by side
+        student = deepcopy(_model)
+        student.load_state_dict(best_state_dict)
+        student_res = deepcopy(best_eval_res)
+        student_res.update(measure_latency(
+            student, config.n_leads, config[config.task].input_len,
+            batch_size=distill_config.get("latency_batch_size", 1),
+            device=torch.device(distill_config.get("latency_device", "cpu")),
+        ))
+        student_res["speedup"] = teacher_res["latency_ms"] / student_res["latency_ms"]
+        del student
+        for k, v in student_res.items():
+            writer.add_scalar(f"distillation/student_{k}", v, global_step)
+            if k in teacher_res:
+                writer.add_scalar(f"distillation/teacher_{k}", teacher_res[k], global_step)
+        msg = f"teacher vs. student ({distill_config.student}):\n" \
+            + comparison_to_str({"teacher": teacher_res, "student": student_res})
         if logger:
-            logger.info(f"Best model saved to {save_path}!")
+            logger.info(msg)
+        else:
+            print(msg)
 
-    writer.close()
+    if is_main_process:
+        # wait for the checkpoints to be written
+        ckpt_manager.close()
+        writer.close()
 
     if logger:
         for h in logger.handlers:
@@ -477,14 +777,14 @@ def evaluate(model:nn.Module,
     prev_aug_status = data_loader.dataset.use_augmentation
     data_loader.dataset.disable_data_augmentation()
 
-    if type(model).__name__ in ["DataParallel",]:  # TODO: further consider "DistributedDataParallel"
+    if type(model).__name__ in ["DataParallel", "DistributedDataParallel",]:
         _model = model.module
     else:
         _model = model
 
+    # the metrics are accumulated batch by batch
     if config.task == "qrs_detection":
-        all_rpeak_preds = []
-        all_rpeak_labels = []
+        accumulator = RPeakMetricAccumulator(fs=config.fs, thr=config.qrs_mask_bias/config.fs)
         for signals, labels in data_loader:
             signals = signals.to(device=device, dtype=_DTYPE)
             labels = labels.numpy()
@@ -497,63 +797,82 @@ def evaluate(model:nn.Module,
                 item[np.where((item>=config.rpeaks_dist2border) & (item<config.qrs_detection.input_len-config.rpeaks_dist2border))[0]] \
                     for item in labels
             ]
-            all_rpeak_labels += labels
 
             if torch.cuda.is_available():
                 torch.cuda.synchronize()
             prob, rpeak_preds = _model.inference(signals)
-            all_rpeak_preds += rpeak_preds
+            accumulator.update(labels, rpeak_preds)
         if debug:
             pass  # TODO: add log
-        eval_res = compute_rpeak_metric(
-            rpeaks_truths=all_rpeak_labels,
-            rpeaks_preds=all_rpeak_preds,
-            fs=config.fs,
-            thr=config.qrs_mask_bias/config.fs,
-        )
-        # eval_res = {"qrs_score": eval_res}  # to dict
     elif config.task == "rr_lstm":
-        all_preds = np.array([]).reshape((0, config[config.task].input_len))
-        all_labels = np.array([]).reshape((0, config[config.task].input_len))
-        all_weight_masks = np.array([]).reshape((0, config[config.task].input_len))
+        accumulator = RRMetricAccumulator(
+            n_samples=len(data_loader.dataset), seq_len=config[config.task].input_len,
+        )
         for signals, labels, weight_masks in data_loader:
             signals = signals.to(device=device, dtype=_DTYPE)
             labels = labels.numpy().squeeze(-1)  # (batch_size, seq_len, 1) -> (batch_size, seq_len)
             weight_masks = weight_masks.numpy().squeeze(-1)  # (batch_size, seq_len, 1) -> (batch_size, seq_len)
-            all_labels = np.concatenate((all_labels, labels))
-            all_weight_masks = np.concatenate((all_weight_masks, weight_masks))
             if torch.cuda.is_available():
                 torch.cuda.synchronize()
             preds, _ = _model.inference(signals)
-            all_preds = np.concatenate((all_preds, preds))
+            accumulator.update(labels, preds, weight_masks)
         if debug:
             pass  # TODO: add log
-        eval_res = compute_rr_metric(all_labels, all_preds, all_weight_masks)
-        # eval_res = {"rr_score": eval_res}  # to dict
     elif config.task == "main":
-        all_preds = np.array([]).reshape((0, config.main.input_len//config.main.reduction))
-        all_labels = np.array([]).reshape((0, config.main.input_len//config.main.reduction))
-        all_weight_masks = np.array([]).reshape((0, config.main.input_len//config.main.reduction))
+        accumulator = MainTaskMetricAccumulator(
+            n_samples=len(data_loader.dataset),
+            seq_len=config.main.input_len//config.main.reduction,
+            fs=config.fs,
+            reduction=config.main.reduction,
+        )
         for signals, labels, weight_masks in data_loader:
             signals = signals.to(device=device, dtype=_DTYPE)
             labels = labels.numpy().squeeze(-1)  # (batch_size, seq_len, 1) -> (batch_size, seq_len)
             weight_masks = weight_masks.numpy().squeeze(-1)  # (batch_size, seq_len, 1) -> (batch_size, seq_len)
-            all_labels = np.concatenate((all_labels, labels))
-            all_weight_masks = np.concatenate((all_weight_masks, weight_masks))
             if torch.cuda.is_available():
                 torch.cuda.synchronize()
             preds, _ = _model.inference(signals)
-            all_preds = np.concatenate((all_preds, preds))
+            accumulator.update(labels, preds, weight_masks)
         if debug:
             pass  # TODO: add log
-        eval_res = compute_main_task_metric(
-            mask_truths=all_labels,
-            mask_preds=all_preds,
-            fs=config.fs,
-            reduction=config.main.reduction,
-            weight_masks=all_weight_masks,
+    elif config.task == "multi_task":
+        # metrics of the two heads, the same as those of the tasks "qrs_detection" and "main"
+        accumulator = _MultiTaskMetricAccumulator(
+            RPeakMetricAccumulator(fs=config.fs, thr=config.qrs_mask_bias/config.fs),
+            MainTaskMetricAccumulator(
+                n_samples=len(data_loader.dataset),
+                seq_len=config.multi_task.input_len//config.multi_task.reduction,
+                fs=config.fs,
+                reduction=config.multi_task.reduction,
+            ),
         )
-        # eval_res = {"main_score": eval_res}  # to dict
+        for signals, labels, weight_masks in data_loader:
+            signals = signals.to(device=device, dtype=_DTYPE)
+            labels = labels.numpy()
+            weight_masks = weight_masks.numpy().squeeze(-1)  # (batch_size, seq_len, 1) -> (batch_size, seq_len)
+            rpeak_labels = [mask_to_intervals(item, 1) for item in labels[..., 0]]  # intervals of qrs complexes
+            rpeak_labels = [ # to indices of rpeaks in the original signal sequence
+                (config.multi_task.reduction * np.array([itv[0]+itv[1] for itv in item]) / 2).astype(int) \
+                    for item in rpeak_labels
+            ]
+            rpeak_labels = [
+                item[np.where((item>=config.rpeaks_dist2border) & (item<config.multi_task.input_len-config.rpeaks_dist2border))[0]] \
+                    for item in rpeak_labels
+            ]
+            if torch.cuda.is_available():
+                torch.cuda.synchronize()
+            preds, rpeak_preds, _ = _model.inference(signals)
+            accumulator.rpeak.update(rpeak_labels, rpeak_preds)
+            accumulator.main.update(labels[..., 1], preds[..., 1], weight_masks)
+        if debug:
+            pass  # TODO: add log
+
+    # aggregate over all processes of distributed training
+    all_accumulators = _all_gather_object(accumulator)
+    accumulator = all_accumulators[0]
+    for other in all_accumulators[1:]:
+        accumulator.merge(other)
+    eval_res = accumulator.compute()
 
     model.train()
     if prev_aug_status:
@@ -562,6 +881,271 @@ def evaluate(model:nn.Module,
     return eval_res
 
 
+class _MultiTaskMetricAccumulator(object):
+    """ finished, NOT checked,
+
+    accumulators of the metrics of the two heads of the multi-task model,
+    with the same interface (`merge`, `compute`) as each of them
+    """
+
+    def __init__(self, rpeak:RPeakMetricAccumulator, main:MainTaskMetricAccumulator) -> NoReturn:
+        """
+        """
+        self.rpeak = rpeak
+        self.main = main
+
+    def merge(self, other:"_MultiTaskMetricAccumulator") -> NoReturn:
+        """
+        """
+        self.rpeak.merge(other.rpeak)
+        self.main.merge(other.main)
+
+    def compute(self) -> Dict[str, float]:
+        """
+        """
+        return {**self.rpeak.compute(), **self.main.compute()}
+
+
+def _timing_to_str(timing:Dict[str, float]) -> str:
+    """ finished, NOT checked,
+
+    Parameters
+    ----------
+    timing: dict,
+        summary of the time of the phases of the training steps, ref. `StepTimer.window_summary`
+
+    Returns
+    -------
+    str, the summary in one line
+    """
+    items = []
+    for k, v in timing.items():
+        if k.startswith("time_"):
+            items.append(f"{k[5:]} : {v:.1f} ms")
+        elif k == "data_wait_ratio":
+            items.append(f"data wait : {100 * v:.1f}%")
+        else:  # samples_per_sec
+            items.append(f"{v:.1f} samples/s")
+    return ", ".join(items)
+
+
+def _get_train_loader(train_dataset:CPSC2021,
+                      config:dict,
+                      num_workers:int,
+                      seed:int,
+                      n_skipped_steps:int=0) -> DataLoader:
+    """ finished, NOT checked,
+
+    Parameters
+    ----------
+    train_dataset: CPSC2021,
+        the training dataset
+    config: dict,
+        training configurations
+    num_workers: int,
+        number of worker processes of the data loader
+    seed: int,
+        seed of the (per-epoch) permutations of the items,
+        the permutations are determined by `seed` and the epoch (set via `set_epoch` of the sampler),
+        so that an epoch can be replayed when training is resumed
+    n_skipped_steps: int, default 0,
+        number of (finished) steps at the beginning of the epoch to skip,
+        for training resumed from mid-epoch checkpoints
+
+    Returns
+    -------
+    train_loader: DataLoader,
+        the data loader (of the shard of the current process for distributed training)
+    """
+    world_size, rank = _get_world_size(), _get_rank()
+    if config.task in ["rr_lstm",] and train_dataset.rr_seq_packed:
+        # each batch is one read of the packed (memory-mapped) array,
+        # hence no worker processes nor collating are needed
+        sampler = RRSeqBatchSampler(
+            len(train_dataset), config.batch_size, shuffle=True,
+            num_replicas=world_size, rank=rank, seed=seed,
+        )
+        return DataLoader(
+            dataset=train_dataset,
+            sampler=_SkipSampler(sampler, n_skipped_steps) if n_skipped_steps > 0 else sampler,
+            batch_size=None,
+            num_workers=0,
+            pin_memory=True,
+        )
+    # also for non-distributed training (`num_replicas` = 1), for the reproducible permutations
+    sampler = DistributedSampler(
+        train_dataset, num_replicas=world_size, rank=rank, shuffle=True, seed=seed,
+    )
+    return DataLoader(
+        dataset=train_dataset,
+        batch_size=config.batch_size,
+        shuffle=False,
+        sampler=_SkipSampler(sampler, n_skipped_steps * config.batch_size) if n_skipped_steps > 0 else sampler,
+        num_workers=num_workers,
+        pin_memory=True,
+        drop_last=False,
+        collate_fn=collate_fn,
+    )
+
+
+class _SkipSampler(Sampler):
+    """ finished, NOT checked,
+
+    sampler skipping the first `n_skipped` items (indices, or batches of indices) of another sampler,
+    without loading the skipped samples
+    """
+
+    def __init__(self, sampler:Sampler, n_skipped:int) -> NoReturn:
+        """
+
+        Parameters
+        ----------
+        sampler: Sampler,
+            the sampler, typically with `set_epoch`
+        n_skipped: int,
+            number of items to skip
+        """
+        self.sampler = sampler
+        self.n_skipped = n_skipped
+
+    def set_epoch(self, epoch:int) -> NoReturn:
+        """
+        """
+        self.sampler.set_epoch(epoch)
+
+    def __iter__(self):
+        """
+        """
+        return islice(iter(self.sampler), self.n_skipped, None)
+
+    def __len__(self) -> int:
+        """
+        """
+        return max(0, len(self.sampler) - self.n_skipped)
+
+
+def _get_eval_loader(eval_dataset:CPSC2021, config:dict, num_workers:int) -> DataLoader:
+    """ finished, NOT checked,
+
+    Parameters
+    ----------
+    eval_dataset: CPSC2021,
+        the dataset for evaluation
+    config: dict,
+        training configurations
+    num_workers: int,
+        number of worker processes of the data loader
+
+    Returns
+    -------
+    eval_loader: DataLoader,
+        the data loader (of the shard of the current process for distributed training),
+        the shards are NOT padded, so that no sample is evaluated twice
+    """
+    world_size, rank = _get_world_size(), _get_rank()
+    if config.task in ["rr_lstm",] and eval_dataset.rr_seq_packed:
+        return DataLoader(
+            dataset=eval_dataset,
+            sampler=RRSeqBatchSampler(
+                len(eval_dataset), config.batch_size*4, shuffle=False,
+                num_replicas=world_size, rank=rank,
+            ),
+            batch_size=None,
+            num_workers=0,
+            pin_memory=True,
+        )
+    return DataLoader(
+        dataset=eval_dataset,
+        batch_size=config.batch_size*4,
+        shuffle=world_size == 1,
+        sampler=range(rank, len(eval_dataset), world_size) if world_size > 1 else None,
+        num_workers=num_workers,
+        pin_memory=True,
+        drop_last=False,
+        collate_fn=collate_fn,
+    )
+
+
+def _init_distributed(config:dict) -> bool:
+    """ finished, NOT checked,
+
+    initialize the process group if launched via `torchrun` (or `torch.distributed.launch`),
+    which sets the environment variables `WORLD_SIZE`, `RANK`, `MASTER_ADDR`, etc.
+
+    Parameters
+    ----------
+    config: dict,
+        training configurations, with `dist_backend`
+
+    Returns
+    -------
+    bool, whether the training is distributed
+    """
+    if int(os.environ.get("WORLD_SIZE", 1)) <= 1 or not dist.is_available():
+        return False
+    if not dist.is_initialized():
+        dist.init_process_group(backend=config.dist_backend)
+    return True
+
+
+def _sync_item_order(dataset:CPSC2021) -> NoReturn:
+    """ finished, NOT checked,
+
+    make the ordering of the items (segments, rr sequences) of the dataset,
+    which are shuffled in `CPSC2021.__init__`, the same in all processes of distributed training
+    (and in resumed training), so that the indices drawn by the samplers refer to the same items,
+    shuffling is then done by the samplers
+
+    Parameters
+    ----------
+    dataset: CPSC2021,
+        the dataset
+    """
+    if dataset.task in ["qrs_detection", "main", "multi_task",]:
+        dataset.segments.sort()
+    elif not dataset.rr_seq_packed:  # the packed ones are already in a fixed ordering
+        dataset.rr_seq.sort()
+
+
+def _get_world_size() -> int:
+    """
+    """
+    if dist.is_available() and dist.is_initialized():
+        return dist.get_world_size()
+    return 1
+
+
+def _get_rank() -> int:
+    """
+    """
+    if dist.is_available() and dist.is_initialized():
+        return dist.get_rank()
+    return 0
+
+
+def _all_gather_object(obj:Any) -> list:
+    """ finished, NOT checked,
+
+    gather (picklable) objects from all processes of distributed training
+
+    Parameters
+    ----------
+    obj: any,
+        the object of the current process
+
+    Returns
+    -------
+    list, of the objects from all processes (ordered by rank),
+    or of the only object if the training is not distributed
+    """
+    world_size = _get_world_size()
+    if world_size == 1:
+        return [obj]
+    gathered = [None for _ in range(world_size)]
+    dist.all_gather_object(gathered, obj)
+    return gathered
+
+
 def get_args(**kwargs:Any):
     """ NOT checked,
     """
@@ -589,6 +1173,11 @@ def get_args(**kwargs:Any):
     #     type=str, default="se",
     #     help="choice of attention structures",
     #     dest="attn_name")
+    parser.add_argument(
+        "--tasks", type=str, nargs="+", default=["qrs_detection", "rr_lstm", "main",],
+        choices=cfg.get("tasks", TrainCfg.tasks),
+        help="tasks to train, in order",
+        dest="tasks")
     parser.add_argument(
         "--keep-checkpoint-max", type=int, default=20,
         help="maximum number of checkpoints to keep. If set 0, all checkpoints will be kept",
@@ -597,6 +1186,22 @@ def get_args(**kwargs:Any):
     #     "--optimizer", type=str, default="adam",
     #     help="training optimizer",
     #     dest="train_optimizer")
+    parser.add_argument(
+        "--resume", type=str, default=None,
+        help="path of the checkpoint to resume training from",
+        dest="resume")
+    parser.add_argument(
+        "--checkpoint-step", type=int, default=0,
+        help="number of steps between mid-epoch checkpoints (of the latest step). If set 0, no mid-epoch checkpoint is saved",
+        dest="checkpoint_step")
+    parser.add_argument(
+        "--teacher", type=str, default=None,
+        help="path of the checkpoint of the teacher, to train a compact student via knowledge distillation",
+        dest="teacher")
+    parser.add_argument(
+        "--student", type=str, default=cfg.get("distillation", TrainCfg.distillation).student,
+        help="config of the student, e.g. seq_lab_small, seq_lab_tiny",
+        dest="student")
     parser.add_argument(
         "--debug", type=str2bool, default=False,
         help="train with more debugging information",
@@ -604,6 +1209,9 @@ def get_args(**kwargs:Any):
     
     args = vars(parser.parse_args())
 
+    cfg["distillation"] = deepcopy(cfg.get("distillation", TrainCfg.distillation))
+    cfg["distillation"]["teacher"] = args.pop("teacher") or cfg["distillation"].get("teacher", None)
+    cfg["distillation"]["student"] = args.pop("student")
     cfg.update(args)
     
     return ED(cfg)
@@ -616,6 +1224,42 @@ _MODEL_MAP = {
     "lstm": RR_LSTM_CPSC2021,
 }
 
+# models of the task "multi_task", with one shared backbone for the tasks "qrs_detection" and "main"
+_MULTI_TASK_MODEL_MAP = {
+    "seq_lab": ECG_SEQ_LAB_NET_MULTI_TASK_CPSC2021,
+}
+
+
+def _get_model(task:str, config:ED) -> Tuple[nn.Module, ED]:
+    """ finished, NOT checked,
+
+    Parameters
+    ----------
+    task: str,
+        the task, one of `TrainCfg.tasks`
+    config: dict,
+        training configurations
+
+    Returns
+    -------
+    model: Module,
+        the model of the task (NOT wrapped by `DataParallel`, etc.)
+    model_config: dict,
+        config of the model
+    """
+    if task == "multi_task":
+        model_cls = _MULTI_TASK_MODEL_MAP[config[task].model_name]
+    else:
+        model_cls = _MODEL_MAP[config[task].model_name]
+    model_cls.__DEBUG__ = False
+    model_config = deepcopy(ModelCfg[task])
+    if config.get("distillation", ED()).get("teacher", None):
+        # the compact config of the student in place of that of the teacher,
+        # so that the student is loaded via `from_checkpoint` the same way
+        model_config[model_config.model_name] = deepcopy(model_config[config.distillation.student])
+    model = model_cls(config=model_config)
+    return model, model_config
+
 
 def _set_task(task:str, config:ED) -> NoReturn:
     """ finished, checked,
@@ -632,23 +1276,49 @@ if __name__ == "__main__":
     # WARNING: most training were done in notebook,
     # NOT in cli
     config = get_args(**TrainCfg)
-    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-    logger = init_logger(log_dir=config.log_dir, verbose=2)
+    # launched via `torchrun` for distributed training, e.g.
+    # torchrun --nproc_per_node=8 trainer.py
+    distributed = _init_distributed(config)
+    if distributed and torch.cuda.is_available():
+        device = torch.device(f"cuda:{int(os.environ.get('LOCAL_RANK', 0))}")
+    else:
+        device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    if distributed and device.type == "cpu":
+        # `torchrun` sets `OMP_NUM_THREADS` to 1, the cores are shared by the local processes instead
+        torch.set_num_threads(max(1, os.cpu_count() // int(os.environ.get("LOCAL_WORLD_SIZE", 1))))
+    # preemption (SIGTERM) is handled as KeyboardInterrupt, so that the states of training are saved
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    if _get_rank() == 0:
+        logger = init_logger(log_dir=config.log_dir, verbose=2)
+    else:  # only the main process logs
+        logger = logging.getLogger(f"CPSC2021-rank{_get_rank()}")
+        logger.addHandler(logging.NullHandler())
     logger.info(f"\n{'*'*20}   Start Training   {'*'*20}\n")
     logger.info(f"Using device {device}")
     logger.info(f"Using torch of version {torch.__version__}")
     logger.info(f"with configuration\n{dict_to_str(config)}")
 
+    if config.distillation.teacher:
+        assert len(config.tasks) == 1, "the teacher is of one task, hence only one task can be trained via distillation"
+    tasks = list(config.tasks)
+    if config.resume:
+        # the checkpoint is of one task, which is resumed, followed by the tasks after it,
+        # the tasks before it are considered finished
+        resume_ckpt = torch.load(config.resume, map_location=torch.device("cpu"))
+        resume_task = (resume_ckpt.get("train_config", None) or resume_ckpt["config"]).task
+        del resume_ckpt
+        assert resume_task in tasks, \
+            f"the checkpoint to resume from is of task \042{resume_task}\042, which is not in {tasks}"
+        tasks = tasks[tasks.index(resume_task):]
     # TODO: adjust for CPSC2021
-    for task in config.tasks:
-        model_cls = _MODEL_MAP[config[task].model_name]
-        model_cls.__DEBUG__ = False
+    for task in tasks:
         _set_task(task, config)
-        model_config = deepcopy(ModelCfg[task])
-        model = model_cls(config=model_config)
-        if torch.cuda.device_count() > 1 or task not in ["rr_lstm",]:
+        model, model_config = _get_model(task, config)
+        if distributed:
+            model.to(device=device)
+            model = DDP(model, device_ids=[device.index] if device.type == "cuda" else None)
+        elif torch.cuda.device_count() > 1 or task not in ["rr_lstm",]:
             model = DP(model)
-            # model = DDP(model)
         model.to(device=device)
 
         try:
@@ -661,13 +1331,16 @@ if __name__ == "__main__":
                 debug=config.debug,
             )
         except KeyboardInterrupt:
-            torch.save({
-                "model_state_dict": model.state_dict(),
-                "model_config": model_config,
-                "train_config": config,
-            }, os.path.join(config.checkpoints, "INTERRUPTED.pth.tar"))
+            # the full states of training are saved in `train`, to be resumed via `--resume`
+            if _get_rank() != 0:
+                os._exit(0)
             logger.info("Saved interrupt")
             try:
                 sys.exit(0)
             except SystemExit:
                 os._exit(0)
+        # only the first task is resumed
+        config.resume = None
+
+    if distributed:
+        dist.destroy_process_group()
@@ -6,8 +6,7 @@ References
 [1] http://2019.icbeb.org/Challenge.html
 """
 import math
-import multiprocessing as mp
-from typing import Union, Optional, Sequence, Dict
+from typing import Union, Optional, Sequence, Dict, List, Tuple, NoReturn
 from numbers import Real
 
 import numpy as np
@@ -15,13 +14,14 @@ import torch
 
 from torch_ecg.torch_ecg.models.loss import MaskedBCEWithLogitsLoss
 
-from .misc import mask_to_intervals
-
 
 __all__ = [
     "compute_rpeak_metric",
     "compute_rr_metric",
     "compute_main_task_metric",
+    "RPeakMetricAccumulator",
+    "RRMetricAccumulator",
+    "MainTaskMetricAccumulator",
 ]
 
 
@@ -54,47 +54,11 @@ def compute_rpeak_metric(rpeaks_truths:Sequence[Union[np.ndarray,Sequence[int]]]
     rec_acc: float,
         accuracy of predictions
     """
-    assert len(rpeaks_truths) == len(rpeaks_preds), \
-        f"number of records does not match, truth indicates {len(rpeaks_truths)}, while pred indicates {len(rpeaks_preds)}"
     n_records = len(rpeaks_truths)
-    record_flags = np.ones((len(rpeaks_truths),), dtype=float)
-    thr_ = thr * fs
     if verbose >= 1:
         print(f"number of records = {n_records}")
-        print(f"threshold in number of sample points = {thr_}")
-    for idx, (truth_arr, pred_arr) in enumerate(zip(rpeaks_truths, rpeaks_preds)):
-        false_negative = 0
-        false_positive = 0
-        true_positive = 0
-        extended_truth_arr = np.concatenate((truth_arr.astype(int), [int(9.5*fs)]))
-        for j, t_ind in enumerate(extended_truth_arr[:-1]):
-            next_t_ind = extended_truth_arr[j+1]
-            loc = np.where(np.abs(pred_arr - t_ind) <= thr_)[0]
-            if j == 0:
-                err = np.where((pred_arr >= 0.5*fs + thr_) & (pred_arr <= t_ind - thr_))[0]
-            else:
-                err = np.array([], dtype=int)
-            err = np.append(
-                err,
-                np.where((pred_arr >= t_ind+thr_) & (pred_arr <= next_t_ind-thr_))[0]
-            )
-
-            false_positive += len(err)
-            if len(loc) >= 1:
-                true_positive += 1
-                false_positive += len(loc) - 1
-            elif len(loc) == 0:
-                false_negative += 1
-
-        if false_negative + false_positive > 1:
-            record_flags[idx] = 0
-        elif false_negative == 1 and false_positive == 0:
-            record_flags[idx] = 0.3
-        elif false_negative == 0 and false_positive == 1:
-            record_flags[idx] = 0.7
-
-        if verbose >= 2:
-            print(f"for the {idx}-th record,\ntrue positive = {true_positive}\nfalse positive = {false_positive}\nfalse negative = {false_negative}")
+        print(f"threshold in number of sample points = {thr * fs}")
+    record_flags = _compute_rpeak_record_flags(rpeaks_truths, rpeaks_preds, fs, thr, verbose)
 
     rec_acc = round(np.sum(record_flags) / n_records, 4)
 
@@ -107,6 +71,128 @@ def compute_rpeak_metric(rpeaks_truths:Sequence[Union[np.ndarray,Sequence[int]]]
     return metrics
 
 
+def _compute_rpeak_record_flags(rpeaks_truths:Sequence[Union[np.ndarray,Sequence[int]]],
+                                rpeaks_preds:Sequence[Union[np.ndarray,Sequence[int]]],
+                                fs:Real,
+                                thr:float=0.075,
+                                verbose:int=0) -> np.ndarray:
+    """ finished, checked,
+
+    Parameters
+    ----------
+    ref. `compute_rpeak_metric`
+
+    Returns
+    -------
+    record_flags: ndarray,
+        scores (1, 0.7, 0.3, or 0) of the records, whose mean is the accuracy
+    """
+    assert len(rpeaks_truths) == len(rpeaks_preds), \
+        f"number of records does not match, truth indicates {len(rpeaks_truths)}, while pred indicates {len(rpeaks_preds)}"
+    true_positive, false_positive, false_negative = _match_rpeaks(rpeaks_truths, rpeaks_preds, fs, thr)
+    record_flags = np.ones((len(rpeaks_truths),), dtype=float)
+    record_flags[(false_negative == 1) & (false_positive == 0)] = 0.3
+    record_flags[(false_negative == 0) & (false_positive == 1)] = 0.7
+    record_flags[false_negative + false_positive > 1] = 0
+
+    if verbose >= 2:
+        for idx in range(len(rpeaks_truths)):
+            print(f"for the {idx}-th record,\ntrue positive = {true_positive[idx]}\nfalse positive = {false_positive[idx]}\nfalse negative = {false_negative[idx]}")
+
+    return record_flags
+
+
+def _match_rpeaks(rpeaks_truths:Sequence[Union[np.ndarray,Sequence[int]]],
+                  rpeaks_preds:Sequence[Union[np.ndarray,Sequence[int]]],
+                  fs:Real,
+                  thr:float=0.075) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """ finished, checked,
+
+    count the true positives, false positives and false negatives of the predicted rpeaks
+    of (a batch of) records, in the same way as the official scoring function of CPSC2019,
+    via binary searches (`np.searchsorted`) of the bounds of the neighborhoods of the true rpeaks
+    in the sorted predictions of all the records (shifted by record-wise offsets) at once,
+    i.e. O(n log n), instead of full scans of the predictions for each true rpeak
+
+    Parameters
+    ----------
+    ref. `compute_rpeak_metric`
+
+    Returns
+    -------
+    true_positive, false_positive, false_negative: ndarray,
+        the counts of the records, each of shape (n_records,)
+    """
+    n_records = len(rpeaks_truths)
+    thr_ = thr * fs
+    truths = [np.asarray(truth_arr).astype(int) for truth_arr in rpeaks_truths]
+    preds = [np.asarray(pred_arr).ravel() for pred_arr in rpeaks_preds]
+    if not all(np.issubdtype(pred_arr.dtype, np.integer) or np.all(pred_arr == np.round(pred_arr)) for pred_arr in preds):
+        # the bounds can not be made integral, records are matched one by one (without offsets)
+        if n_records > 1:
+            counts = [_match_rpeaks([t], [p], fs, thr) for t, p in zip(truths, preds)]
+            return tuple(np.concatenate(c) for c in zip(*counts))
+        integral = False
+    else:
+        integral = True
+
+    n_truths = np.array([len(truth_arr) for truth_arr in truths], dtype=int)
+    true_positive = np.zeros((n_records,), dtype=int)
+    false_positive = np.zeros((n_records,), dtype=int)
+    false_negative = np.zeros((n_records,), dtype=int)
+    if n_truths.sum() == 0:
+        return true_positive, false_positive, false_negative
+
+    rec_idx = np.repeat(np.arange(n_records), n_truths)
+    t_ind = np.concatenate(truths)
+    is_first = np.zeros((len(t_ind),), dtype=bool)
+    is_first[np.cumsum(n_truths)[n_truths > 0] - n_truths[n_truths > 0]] = True
+    is_last = np.zeros((len(t_ind),), dtype=bool)
+    is_last[np.cumsum(n_truths)[n_truths > 0] - 1] = True
+    next_t_ind = np.append(t_ind[1:], 0)
+    next_t_ind[is_last] = int(9.5*fs)
+
+    # closed intervals [lower, upper] (computed the same as the comparisons of the official scoring function),
+    # in which the predictions are counted
+    if integral:
+        loc_lower, loc_upper = t_ind - math.floor(thr_), t_ind + math.floor(thr_)
+    else:
+        loc_lower, loc_upper = t_ind - thr_, t_ind + thr_
+    err_lower, err_upper = t_ind + thr_, next_t_ind - thr_
+    first_err_lower, first_err_upper = np.full_like(t_ind, 0.5*fs + thr_, dtype=float), t_ind - thr_
+    if integral:
+        err_lower, first_err_lower = np.ceil(err_lower), np.ceil(first_err_lower)
+        err_upper, first_err_upper = np.floor(err_upper), np.floor(first_err_upper)
+
+    # shift the records apart, so that the predictions of all the records are sorted in one array
+    n_preds = np.array([len(pred_arr) for pred_arr in preds], dtype=int)
+    all_preds = np.concatenate(preds + [np.array([])]).astype(float)
+    if integral:
+        bounds = [loc_lower, loc_upper, err_lower, err_upper, first_err_lower, first_err_upper]
+        base = min([b.min() for b in bounds] + [all_preds.min(initial=0)]) - 1
+        span = max([b.max() for b in bounds] + [all_preds.max(initial=0)]) - base + 1
+        all_preds = all_preds - base + np.repeat(np.arange(n_records), n_preds) * span
+        rec_offset = rec_idx * span - base
+    else:
+        rec_offset = np.zeros_like(t_ind)
+    all_preds = np.sort(all_preds)
+
+    def _count(lower:np.ndarray, upper:np.ndarray) -> np.ndarray:
+        counts = np.searchsorted(all_preds, upper + rec_offset, side="right") \
+            - np.searchsorted(all_preds, lower + rec_offset, side="left")
+        return np.maximum(0, counts)
+
+    n_loc = _count(loc_lower, loc_upper)
+    n_err = _count(err_lower, err_upper) + is_first * _count(first_err_lower, first_err_upper)
+    n_fp = n_err + np.maximum(0, n_loc - 1)
+
+    true_positive = np.bincount(rec_idx, weights=(n_loc >= 1), minlength=n_records).astype(int)
+    false_negative = np.bincount(rec_idx, weights=(n_loc == 0), minlength=n_records).astype(int)
+    false_positive = np.bincount(rec_idx, weights=n_fp, minlength=n_records).astype(int)
+
+    return true_positive, false_positive, false_negative
+
+
 def compute_rr_metric(rr_truths:Sequence[Union[np.ndarray,Sequence[int]]],
                       rr_preds:Sequence[Union[np.ndarray,Sequence[int]]],
                       weight_masks:Optional[Sequence[Union[np.ndarray,Sequence[int]]]]=None,
@@ -131,29 +217,15 @@ def compute_rr_metric(rr_truths:Sequence[Union[np.ndarray,Sequence[int]]],
     neg_masked_bce: float,
         negative masked BCE loss
     """
-    with mp.Pool(processes=max(1,mp.cpu_count())) as pool:
-        af_episode_truths = pool.starmap(
-            func=mask_to_intervals,
-            iterable=[(row,1,True) for row in rr_truths]
-        )
-    with mp.Pool(processes=max(1,mp.cpu_count())) as pool:
-        af_episode_preds = pool.starmap(
-            func=mask_to_intervals,
-            iterable=[(row,1,True) for row in rr_preds]
-        )
-    scoring_mask = np.zeros_like(np.array(rr_truths))
-    n_samples, seq_len = scoring_mask.shape
-    for idx, sample in enumerate(af_episode_truths):
-        for itv in sample:
-            scoring_mask[idx][max(0,itv[0]-2):min(seq_len,itv[0]+3)] = 0.5
-            scoring_mask[idx][max(0,itv[1]-2):min(seq_len,itv[1]+3)] = 0.5
-            scoring_mask[idx][max(0,itv[0]-1):min(seq_len,itv[0]+2)] = 1
-            scoring_mask[idx][max(0,itv[1]-1):min(seq_len,itv[1]+2)] = 1
-    rr_score = sum([
-        scoring_mask[idx][itv].sum() / max(1, len(af_episode_truths[idx])) \
-            for idx in range(n_samples) for itv in af_episode_preds[idx]
-    ])
-    rr_score += sum([0==len(t)==len(p) for t, p in zip(af_episode_truths, af_episode_preds)])
+    rr_truths = np.asarray(rr_truths)
+    rr_preds = np.asarray(rr_preds)
+    n_samples, seq_len = rr_truths.shape
+    truth_episodes = _batched_mask_to_intervals(rr_truths)
+    pred_episodes = _batched_mask_to_intervals(rr_preds)
+    # NOTE: the scoring mask has the dtype of `rr_truths` (as was `np.zeros_like`)
+    scoring_mask = np.zeros_like(rr_truths)
+    _fill_scoring_mask(scoring_mask, *truth_episodes, inner=1, outer=2, right_bound=seq_len)
+    rr_score = _episode_score(scoring_mask, truth_episodes, pred_episodes, n_samples)
     neg_masked_bce = -_MBCE(
         torch.as_tensor(rr_preds, dtype=torch.float32, device=torch.device("cpu")),
         torch.as_tensor(rr_truths, dtype=torch.float32, device=torch.device("cpu")),
@@ -204,46 +276,25 @@ def compute_main_task_metric(mask_truths:Sequence[Union[np.ndarray,Sequence[int]
     default_rr = int(fs * 0.8 / reduction)
     if rpeaks is not None:
         assert len(rpeaks) == len(mask_truths)
-    with mp.Pool(processes=max(1,mp.cpu_count())) as pool:
-        af_episode_truths = pool.starmap(
-            func=mask_to_intervals,
-            iterable=[(row,1,True) for row in mask_truths]
-        )
-    with mp.Pool(processes=max(1,mp.cpu_count())) as pool:
-        af_episode_preds = pool.starmap(
-            func=mask_to_intervals,
-            iterable=[(row,1,True) for row in mask_preds]
-        )
-    af_episode_truths = [[[itv[0]*reduction, itv[1]*reduction] for itv in sample] for sample in af_episode_truths]
-    af_episode_preds = [[[itv[0]*reduction, itv[1]*reduction] for itv in sample] for sample in af_episode_preds]
-    n_samples, seq_len = np.array(mask_truths).shape
+    mask_truths = np.asarray(mask_truths)
+    mask_preds = np.asarray(mask_preds)
+    n_samples, seq_len = mask_truths.shape
+    sample_idx, starts, ends = _batched_mask_to_intervals(mask_truths)
+    truth_episodes = (sample_idx, starts * reduction, ends * reduction)
+    sample_idx, starts, ends = _batched_mask_to_intervals(mask_preds)
+    pred_episodes = (sample_idx, starts * reduction, ends * reduction)
     scoring_mask = np.zeros((n_samples, seq_len*reduction))
-    for idx, sample in enumerate(af_episode_truths):
-        for itv in sample:
-            if rpeaks is not None:
-                itv_rpeaks = [i for i,r in enumerate(rpeaks[idx]) if itv[0] <= r < itv[1]]
-                start = rpeaks[idx][max(0,itv_rpeaks[0]-2)]
-                end = rpeaks[idx][min(len(rpeaks[idx])-1,itv_rpeaks[0]+2)] + 1
-                scoring_mask[idx][start:end] = 0.5
-                start = rpeaks[idx][max(0,itv_rpeaks[-1]-2)]
-                end = rpeaks[idx][min(len(rpeaks[idx])-1,itv_rpeaks[-1]+2)] + 1
-                scoring_mask[idx][start:end] = 0.5
-                start = rpeaks[idx][max(0,itv_rpeaks[0]-1)]
-                end = rpeaks[idx][min(len(rpeaks[idx])-1,itv_rpeaks[0]+1)] + 1
-                scoring_mask[idx][start:end] = 1
-                start = rpeaks[idx][max(0,itv_rpeaks[-1]-1)]
-                end = rpeaks[idx][min(len(rpeaks[idx])-1,itv_rpeaks[-1]+1)] + 1
-                scoring_mask[idx][start:end] = 1
-            else:
-                scoring_mask[idx][max(0,itv[0]-2*default_rr):min(seq_len,itv[0]+2*default_rr+1)] = 0.5
-                scoring_mask[idx][max(0,itv[1]-2*default_rr):min(seq_len,itv[1]+2*default_rr+1)] = 0.5
-                scoring_mask[idx][max(0,itv[0]-1*default_rr):min(seq_len,itv[0]+1*default_rr+1)] = 1
-                scoring_mask[idx][max(0,itv[1]-1*default_rr):min(seq_len,itv[1]+1*default_rr+1)] = 1
-    main_score = sum([
-        scoring_mask[idx][itv].sum() / max(1, len(af_episode_truths[idx])) \
-            for idx in range(n_samples) for itv in af_episode_preds[idx]
-    ])
-    main_score += sum([0==len(t)==len(p) for t, p in zip(af_episode_truths, af_episode_preds)])
+    if rpeaks is not None:
+        for idx, start, end in zip(*truth_episodes):
+            itv_rpeaks = [i for i,r in enumerate(rpeaks[idx]) if start <= r < end]
+            for rp_idx, radius, val in [(itv_rpeaks[0],2,0.5), (itv_rpeaks[-1],2,0.5), (itv_rpeaks[0],1,1), (itv_rpeaks[-1],1,1)]:
+                lo = rpeaks[idx][max(0,rp_idx-radius)]
+                hi = rpeaks[idx][min(len(rpeaks[idx])-1,rp_idx+radius)] + 1
+                scoring_mask[idx][lo:hi] = val
+    else:
+        # NOTE: the right bound is `seq_len` (rather than `seq_len*reduction`), as has always been
+        _fill_scoring_mask(scoring_mask, *truth_episodes, inner=default_rr, outer=2*default_rr, right_bound=seq_len)
+    main_score = _episode_score(scoring_mask, truth_episodes, pred_episodes, n_samples)
     neg_masked_bce = -_MBCE(
         torch.as_tensor(mask_preds, dtype=torch.float32, device=torch.device("cpu")),
         torch.as_tensor(mask_truths, dtype=torch.float32, device=torch.device("cpu")),
@@ -256,6 +307,293 @@ def compute_main_task_metric(mask_truths:Sequence[Union[np.ndarray,Sequence[int]
     return metrics
 
 
+def _batched_mask_to_intervals(masks:np.ndarray, vals:Real=1) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """ finished, checked,
+
+    batched (run-length encoding) version of `mask_to_intervals(row, vals, right_inclusive=True)`,
+    applied to all the rows of `masks` at once
+
+    Parameters
+    ----------
+    masks: ndarray,
+        the masks, of shape (n_samples, seq_len)
+    vals: real number, default 1,
+        the value of the intervals
+
+    Returns
+    -------
+    sample_idx, starts, ends: ndarray,
+        indices of the samples, start indices and (inclusive) end indices of the intervals,
+        ordered by sample and then by start index
+    """
+    n_samples = masks.shape[0]
+    padded = np.zeros((n_samples, masks.shape[1]+2), dtype=np.int8)
+    padded[:, 1:-1] = (masks == vals)
+    diff = np.diff(padded, axis=1)
+    sample_idx, starts = np.nonzero(diff == 1)
+    _, ends = np.nonzero(diff == -1)
+    return sample_idx, starts, ends - 1
+
+
+def _fill_scoring_mask(scoring_mask:np.ndarray,
+                       sample_idx:np.ndarray,
+                       starts:np.ndarray,
+                       ends:np.ndarray,
+                       inner:int,
+                       outer:int,
+                       right_bound:int) -> NoReturn:
+    """ finished, checked,
+
+    fill (in place) the scoring mask around the endpoints of the (truth) intervals,
+    with 0.5 within `outer`, and 1 within `inner` of the endpoints,
+    with later writes taking precedence over earlier ones,
+    exactly as the sequential assignments interval by interval did
+
+    Parameters
+    ----------
+    scoring_mask: ndarray,
+        the scoring mask (zeros), of shape (n_samples, mask_len)
+    sample_idx, starts, ends: ndarray,
+        the (truth) intervals, ref. `_batched_mask_to_intervals`
+    inner, outer: int,
+        radii of the neighborhoods of the endpoints
+    right_bound: int,
+        (exclusive) right bound of the neighborhoods
+    """
+    if len(sample_idx) == 0:
+        return
+    n_itv = len(sample_idx)
+    # the 4 writes of each interval, in the order of assignment
+    centers = np.stack([starts, ends, starts, ends], axis=1).ravel()
+    radii = np.tile([outer, outer, inner, inner], n_itv)
+    values = np.tile([0.5, 0.5, 1, 1], n_itv)
+    rows = np.repeat(sample_idx, 4)
+    lo = np.maximum(0, centers - radii)
+    hi = np.minimum(right_bound, centers + radii + 1)
+    pos = lo[:, np.newaxis] + np.arange(2 * outer + 1)[np.newaxis, :]
+    valid = pos < hi[:, np.newaxis]
+    write_idx = np.broadcast_to(np.arange(len(centers))[:, np.newaxis], pos.shape)[valid]
+    mask_len = scoring_mask.shape[1]
+    flat_pos = rows[write_idx] * mask_len + pos[valid]
+    if len(flat_pos) == 0:
+        return
+    # the last write to each position wins
+    order = np.lexsort((write_idx, flat_pos))
+    flat_pos, write_idx = flat_pos[order], write_idx[order]
+    last = np.append(flat_pos[1:] != flat_pos[:-1], True)
+    flat_pos, write_idx = flat_pos[last], write_idx[last]
+    scoring_mask[flat_pos // mask_len, flat_pos % mask_len] = values[write_idx]
+
+
+def _episode_score(scoring_mask:np.ndarray,
+                   truth_episodes:Tuple[np.ndarray, np.ndarray, np.ndarray],
+                   pred_episodes:Tuple[np.ndarray, np.ndarray, np.ndarray],
+                   n_samples:int) -> float:
+    """ finished, checked,
+
+    the score of the predicted intervals on the scoring mask,
+    i.e. the sum of the scoring mask at both endpoints of each predicted interval,
+    divided by the number of truth intervals of the sample,
+    plus the number of samples free of intervals in both the truths and the predictions
+
+    Parameters
+    ----------
+    scoring_mask: ndarray,
+        the scoring mask, of shape (n_samples, mask_len)
+    truth_episodes, pred_episodes: tuple of ndarray,
+        the truth and predicted intervals, ref. `_batched_mask_to_intervals`
+    n_samples: int,
+        number of samples
+
+    Returns
+    -------
+    score: float
+    """
+    n_truths = np.bincount(truth_episodes[0], minlength=n_samples)
+    n_preds = np.bincount(pred_episodes[0], minlength=n_samples)
+    sample_idx, starts, ends = pred_episodes
+    endpoint_scores = scoring_mask[sample_idx, starts].astype(np.float64) \
+        + scoring_mask[sample_idx, ends].astype(np.float64)
+    score = float(np.sum(endpoint_scores / np.maximum(1, n_truths[sample_idx])))
+    score += int(np.sum((n_truths == 0) & (n_preds == 0)))
+    return score
+
+
+class RPeakMetricAccumulator(object):
+    """ finished, NOT checked,
+
+    streaming counterpart of `compute_rpeak_metric`, updated batch by batch,
+    keeping only the sum of the scores of the records (and the number of records)
+    """
+    __name__ = "RPeakMetricAccumulator"
+
+    def __init__(self, fs:Real, thr:float=0.075) -> NoReturn:
+        """
+
+        Parameters
+        ----------
+        fs: real number,
+            sampling frequency of ECG signal
+        thr: float, default 0.075,
+            threshold for a prediction to be truth positive,
+            with units in seconds,
+        """
+        self.fs = fs
+        self.thr = thr
+        self.flag_sum = 0.0
+        self.n_records = 0
+
+    def update(self,
+               rpeaks_truths:Sequence[Union[np.ndarray,Sequence[int]]],
+               rpeaks_preds:Sequence[Union[np.ndarray,Sequence[int]]]) -> NoReturn:
+        """
+
+        Parameters
+        ----------
+        rpeaks_truths, rpeaks_preds: sequence,
+            ground truths and predictions of rpeaks locations (indices) of the batch,
+            ref. `compute_rpeak_metric`
+        """
+        self.flag_sum += float(np.sum(_compute_rpeak_record_flags(rpeaks_truths, rpeaks_preds, self.fs, self.thr)))
+        self.n_records += len(rpeaks_truths)
+
+    def merge(self, other:"RPeakMetricAccumulator") -> NoReturn:
+        """ merge the (partial) results of another accumulator, e.g. from another process
+        """
+        self.flag_sum += other.flag_sum
+        self.n_records += other.n_records
+
+    def compute(self) -> Dict[str, float]:
+        """
+
+        Returns
+        -------
+        metrics: dict,
+            the same as `compute_rpeak_metric`
+        """
+        return {"qrs_score": round(self.flag_sum / max(1, self.n_records), 4)}
+
+
+class _MaskMetricAccumulator(object):
+    """ finished, NOT checked,
+
+    base class of the streaming counterparts of `compute_rr_metric` and `compute_main_task_metric`,
+    which fill (float32) buffers preallocated to the size of the dataset batch by batch,
+    without concatenating (copying) the whole of the results on every batch
+    """
+    __name__ = "_MaskMetricAccumulator"
+
+    def __init__(self, n_samples:int, seq_len:int) -> NoReturn:
+        """
+
+        Parameters
+        ----------
+        n_samples: int,
+            (expected) number of samples, typically the length of the dataset,
+            the buffers are enlarged if exceeded
+        seq_len: int,
+            length of the sequences of labels (and predictions, weight masks)
+        """
+        self.seq_len = seq_len
+        self.n = 0
+        self.labels = np.zeros((n_samples, seq_len), dtype=np.float32)
+        self.preds = np.zeros((n_samples, seq_len), dtype=np.float32)
+        self.weight_masks = np.zeros((n_samples, seq_len), dtype=np.float32)
+
+    def update(self, labels:np.ndarray, preds:np.ndarray, weight_masks:np.ndarray) -> NoReturn:
+        """
+
+        Parameters
+        ----------
+        labels, preds, weight_masks: ndarray,
+            labels, predictions, and weight masks of the batch, of shape (batch_size, seq_len)
+        """
+        batch_size = len(labels)
+        if self.n + batch_size > len(self.labels):
+            new_size = max(2 * len(self.labels), self.n + batch_size)
+            for k in ["labels", "preds", "weight_masks",]:
+                buffer = np.zeros((new_size, self.seq_len), dtype=np.float32)
+                buffer[:self.n] = getattr(self, k)[:self.n]
+                setattr(self, k, buffer)
+        self.labels[self.n: self.n+batch_size] = labels
+        self.preds[self.n: self.n+batch_size] = preds
+        self.weight_masks[self.n: self.n+batch_size] = weight_masks
+        self.n += batch_size
+
+    def merge(self, other:"_MaskMetricAccumulator") -> NoReturn:
+        """ merge the (partial) results of another accumulator, e.g. from another process
+        """
+        self.update(other.labels[:other.n], other.preds[:other.n], other.weight_masks[:other.n])
+
+    def __getstate__(self) -> dict:
+        """ only the filled parts of the buffers are pickled
+        """
+        state = self.__dict__.copy()
+        for k in ["labels", "preds", "weight_masks",]:
+            state[k] = state[k][:self.n]
+        return state
+
+
+class RRMetricAccumulator(_MaskMetricAccumulator):
+    """ finished, NOT checked,
+
+    streaming counterpart of `compute_rr_metric`
+    """
+    __name__ = "RRMetricAccumulator"
+
+    def compute(self) -> Dict[str, float]:
+        """
+
+        Returns
+        -------
+        metrics: dict,
+            the same as `compute_rr_metric`
+        """
+        return compute_rr_metric(self.labels[:self.n], self.preds[:self.n], self.weight_masks[:self.n])
+
+
+class MainTaskMetricAccumulator(_MaskMetricAccumulator):
+    """ finished, NOT checked,
+
+    streaming counterpart of `compute_main_task_metric`
+    """
+    __name__ = "MainTaskMetricAccumulator"
+
+    def __init__(self, n_samples:int, seq_len:int, fs:Real, reduction:int) -> NoReturn:
+        """
+
+        Parameters
+        ----------
+        n_samples: int,
+            (expected) number of samples, typically the length of the dataset,
+            the buffers are enlarged if exceeded
+        seq_len: int,
+            length of the sequences of labels (and predictions, weight masks)
+        fs: Real,
+            sampling frequency of the model input ECGs
+        reduction: int,
+            reduction ratio of the main task model
+        """
+        super().__init__(n_samples, seq_len)
+        self.fs = fs
+        self.reduction = reduction
+
+    def compute(self) -> Dict[str, float]:
+        """
+
+        Returns
+        -------
+        metrics: dict,
+            the same as `compute_main_task_metric`
+        """
+        return compute_main_task_metric(
+            mask_truths=self.labels[:self.n],
+            mask_preds=self.preds[:self.n],
+            fs=self.fs,
+            reduction=self.reduction,
+            weight_masks=self.weight_masks[:self.n],
+        )
+
 
 # class WeightedBoundaryLoss(nn.Module):
 #     """
@@ -0,0 +1,241 @@
+"""
+check the (vectorized) `compute_rr_metric` and `compute_main_task_metric`
+against the former implementations (row-by-row `mask_to_intervals` in process pools),
+on random masks, and the (sorted-matching) counts of `compute_rpeak_metric`
+against the former (full scan for each true rpeak) implementation, on random rpeaks,
+and benchmark them
+"""
+import time
+import argparse
+import multiprocessing as mp
+from typing import Union, Optional, Sequence, Tuple, NoReturn
+from numbers import Real
+
+def import_parents(level:int=1) -> NoReturn:
+    # https://gist.github.com/vaultah/d63cb4c86be2774377aa674b009f759a
+    import sys, importlib
+    from pathlib import Path
+    global __package__
+    file = Path(__file__).resolve()
+    parent, top = file.parent, file.parents[level]
+
+    sys.path.append(str(top))
+    try:
+        sys.path.remove(str(parent))
+    except ValueError: # already removed
+        pass
+    __package__ = '.'.join(parent.parts[len(top.parts):])
+    importlib.import_module(__package__) # won't be needed after that
+
+if __name__ == "__main__" and __package__ is None:
+    import_parents(level=1)
+
+import numpy as np
+
+from .aux_metrics import compute_rr_metric, compute_main_task_metric, _match_rpeaks
+from .misc import mask_to_intervals
+
+
+def _get_parser() -> dict:
+    """
+    """
+    description = "check and benchmark the vectorized metrics of the rr_lstm and the main task"
+    parser = argparse.ArgumentParser(
+        description=description,
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument(
+        "-n", "--n-samples", type=int, default=2000,
+        help="number of (random) samples",
+        dest="n_samples",
+    )
+    parser.add_argument(
+        "-r", "--repeats", type=int, default=20,
+        help="number of repeats of the comparison",
+        dest="repeats",
+    )
+    parser.add_argument(
+        "-s", "--seed", type=int, default=0,
+        help="seed of the random masks",
+        dest="seed",
+    )
+
+    args = vars(parser.parse_args())
+
+    return args
+
+
+def _legacy_score(truths:Sequence[Union[np.ndarray,Sequence[int]]],
+                  preds:Sequence[Union[np.ndarray,Sequence[int]]],
+                  inner:int,
+                  outer:int,
+                  reduction:int=1,
+                  scoring_mask:Optional[np.ndarray]=None) -> float:
+    """ finished, checked,
+
+    the score part of the former `compute_rr_metric` (`reduction` = 1)
+    and `compute_main_task_metric` (without `rpeaks`)
+    """
+    with mp.Pool(processes=max(1,mp.cpu_count())) as pool:
+        af_episode_truths = pool.starmap(
+            func=mask_to_intervals,
+            iterable=[(row,1,True) for row in truths]
+        )
+    with mp.Pool(processes=max(1,mp.cpu_count())) as pool:
+        af_episode_preds = pool.starmap(
+            func=mask_to_intervals,
+            iterable=[(row,1,True) for row in preds]
+        )
+    af_episode_truths = [[[itv[0]*reduction, itv[1]*reduction] for itv in sample] for sample in af_episode_truths]
+    af_episode_preds = [[[itv[0]*reduction, itv[1]*reduction] for itv in sample] for sample in af_episode_preds]
+    n_samples, seq_len = np.array(truths).shape
+    if scoring_mask is None:
+        scoring_mask = np.zeros((n_samples, seq_len*reduction))
+    for idx, sample in enumerate(af_episode_truths):
+        for itv in sample:
+            scoring_mask[idx][max(0,itv[0]-outer):min(seq_len,itv[0]+outer+1)] = 0.5
+            scoring_mask[idx][max(0,itv[1]-outer):min(seq_len,itv[1]+outer+1)] = 0.5
+            scoring_mask[idx][max(0,itv[0]-inner):min(seq_len,itv[0]+inner+1)] = 1
+            scoring_mask[idx][max(0,itv[1]-inner):min(seq_len,itv[1]+inner+1)] = 1
+    score = sum([
+        scoring_mask[idx][itv].sum() / max(1, len(af_episode_truths[idx])) \
+            for idx in range(n_samples) for itv in af_episode_preds[idx]
+    ])
+    score += sum([0==len(t)==len(p) for t, p in zip(af_episode_truths, af_episode_preds)])
+    return score
+
+
+def _legacy_rpeak_counts(rpeaks_truths:Sequence[Union[np.ndarray,Sequence[int]]],
+                         rpeaks_preds:Sequence[Union[np.ndarray,Sequence[int]]],
+                         fs:Real,
+                         thr:float=0.075) -> np.ndarray:
+    """ finished, checked,
+
+    the true positives, false positives and false negatives of the records,
+    computed as the former `compute_rpeak_metric`, of shape (n_records, 3)
+    """
+    counts = []
+    thr_ = thr * fs
+    for truth_arr, pred_arr in zip(rpeaks_truths, rpeaks_preds):
+        false_negative = 0
+        false_positive = 0
+        true_positive = 0
+        extended_truth_arr = np.concatenate((truth_arr.astype(int), [int(9.5*fs)]))
+        for j, t_ind in enumerate(extended_truth_arr[:-1]):
+            next_t_ind = extended_truth_arr[j+1]
+            loc = np.where(np.abs(pred_arr - t_ind) <= thr_)[0]
+            if j == 0:
+                err = np.where((pred_arr >= 0.5*fs + thr_) & (pred_arr <= t_ind - thr_))[0]
+            else:
+                err = np.array([], dtype=int)
+            err = np.append(
+                err,
+                np.where((pred_arr >= t_ind+thr_) & (pred_arr <= next_t_ind-thr_))[0]
+            )
+
+            false_positive += len(err)
+            if len(loc) >= 1:
+                true_positive += 1
+                false_positive += len(loc) - 1
+            elif len(loc) == 0:
+                false_negative += 1
+        counts.append([true_positive, false_positive, false_negative])
+    return np.array(counts, dtype=int).reshape(-1, 3)
+
+
+def _random_rpeaks(rng:np.random.Generator, n_records:int, fs:Real, thr:float) -> Tuple[list, list]:
+    """ random true rpeaks, and predictions (shifted, dropped, spurious) of them, in 10s windows
+    """
+    siglen = int(10 * fs)
+    rpeaks_truths, rpeaks_preds = [], []
+    for _ in range(n_records):
+        truth_arr = np.sort(rng.choice(siglen, rng.integers(0, 30), replace=False))
+        pred_arr = np.concatenate([
+            truth_arr + rng.integers(-int(thr*fs)-3, int(thr*fs)+4, len(truth_arr)),
+            rng.integers(0, siglen, rng.integers(0, 4)),
+        ])
+        pred_arr = pred_arr[rng.random(len(pred_arr)) > 0.05]
+        rpeaks_truths.append(truth_arr)
+        rpeaks_preds.append(pred_arr)
+    return rpeaks_truths, rpeaks_preds
+
+
+def _random_masks(rng:np.random.Generator, n_samples:int, seq_len:int, max_episodes:int=4) -> np.ndarray:
+    """ random binary masks, with episodes of various lengths (some of length 1, some adjacent)
+    """
+    masks = np.zeros((n_samples, seq_len), dtype=np.float32)
+    for idx in range(n_samples):
+        for _ in range(rng.integers(0, max_episodes+1)):
+            start = rng.integers(0, seq_len)
+            masks[idx, start: start+rng.integers(1, max(2, seq_len//3))] = 1
+    return masks
+
+
+def run_test(n_samples:int=2000, repeats:int=20, seed:int=0) -> bool:
+    """ finished, checked,
+
+    Parameters
+    ----------
+    n_samples: int, default 2000,
+        number of (random) samples (records) of each comparison
+    repeats: int, default 20,
+        number of repeats of the comparison
+    seed: int, default 0,
+        seed of the random masks
+
+    Returns
+    -------
+    scores_agree: bool,
+        True if the scores (and counts) of the new and the former implementations agree
+    """
+    rng = np.random.default_rng(seed)
+    scores_agree = True
+    timings = {"rr": [0.0, 0.0], "main": [0.0, 0.0], "rpeak": [0.0, 0.0]}
+    # the rr_lstm task (seq_len 30), and the main task (seq_len 6000, reduction 8, fs 200)
+    for task, seq_len, fs, reduction in [("rr", 30, None, 1), ("main", 750, 200, 8)]:
+        for _ in range(repeats):
+            truths = _random_masks(rng, n_samples, seq_len)
+            preds = _random_masks(rng, n_samples, seq_len)
+            weight_masks = np.ones_like(truths)
+            tic = time.time()
+            if task == "rr":
+                legacy = _legacy_score(
+                    truths, preds, inner=1, outer=2, scoring_mask=np.zeros_like(truths),
+                )
+            else:
+                default_rr = int(fs * 0.8 / reduction)
+                legacy = _legacy_score(
+                    truths, preds, inner=default_rr, outer=2*default_rr, reduction=reduction,
+                )
+            timings[task][0] += time.time() - tic
+            tic = time.time()
+            if task == "rr":
+                score = compute_rr_metric(truths, preds, weight_masks)["rr_score"]
+            else:
+                score = compute_main_task_metric(truths, preds, fs, reduction, weight_masks)["main_score"]
+            timings[task][1] += time.time() - tic
+            # the former implementation accumulated float32 scores for float32 masks
+            if not np.isclose(score, legacy, rtol=1e-6, atol=1e-8):
+                print(f"{task} scores disagree: vectorized {score}, former {legacy}")
+                scores_agree = False
+        print(f"{task}: former {timings[task][0]/repeats:.4f}s, vectorized {timings[task][1]/repeats:.4f}s per call, with {n_samples} samples")
+    for _ in range(repeats):
+        fs, thr = rng.choice([200, 250, 500]), rng.choice([0, 0.033, 0.075])
+        rpeaks_truths, rpeaks_preds = _random_rpeaks(rng, n_samples, fs, thr)
+        tic = time.time()
+        legacy = _legacy_rpeak_counts(rpeaks_truths, rpeaks_preds, fs, thr)
+        timings["rpeak"][0] += time.time() - tic
+        tic = time.time()
+        counts = np.stack(_match_rpeaks(rpeaks_truths, rpeaks_preds, fs, thr), axis=1)
+        timings["rpeak"][1] += time.time() - tic
+        if not (counts == legacy).all():
+            print(f"rpeak counts disagree at records {np.where((counts != legacy).any(axis=1))[0]}")
+            scores_agree = False
+    print(f"rpeak: former {timings['rpeak'][0]/repeats:.4f}s, sorted matching {timings['rpeak'][1]/repeats:.4f}s per call, with {n_samples} records")
+    print(f"scores agree: {scores_agree}")
+    return scores_agree
+
+
+if __name__ == "__main__":
+    args = _get_parser()
+    run_test(**args)
@@ -43,6 +43,7 @@ __all__ = [
     "nildent",
     "list_sum",
     "save_dict",
+    "dump_json_atomic",
     "uniform",
     "WFDB_Beat_Annotations", "WFDB_Non_Beat_Annotations", "WFDB_Rhythm_Annotations",
 ]
@@ -810,6 +811,28 @@ def save_dict(filename, dic):
         json.dump(dic, json_file, ensure_ascii=False)
 
 
+def dump_json_atomic(obj:Any, filename:str, **kwargs:Any) -> NoReturn:
+    """ finished, checked,
+
+    dump `obj` into a json file atomically,
+    i.e. written into a temporary file first, which then replaces `filename`,
+    so that readers never see a partially written file
+
+    Parameters
+    ----------
+    obj: any,
+        the json serializable object to dump
+    filename: str,
+        path of the json file
+    kwargs: dict,
+        key word arguments passed to `json.dump`
+    """
+    tmp_filename = f"{filename}.{os.getpid()}.tmp"
+    with open(tmp_filename, "w") as f:
+        json.dump(obj, f, **kwargs)
+    os.replace(tmp_filename, filename)
+
+
 def uniform(low:Real, high:Real, num:int) -> List[float]:
     """ finished, checked,
 
@@ -13,6 +13,7 @@ import wfdb
 __all__ = [
     "compute_challenge_metric",
     "gen_endpoint_score_mask", "gen_endpoint_score_range",
+    "EndpointScoreRange", "gen_endpoint_score_intervals",
 ]
 
 
@@ -250,10 +251,10 @@ def compute_challenge_metric(class_true:int,
         labelled intervals of AF episodes
     endpoints_pred: sequence of intervals,
         predicted intervals of AF episodes
-    onset_score_range: sequence of float,
-        scoring mask for the AF onset predictions
-    offset_score_range: sequence of float,
-        scoring mask for the AF offset predictions
+    onset_score_range: sequence of float, or EndpointScoreRange,
+        scoring mask (or sparse scoring range) for the AF onset predictions
+    offset_score_range: sequence of float, or EndpointScoreRange,
+        scoring mask (or sparse scoring range) for the AF offset predictions
 
     Returns
     -------
@@ -266,14 +267,135 @@ def compute_challenge_metric(class_true:int,
     return u
 
 
-def gen_endpoint_score_mask(siglen:int,
-                            critical_points:Sequence[int],
-                            af_intervals:Sequence[Sequence[int]],
-                            bias:dict={1:1, 2:0.5},
-                            verbose:int=0) -> Tuple[np.ndarray, np.ndarray]:
-    """ finished, checked,
+class EndpointScoreRange(object):
+    """ finished, NOT checked,
 
-    generate the scoring mask for the onsets and offsets of af episodes,
+    sparse (piecewise-constant) representation of the scoring mask (range)
+    for the onsets (or offsets) of af episodes,
+    which can be used in place of the signal-length scoring mask,
+    e.g. `onset_score_range[idx]` in `ue_calculate`, without allocating signal-length arrays
+
+    the score at index `idx` is `weights[i]` where `bounds[i] <= idx < bounds[i+1]`
+    """
+    __name__ = "EndpointScoreRange"
+
+    def __init__(self, siglen:int, bounds:Sequence[int], weights:Sequence[float]) -> NoReturn:
+        """ finished, NOT checked,
+
+        Parameters
+        ----------
+        siglen: int,
+            length of the signal
+        bounds: sequence of int,
+            strictly increasing bounds of the pieces, starting from 0 and ending with `siglen`
+        weights: sequence of float,
+            scores of the pieces, of length `len(bounds)-1`
+        """
+        self.siglen = int(siglen)
+        self.bounds = np.asarray(bounds, dtype=int)
+        self.weights = np.asarray(weights, dtype=float)
+        assert len(self.bounds) == len(self.weights) + 1, \
+            "length of `bounds` should be one more than that of `weights`"
+
+    @classmethod
+    def from_intervals(cls,
+                       siglen:int,
+                       starts:Sequence[int],
+                       ends:Sequence[int],
+                       values:Sequence[float]) -> "EndpointScoreRange":
+        """ finished, NOT checked,
+
+        construct the piecewise-constant representation from scoring intervals,
+        the score at each index being the maximum of 0 and
+        the values of the intervals (right exclusive) covering the index
+
+        Parameters
+        ----------
+        siglen: int,
+            length of the signal
+        starts, ends: sequence of int,
+            start and end (exclusive) indices of the scoring intervals
+        values: sequence of float,
+            scores of the scoring intervals
+
+        Returns
+        -------
+        score_range: EndpointScoreRange,
+            the sparse scoring range
+        """
+        starts = np.clip(np.asarray(starts, dtype=int), 0, siglen)
+        ends = np.clip(np.asarray(ends, dtype=int), 0, siglen)
+        values = np.asarray(values, dtype=float)
+        valid = starts < ends
+        starts, ends, values = starts[valid], ends[valid], values[valid]
+        bounds = np.unique(np.concatenate(([0, siglen], starts, ends)))
+        weights = np.zeros((len(bounds)-1,), dtype=float)
+        # indices of the pieces covered by each interval, expanded without python loops
+        lo, hi = np.searchsorted(bounds, starts), np.searchsorted(bounds, ends)
+        counts = hi - lo
+        offsets = np.repeat(np.cumsum(counts) - counts, counts)
+        pieces = np.repeat(lo, counts) + np.arange(counts.sum()) - offsets
+        np.maximum.at(weights, pieces, np.repeat(values, counts))
+        # merge neighbouring pieces with equal scores
+        keep = np.concatenate(([True], weights[1:] != weights[:-1]))
+        return cls(siglen, np.append(bounds[:-1][keep], siglen), weights[keep])
+
+    def score_at(self, positions:Union[int, Sequence[int], np.ndarray]) -> Union[float, np.ndarray]:
+        """ finished, NOT checked,
+
+        vectorized evaluation of the scores at `positions`,
+        negative positions are counted from the end as for ndarrays
+
+        Parameters
+        ----------
+        positions: int or array_like of int,
+            the positions (indices) to evaluate
+
+        Returns
+        -------
+        scores: float or ndarray,
+            the scores at `positions`
+        """
+        _positions = np.asarray(positions, dtype=int)
+        _positions = np.where(_positions < 0, _positions + self.siglen, _positions)
+        if ((_positions < 0) | (_positions >= self.siglen)).any():
+            raise IndexError(f"index out of bounds for scoring range of length {self.siglen}")
+        scores = self.weights[np.searchsorted(self.bounds, _positions, side="right") - 1]
+        if scores.ndim == 0:
+            return float(scores)
+        return scores
+
+    def __getitem__(self, idx:Union[int, Sequence[int], np.ndarray]) -> Union[float, np.ndarray]:
+        return self.score_at(idx)
+
+    def __len__(self) -> int:
+        return self.siglen
+
+    def to_dense(self) -> np.ndarray:
+        """ finished, NOT checked,
+
+        Returns
+        -------
+        mask: ndarray,
+            the signal-length scoring mask
+        """
+        return np.repeat(self.weights, np.diff(self.bounds))
+
+    def __repr__(self) -> str:
+        return f"{self.__name__}(siglen={self.siglen}, n_pieces={len(self.weights)})"
+
+    __str__ = __repr__
+
+
+def gen_endpoint_score_intervals(siglen:int,
+                                 critical_points:Sequence[int],
+                                 af_intervals:Sequence[Sequence[int]],
+                                 bias:dict={1:1, 2:0.5},
+                                 verbose:int=0) -> Tuple[EndpointScoreRange, EndpointScoreRange]:
+    """ finished, NOT checked,
+
+    generate the sparse scoring ranges for the onsets and offsets of af episodes,
+    in the form of piecewise-constant intervals with weights
 
     Parameters
     ----------
@@ -294,16 +416,12 @@ def gen_endpoint_score_mask(siglen:int,
 
     Returns
     -------
-    (onset_score_mask, offset_score_mask): 2-tuple of ndarray,
-        scoring mask for the onset and offsets predictions of af episodes
+    (onset_score_range, offset_score_range): 2-tuple of EndpointScoreRange,
+        sparse scoring ranges for the onset and offsets predictions of af episodes
 
     NOTE
     ----
-    1. the onsets in `af_intervals` are 0.15s ahead of the corresponding R peaks,
-    while the offsets in `af_intervals` are 0.15s behind the corresponding R peaks.
-    2. for records [data_39_4,data_48_4,data_68_23,data_98_5,data_101_5,data_101_7,data_101_8,data_104_25,data_104_27],
-    the official `RefInfo._gen_endpoint_score_range` slightly expands the scoring intervals at heads or tails of the records,
-    which strictly is incorrect as defined in the `Scoring` section of the official webpage (http://www.icbeb.org/CPSC2021)
+    ref. the NOTE of `gen_endpoint_score_mask`
     """
     _critical_points = list(critical_points)
     if 0 not in _critical_points:
@@ -325,27 +443,85 @@ def gen_endpoint_score_mask(siglen:int,
         _critical_points.append(siglen)
         if verbose >= 2:
             print(f"siglen (={siglen}) appended to _critical_points, len(_critical_points): {len(_critical_points)-1} ==> {len(_critical_points)}")
-    onset_score_mask, offset_score_mask = np.zeros((siglen,)), np.zeros((siglen,))
+    _critical_points = np.array(_critical_points, dtype=int)
+    n_cp = len(_critical_points)
+    _af_intervals = np.array(_af_intervals, dtype=int).reshape((-1, 2))
+    onset_itv, offset_itv = [[], [], []], [[], [], []]
     for b, v in bias.items():
-        mask_onset, mask_offset = np.zeros((siglen,)), np.zeros((siglen,))
-        for itv in _af_intervals:
-            onset_start = _critical_points[max(0, itv[0]-b)]
-            # note that the onsets and offsets in `_af_intervals` already occupy positions in `_critical_points`
-            onset_end = _critical_points[min(itv[0]+1+b, len(_critical_points)-1)]
-            if verbose > 0:
-                print(f"custom --- onset (c_ind, score {v}): {max(0, itv[0]-b)} --- {min(itv[0]+1+b, len(_critical_points)-1)}")
-                print(f"custom --- onset (sample, score {v}): {_critical_points[max(0, itv[0]-b)]} --- {_critical_points[min(itv[0]+1+b, len(_critical_points)-1)]}")
-            mask_onset[onset_start: onset_end] = v
-            # note that the onsets and offsets in `af_intervals` already occupy positions in `_critical_points`
-            offset_start = _critical_points[max(0, itv[1]-1-b)]
-            offset_end = _critical_points[min(itv[1]+b, len(_critical_points)-1)]
-            if verbose > 0:
-                print(f"custom --- offset (c_ind, score {v}): {max(0, itv[1]-1-b)} --- {min(itv[1]+b, len(_critical_points)-1)}")
-                print(f"custom --- offset (sample, score {v}): {_critical_points[max(0, itv[1]-1-b)]} --- {_critical_points[min(itv[1]+b, len(_critical_points)-1)]}")
-            mask_offset[offset_start: offset_end] = v
-        onset_score_mask = np.maximum(onset_score_mask, mask_onset)
-        offset_score_mask = np.maximum(offset_score_mask, mask_offset)
-    return onset_score_mask, offset_score_mask
+        # note that the onsets and offsets in `_af_intervals` already occupy positions in `_critical_points`
+        onset_inds = [np.maximum(0, _af_intervals[:,0]-b), np.minimum(_af_intervals[:,0]+1+b, n_cp-1)]
+        offset_inds = [np.maximum(0, _af_intervals[:,1]-1-b), np.minimum(_af_intervals[:,1]+b, n_cp-1)]
+        if verbose > 0:
+            for s, e in zip(*onset_inds):
+                print(f"custom --- onset (c_ind, score {v}): {s} --- {e}")
+                print(f"custom --- onset (sample, score {v}): {_critical_points[s]} --- {_critical_points[e]}")
+            for s, e in zip(*offset_inds):
+                print(f"custom --- offset (c_ind, score {v}): {s} --- {e}")
+                print(f"custom --- offset (sample, score {v}): {_critical_points[s]} --- {_critical_points[e]}")
+        for itv, inds in [(onset_itv, onset_inds), (offset_itv, offset_inds)]:
+            itv[0].append(_critical_points[inds[0]])
+            itv[1].append(_critical_points[inds[1]])
+            itv[2].append(np.full((len(_af_intervals),), v, dtype=float))
+    onset_score_range, offset_score_range = [
+        EndpointScoreRange.from_intervals(
+            siglen,
+            np.concatenate(itv[0]) if itv[0] else [],
+            np.concatenate(itv[1]) if itv[1] else [],
+            np.concatenate(itv[2]) if itv[2] else [],
+        ) for itv in [onset_itv, offset_itv]
+    ]
+    return onset_score_range, offset_score_range
+
+
+def gen_endpoint_score_mask(siglen:int,
+                            critical_points:Sequence[int],
+                            af_intervals:Sequence[Sequence[int]],
+                            bias:dict={1:1, 2:0.5},
+                            verbose:int=0) -> Tuple[np.ndarray, np.ndarray]:
+    """ finished, checked,
+
+    generate the scoring mask for the onsets and offsets of af episodes,
+
+    Parameters
+    ----------
+    siglen: int,
+        length of the signal
+    critical_points: sequence of int,
+        locations (indices in the signal) of the critical points,
+        including R peaks, rhythm annotations, etc,
+        which are stored in the `sample` fields of an wfdb annotation file
+        (corr. beat ann, rhythm ann are in the `symbol`, `aux_note` fields)
+    af_intervals: sequence of intervals,
+        intervals of the af episodes in terms of indices in `critical_points`
+    bias: dict, default {1:1, 2:0.5},
+        keys are bias (with ±) in terms of number of rpeaks
+        values are corresponding scores
+    verbose: int, default 0,
+        log verbosity
+
+    Returns
+    -------
+    (onset_score_mask, offset_score_mask): 2-tuple of ndarray,
+        scoring mask for the onset and offsets predictions of af episodes
+
+    NOTE
+    ----
+    1. the onsets in `af_intervals` are 0.15s ahead of the corresponding R peaks,
+    while the offsets in `af_intervals` are 0.15s behind the corresponding R peaks.
+    2. for records [data_39_4,data_48_4,data_68_23,data_98_5,data_101_5,data_101_7,data_101_8,data_104_25,data_104_27],
+    the official `RefInfo._gen_endpoint_score_range` slightly expands the scoring intervals at heads or tails of the records,
+    which strictly is incorrect as defined in the `Scoring` section of the official webpage (http://www.icbeb.org/CPSC2021)
+    3. the masks are the dense form of the sparse ranges from `gen_endpoint_score_intervals`,
+    which should be preferred when only scores at predicted endpoints are needed
+    """
+    onset_score_range, offset_score_range = gen_endpoint_score_intervals(
+        siglen=siglen,
+        critical_points=critical_points,
+        af_intervals=af_intervals,
+        bias=bias,
+        verbose=verbose,
+    )
+    return onset_score_range.to_dense(), offset_score_range.to_dense()
 
 
 gen_endpoint_score_range = gen_endpoint_score_mask  # alias
@@ -32,7 +32,7 @@ import wfdb
 from .scoring_metrics import (
     RefInfo, load_ans,
     score, ue_calculate, ur_calculate,
-    compute_challenge_metric, gen_endpoint_score_mask,
+    compute_challenge_metric, gen_endpoint_score_mask, gen_endpoint_score_intervals,
 )
 from cfg import BaseCfg
 from sample_data import extract_sample_data_if_needed
@@ -139,6 +139,7 @@ def run_single_test(rec:str, classes:Optional[List[str]]=None, verbose:bool=Fals
     -------
     masks_agree: bool,
         True if official and custom onset and offset scoring masks agree,
+        and the challenge metrics computed via the official masks and via the (custom) sparse scoring ranges agree,
         otherwise False
     """
     header = wfdb.rdheader(rec)
@@ -176,9 +177,40 @@ def run_single_test(rec:str, classes:Optional[List[str]]=None, verbose:bool=Fals
     print(f"offset masks agree: {offsets}")
     if not offsets:
         print(f"{np.where(official_offset_scoring_mask!=custom_offset_scoring_mask)[0]}")
+
+    # the challenge metric via the sparse scoring ranges, with the official masks being the reference
+    scores = True
+    if official_ref_info.class_true in [1, 2]:
+        custom_onset_score_range, custom_offset_score_range = gen_endpoint_score_intervals(
+            siglen=header.sig_len,
+            critical_points=ann.sample,
+            af_intervals=_load_af_episodes(rec, fmt="c_intervals"),
+        )
+        endpoints_true = _load_af_episodes(rec, fmt="intervals")
+        rng = np.random.default_rng(0)
+        # the true endpoints, and endpoints perturbed by up to about 2 beats
+        for jitter in [0, 100, 400]:
+            endpoints_pred = np.clip(
+                np.array(endpoints_true) + rng.integers(-jitter, jitter+1, size=np.shape(endpoints_true)),
+                0, header.sig_len-1,
+            )
+            official_score = compute_challenge_metric(
+                official_ref_info.class_true, official_ref_info.class_true,
+                endpoints_true, endpoints_pred,
+                official_onset_scoring_mask, official_offset_scoring_mask,
+            )
+            custom_score = compute_challenge_metric(
+                official_ref_info.class_true, official_ref_info.class_true,
+                endpoints_true, endpoints_pred,
+                custom_onset_score_range, custom_offset_score_range,
+            )
+            if not np.isclose(official_score, custom_score):
+                print(f"jitter {jitter}: official score {official_score}, custom score (sparse) {custom_score}")
+                scores = False
+        print(f"challenge metrics (via sparse scoring ranges) agree: {scores}")
     print("\n"+f"  {os.path.basename(rec)} finishes ".center(30, "-")+"\n")
 
-    masks_agree = onsets and offsets
+    masks_agree = onsets and offsets and scores
     return masks_agree
 
 
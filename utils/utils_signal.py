@@ -3,6 +3,7 @@ utilities for signal processing,
 including spatial, temporal, spatio-temporal domains
 """
 import os
+import math
 from copy import deepcopy
 from typing import Union, Optional, List, Tuple, Sequence, Iterable, NoReturn
 from numbers import Real
@@ -23,6 +24,7 @@ __all__ = [
     "ensure_lead_fmt", "ensure_siglen",
     "get_ampl",
     "normalize",
+    "minmax_envelope",
 ]
 
 
@@ -876,3 +878,35 @@ def normalize(sig:np.ndarray,
     else:
         nm_sig = (sig - _mean) / _std
     return nm_sig
+
+
+def minmax_envelope(sig:np.ndarray, bin_size:int) -> Tuple[np.ndarray, np.ndarray]:
+    """ finished, NOT checked,
+
+    compute the min/max envelopes of `sig` along the last axis,
+    over consecutive bins of `bin_size` samples,
+    typically used for rendering long signals with one bin per pixel column
+
+    Parameters
+    ----------
+    sig: ndarray,
+        the signal, with the last axis being the time axis
+    bin_size: int,
+        number of samples in each bin
+
+    Returns
+    -------
+    (env_min, env_max): 2-tuple of ndarray,
+        the min and max envelopes, of shape (..., ceil(siglen / bin_size)),
+        the last (incomplete) bin is padded with the last sample of `sig`
+    """
+    siglen = sig.shape[-1]
+    n_bins = math.ceil(siglen / bin_size)
+    pad_len = n_bins * bin_size - siglen
+    if pad_len > 0:
+        _sig = np.concatenate([sig, np.repeat(sig[..., -1:], pad_len, axis=-1)], axis=-1)
+    else:
+        _sig = sig
+    _sig = _sig.reshape(sig.shape[:-1] + (n_bins, bin_size))
+    env_min, env_max = _sig.min(axis=-1), _sig.max(axis=-1)
+    return env_min, env_max